@@ -0,0 +1,414 @@
+""" Asyncio Rotation Module """
+
+import asyncio
+import json
+import logging
+
+import aiohttp
+import kubernetes_asyncio
+
+import cobalt_purestorage.inventory as inventory
+import cobalt_purestorage.rotator as rotator
+from cobalt_purestorage.configuration import config
+from cobalt_purestorage.logging_utils import configure_logging, format_stacktrace
+from cobalt_purestorage.models import AccessKey, ObjectStoreUser
+from cobalt_purestorage.pure_storage import chunked, or_filter, quote_token
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
+
+class AsyncFlashBlade:
+    """Lightweight asyncio client for the FlashBlade object store REST API"""
+
+    def __init__(self, url=None, api_token=None, timeout=None, session=None):
+        self.url = url or config.fb_url
+        self.api_token = api_token or config.api_token
+        self.timeout = aiohttp.ClientTimeout(total=timeout or config.fb_timeout)
+        self.session = session
+        self._owns_session = session is None
+        self.api_version = None
+        self.auth_token = None
+
+    async def __aenter__(self):
+        await self.login()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    @property
+    def _ssl(self):
+        """The ssl argument to pass to aiohttp"""
+
+        return None if config.verify_fb_tls else False
+
+    async def login(self):
+        """Negotiate the REST API version and exchange the api token
+        for a session token
+        """
+
+        logger.debug("Instantiating async FlashBlade Client")
+
+        if self.session is None:
+            self.session = aiohttp.ClientSession(timeout=self.timeout)
+
+        try:
+            async with self.session.get(
+                f"https://{self.url}/api/api_version", ssl=self._ssl
+            ) as resp:
+                versions = (await resp.json())["versions"]
+
+            self.api_version = max(
+                (x for x in versions if x.startswith("2.")),
+                key=lambda v: tuple(int(p) for p in v.split(".")),
+            )
+
+            async with self.session.post(
+                f"https://{self.url}/api/login",
+                headers={"api-token": self.api_token},
+                ssl=self._ssl,
+            ) as resp:
+                if resp.status != 200:
+                    raise RuntimeError(f"login failed with status code {resp.status}")
+                self.auth_token = resp.headers["x-auth-token"]
+
+        except (aiohttp.ClientError, asyncio.TimeoutError, KeyError, ValueError):
+            logger.error(format_stacktrace())
+            raise RuntimeError("Could not instantiate async FlashBlade client")
+
+        logger.debug(
+            "Async FlashBlade Client instantiated OK, API %s", self.api_version
+        )
+
+    async def close(self):
+        """Close the underlying HTTP session"""
+
+        if self._owns_session and self.session is not None:
+            await self.session.close()
+
+    async def _request(self, method, endpoint, params=None, body=None):
+        """Call an API endpoint, returning the status code and decoded body"""
+
+        async with self.session.request(
+            method,
+            f"https://{self.url}/api/{self.api_version}/{endpoint}",
+            params=params,
+            json=body,
+            headers={"x-auth-token": self.auth_token},
+            ssl=self._ssl,
+        ) as resp:
+            raw = await resp.read()
+            return resp.status, json.loads(raw) if raw else {}
+
+    async def items(self, endpoint, params, model, limit=None):
+        """Given a listing endpoint, yield its items one at a time as the
+        given model, fetching a page of at most limit items, by default
+        FB_LIST_LIMIT, at a time and following the continuation token
+        """
+
+        params = {**params, "limit": limit or config.fb_list_limit}
+
+        while True:
+            status, data = await self._request("GET", endpoint, params=params)
+
+            if status != 200:
+                what = endpoint.replace("-", " ")
+                logger.error("Failed to fetch %s with status code %s", what, status)
+                raise RuntimeError(f"Could not fetch {what}")
+
+            for item in data["items"]:
+                yield model.from_dict(item)
+
+            if not (continuation_token := data.get("continuation_token")):
+                return
+
+            params = {**params, "continuation_token": quote_token(continuation_token)}
+
+    async def get_object_store_users_by_name(self, names):
+        """Given a list of Object Store User names,
+        return the set of names that exist on the FB array
+        """
+
+        existing = set()
+
+        for chunk in chunked(sorted(names), config.fb_filter_chunk_size):
+            params = {"filter": or_filter("name", chunk)}
+            async for user in self.items("object-store-users", params, ObjectStoreUser):
+                existing.add(user.name)
+
+        return existing
+
+    async def get_access_keys_for_users(self, names):
+        """Given a list of Object Store User names,
+        return a dict of user name to the keys associated with that user
+        """
+
+        keys = {name: [] for name in names}
+
+        for chunk in chunked(sorted(keys), config.fb_filter_chunk_size):
+            params = {"filter": or_filter("user.name", chunk)}
+            async for key in self.items("object-store-access-keys", params, AccessKey):
+                keys.setdefault(key.user_name, []).append(key)
+
+        return keys
+
+    async def post_object_store_access_keys(self, user_name):
+        """Create a new object store access key"""
+
+        status, data = await self._request(
+            "POST", "object-store-access-keys", body={"user": {"name": user_name}}
+        )
+
+        if status == 200:
+            return AccessKey.from_dict(data["items"][0])
+
+        logger.error("An error occured creating a key for user %s", user_name)
+        return None
+
+    async def delete_object_store_access_keys(self, key_names):
+        """Given a list of key names, delete them"""
+
+        status, _ = await self._request(
+            "DELETE", "object-store-access-keys", params={"names": ",".join(key_names)}
+        )
+
+        if status == 200:
+            return True
+
+        logger.error("An error occured deleting keys %s", key_names)
+        return False
+
+
+class AsyncK8S:
+    """Service class for the asyncio kubernetes client"""
+
+    def __init__(self):
+        self.api_client = None
+        self.v1 = None
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def connect(self):
+        """Create the kubernetes client"""
+
+        logger.debug("Instantiating async Kubernetes Client")
+
+        if config.kubeconfig:
+            await kubernetes_asyncio.config.load_kube_config(
+                config_file=config.kubeconfig
+            )
+        else:
+            try:
+                kubernetes_asyncio.config.load_incluster_config()
+
+            except kubernetes_asyncio.config.config_exception.ConfigException as err:
+                logger.error(format_stacktrace())
+                raise RuntimeError(err)
+
+        self.api_client = kubernetes_asyncio.client.ApiClient()
+        self.v1 = kubernetes_asyncio.client.CoreV1Api(self.api_client)
+
+    async def close(self):
+        """Close the underlying HTTP session"""
+
+        if self.api_client is not None:
+            await self.api_client.close()
+
+    async def update_secret(self, namespace, secret_name, secret_key, secret_body):
+        """update a pre-existing secret"""
+
+        await self.update_secret_data(namespace, secret_name, {secret_key: secret_body})
+
+    async def update_secret_data(self, namespace, secret_name, data):
+        """update many keys of a pre-existing secret with a single patch"""
+
+        body = {"data": data}
+
+        try:
+            await self.v1.patch_namespaced_secret(secret_name, namespace, body)
+            logger.info(
+                "Patched secret: Namespace: %s Secret: %s Keys: %s",
+                namespace,
+                secret_name,
+                len(data),
+            )
+
+        except kubernetes_asyncio.client.exceptions.ApiException as err:
+            if err.status == 404:
+                logger.error("specified secret does not exist")
+                raise ValueError("secret does not exist")
+
+            logger.error(format_stacktrace())
+            raise RuntimeError("error updating k8s secret")
+
+
+async def update_credentials_async(batch, refreshed_credentials, user_name):
+    """Select the update method.  In k8s mode the credentials are staged
+    in the batch, to be written to the user's target secret by
+    flush_async once the users are rotated.
+    """
+
+    if batch is not None:
+        batch.add(refreshed_credentials, user_name)
+
+    else:
+        await asyncio.to_thread(rotator.update_local, refreshed_credentials, user_name)
+
+
+async def flush_async(k8s, batch):
+    """Patch every secret staged in the batch once.
+    Returns the users whose credentials could not be published.
+    """
+
+    failed = []
+    batches, users = batch.take()
+
+    for (namespace, secret_name), data in sorted(batches.items()):
+        try:
+            await k8s.update_secret_data(namespace, secret_name, data)
+            logger.info(
+                "Updated k8s. Users: %s",
+                ", ".join(sorted(users[(namespace, secret_name)])),
+            )
+
+        except (RuntimeError, ValueError):
+            logger.error(
+                "Failed to update secret: Namespace: %s Secret: %s",
+                namespace,
+                secret_name,
+            )
+            failed.extend(users[(namespace, secret_name)])
+
+    return failed
+
+
+async def create_and_publish_async(fb, batch, user_name):
+    """Create a new key for the user and publish the credentials.
+    Returns True if a key was created.
+    """
+
+    if credentials := await fb.post_object_store_access_keys(user_name):
+        logger.info("New key created. User: %s, Key: %s", user_name, credentials.name)
+        await update_credentials_async(
+            batch,
+            rotator.generate_aws_credentials(
+                credentials, *inventory.key_age(user_name)
+            ),
+            user_name,
+        )
+        return True
+
+    return False
+
+
+async def rotate_user_async(fb, batch, user_name, keys):
+    """Given a user and its prefetched keys, rotate the user's keys if required.
+    Applies the same rules as rotator.plan_user.
+    """
+
+    outcome, key_name = rotator.plan_user(user_name, keys)
+
+    if outcome not in (rotator.CREATED, rotator.ROTATED):
+        return outcome
+
+    if key_name:
+        # a key cannot be created while the user still has two
+        if not await fb.delete_object_store_access_keys([key_name]):
+            logger.error(
+                "Failed to delete oldest key. User: %s, Key: %s", user_name, key_name
+            )
+            return rotator.FAILED
+
+        logger.info("Oldest key deleted. User: %s, Key: %s", user_name, key_name)
+
+    created = await create_and_publish_async(fb, batch, user_name)
+    return outcome if created else rotator.FAILED
+
+
+async def _rotate(fb, k8s, user_names):
+    """Rotate the given users with already connected clients."""
+
+    existing = await fb.get_object_store_users_by_name(user_names)
+    keys = await fb.get_access_keys_for_users(existing) if existing else {}
+
+    outcomes = {x: rotator.INVALID for x in user_names if x not in existing}
+    for user_name in sorted(outcomes):
+        logger.error("User %s does not appear to be a valid user...", user_name)
+
+    # in k8s mode, users sharing a secret are published with one patch
+    batch = rotator.SecretBatch() if k8s is not None else None
+    semaphore = asyncio.Semaphore(config.async_rotation_concurrency)
+
+    async def worker(user_name):
+        async with semaphore:
+            try:
+                return await rotate_user_async(
+                    fb, batch, user_name, keys.get(user_name, [])
+                )
+
+            except Exception:
+                logger.error(format_stacktrace())
+                logger.error("Rotation failed. User: %s", user_name)
+                return rotator.FAILED
+
+    names = sorted(existing)
+    try:
+        results = await asyncio.gather(*(worker(x) for x in names))
+        outcomes.update(zip(names, results))
+
+    finally:
+        # publish whatever was created, even when the run is failing
+        if batch:
+            outcomes.update({x: rotator.FAILED for x in await flush_async(k8s, batch)})
+
+    summary = rotator.summarise(outcomes)
+    rotator.log_summary(summary)
+
+    return summary
+
+
+class _maybe:
+    """Async context manager yielding a caller supplied client as-is,
+    or creating, and closing, a new one
+    """
+
+    def __init__(self, client, factory):
+        self.client = client
+        self.factory = factory
+        self.owned = None
+
+    async def __aenter__(self):
+        if self.client is not None:
+            return self.client
+
+        self.owned = self.factory()
+        return await self.owned.__aenter__()
+
+    async def __aexit__(self, *exc):
+        if self.owned is not None:
+            await self.owned.__aexit__(*exc)
+
+
+async def rotate_users_async(user_names, fb=None, k8s=None):
+    """Rotate the given users without blocking the event loop.
+    Clients are created, and closed, when not supplied by the caller.
+    Returns the run summary.
+    """
+
+    user_names = set(user_names)
+    if not user_names:
+        logger.error("No Interesting Users are configured, exiting...")
+        return {}
+
+    async with _maybe(fb, AsyncFlashBlade) as fb_client:
+        if not config.k8s_mode:
+            return await _rotate(fb_client, None, user_names)
+
+        async with _maybe(k8s, AsyncK8S) as k8s_client:
+            return await _rotate(fb_client, k8s_client, user_names)
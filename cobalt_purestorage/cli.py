@@ -4,21 +4,163 @@ import logging
 
 import click
 
-import cobalt_purestorage.rotator as rotator
-import cobalt_purestorage.smoketest as smoketest
 from cobalt_purestorage.configuration import config
+from cobalt_purestorage.logging_utils import configure_logging
 
-logging.basicConfig(level=config.log_level)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 
-@click.command()
-def rotate_entrypoint():
-    logger.info("FlashBlade Credentials Rotator starting...")
-    rotator.main()
+@click.group(invoke_without_command=True)
+@click.pass_context
+def rotate_entrypoint(ctx):
+    if ctx.invoked_subcommand is None:
+        # modules are imported as they are needed to keep start up fast
+        from cobalt_purestorage import rotator
+
+        logger.info("FlashBlade Credentials Rotator starting...")
+        rotator.main()
+
+
+@rotate_entrypoint.command("plan")
+def plan_entrypoint():
+    from cobalt_purestorage import rotator
+
+    for line in rotator.dry_run():
+        click.echo(line)
+
+
+@rotate_entrypoint.command("shard")
+@click.option(
+    "--count",
+    type=click.IntRange(min=1),
+    default=None,
+    help="Number of shards, defaults to SHARD_COUNT.",
+)
+@click.argument("user_names", nargs=-1, required=True)
+def shard_entrypoint(count, user_names):
+    from cobalt_purestorage import sharding
+
+    count = count or config.shard_count
+    for user_name in user_names:
+        click.echo(
+            f"{user_name}: shard {sharding.shard_of(user_name, count)} of {count}"
+        )
+
+
+@rotate_entrypoint.command("daemon")
+def daemon_entrypoint():
+    from cobalt_purestorage import daemon
+
+    logger.info("FlashBlade Credentials Rotator daemon starting...")
+    daemon.run()
 
 
 @click.command()
-def smoketest_entrypoint():
+@click.option(
+    "--write-baseline",
+    type=click.Path(dir_okay=False),
+    help="Write the timings to this file as a new baseline instead of comparing.",
+)
+def smoketest_entrypoint(write_baseline):
+    from cobalt_purestorage import smoketest
+
     logger.info("Starting smoketest...")
-    smoketest.main()
+    smoketest.main(write_baseline)
+
+
+@click.command()
+@click.option(
+    "--host", default="127.0.0.1", show_default=True, help="Address to listen on."
+)
+@click.option("--port", default=8443, show_default=True, help="Port to listen on.")
+@click.option("--api-token", default=None, help="Only accept this API token.")
+@click.option(
+    "--users", default=1000, show_default=True, help="Number of simulated users."
+)
+@click.option(
+    "--user-prefix",
+    default="simulator/user",
+    show_default=True,
+    help="Prefix of the simulated user names.",
+)
+@click.option(
+    "--key-age",
+    type=float,
+    multiple=True,
+    help="Age in seconds of a key each user starts with, may be repeated.",
+)
+@click.option(
+    "--latency",
+    default=0.0,
+    show_default=True,
+    help="Mean response time of each API call, in milliseconds.",
+)
+@click.option(
+    "--latency-spread",
+    default=0.0,
+    show_default=True,
+    help="Half width of a uniform, or standard deviation of a lognormal, "
+    "response time, in milliseconds.",
+)
+@click.option(
+    "--latency-distribution",
+    type=click.Choice(["fixed", "uniform", "exponential", "lognormal"]),
+    default="fixed",
+    show_default=True,
+)
+@click.option(
+    "--error-rate",
+    default=0.0,
+    show_default=True,
+    help="Fraction of API calls that fail.",
+)
+@click.option(
+    "--error-status",
+    default=503,
+    show_default=True,
+    help="Status code of the failed API calls.",
+)
+@click.option(
+    "--rate-limit",
+    default=0,
+    show_default=True,
+    help="API calls allowed a second before throttling, 0 to disable.",
+)
+@click.option(
+    "--page-size",
+    default=1000,
+    show_default=True,
+    help="Maximum items returned in a page.",
+)
+def simulator_entrypoint(
+    host,
+    port,
+    api_token,
+    users,
+    user_prefix,
+    key_age,
+    latency,
+    latency_spread,
+    latency_distribution,
+    error_rate,
+    error_status,
+    rate_limit,
+    page_size,
+):
+    from cobalt_purestorage import simulator
+
+    fb = simulator.FlashBladeSimulator(
+        api_token=api_token,
+        latency=simulator.Latency(
+            latency_distribution, latency / 1000, latency_spread / 1000
+        ),
+        error_rate=error_rate,
+        error_status=error_status,
+        rate_limit=rate_limit,
+        max_page_size=page_size,
+    )
+    fb.populate(users, user_prefix, key_age)
+
+    logger.info("Simulating %s users", users)
+    simulator.main(host, port, fb)
@@ -1,7 +1,32 @@
 """ Config Module """
 
-import yaml
-from pydantic import BaseSettings, Field, validator
+from pydantic import BaseModel, BaseSettings, Field, validator
+
+
+class SecretTarget(BaseModel):
+    """The k8s secret a user's credentials are written to.
+    Unset fields fall back to K8S_NAMESPACE, K8S_SECRET_NAME and K8S_SECRET_KEY.
+    """
+
+    namespace: str = None
+    secret: str = None
+    key: str = None
+
+
+class FlashBladeArray(BaseModel):
+    """A FlashBlade array and the users rotated on it.
+    Unset fields fall back to FB_TIMEOUT and INTERESTING_USERS.
+    """
+
+    url: str
+    api_token: str
+    name: str = None
+    timeout: float = None
+    interesting_users: set[str] = set()
+
+    @validator("name", always=True)
+    def default_name(cls, v, values):
+        return v or values.get("url")
 
 
 class Settings(BaseSettings):
@@ -11,6 +36,10 @@ class Settings(BaseSettings):
         "INFO", env="LOG_LEVEL", description="Set python logging level"
     )
 
+    log_format: str = Field(
+        "text", env="LOG_FORMAT", description="Log as plain text or json"
+    )
+
     fb_url: str = Field(
         None,
         env="FB_URL",
@@ -21,6 +50,54 @@ class Settings(BaseSettings):
         15, env="FB_TIMEOUT", description="PureStorage connection timeout"
     )
 
+    fb_connect_timeout: float = Field(
+        None,
+        env="FB_CONNECT_TIMEOUT",
+        description="PureStorage connect timeout, defaults to FB_TIMEOUT",
+    )
+
+    fb_read_timeout: float = Field(
+        None,
+        env="FB_READ_TIMEOUT",
+        description="PureStorage read timeout, defaults to FB_TIMEOUT",
+    )
+
+    fb_pool_size: int = Field(
+        None,
+        env="FB_POOL_SIZE",
+        description="Number of keep-alive connections to the PureStorage array, defaults to ROTATION_CONCURRENCY",
+    )
+
+    fb_retry_attempts: int = Field(
+        3,
+        env="FB_RETRY_ATTEMPTS",
+        description="Maximum attempts for a PureStorage call that failed transiently",
+    )
+
+    fb_retry_base_delay: float = Field(
+        0.5,
+        env="FB_RETRY_BASE_DELAY",
+        description="Base delay in seconds for exponential backoff between PureStorage retries",
+    )
+
+    fb_retry_max_delay: float = Field(
+        10,
+        env="FB_RETRY_MAX_DELAY",
+        description="Maximum delay in seconds between PureStorage retries",
+    )
+
+    fb_circuit_failure_threshold: int = Field(
+        5,
+        env="FB_CIRCUIT_FAILURE_THRESHOLD",
+        description="Consecutive PureStorage failures before the circuit breaker opens",
+    )
+
+    fb_circuit_reset_timeout: float = Field(
+        30,
+        env="FB_CIRCUIT_RESET_TIMEOUT",
+        description="Seconds the circuit breaker stays open before a trial call",
+    )
+
     verify_fb_tls: bool = Field(
         False,
         env="VERIFY_FB_TLS",
@@ -29,12 +106,84 @@ class Settings(BaseSettings):
 
     api_token: str = Field(None, env="API_TOKEN", description="PureStorage api token")
 
+    fb_arrays: list[FlashBladeArray] = Field(
+        [],
+        env="FB_ARRAYS",
+        description="Arrays to rotate concurrently, each with its own url, api token, timeout and users, instead of FB_URL",
+    )
+
+    fb_filter_chunk_size: int = Field(
+        50,
+        env="FB_FILTER_CHUNK_SIZE",
+        description="Maximum number of names OR-combined into a single FlashBlade filter",
+    )
+
+    fb_list_limit: int = Field(
+        1000,
+        env="FB_LIST_LIMIT",
+        description="Maximum number of items a FlashBlade listing returns per page",
+    )
+
+    fb_delete_batch_size: int = Field(
+        50,
+        env="FB_DELETE_BATCH_SIZE",
+        description="Maximum number of access keys deleted with a single FlashBlade call",
+    )
+
     interesting_users: set[str] = Field(
         set(),
         env="INTERESTING_USERS",
         description="Object Store user names of interest",
     )
 
+    discover_users: list[str] = Field(
+        [],
+        env="DISCOVER_USERS",
+        description="Glob patterns of Object Store user names to discover on the array, such as account/*, instead of INTERESTING_USERS",
+    )
+
+    discover_exclude: list[str] = Field(
+        [],
+        env="DISCOVER_EXCLUDE",
+        description="Glob patterns of discovered user names not to rotate",
+    )
+
+    users_file: str = Field(
+        None,
+        env="USERS_FILE",
+        description="Path to a YAML or newline delimited JSON file of users and their options, instead of INTERESTING_USERS",
+    )
+
+    users_file_batch_size: int = Field(
+        1000,
+        env="USERS_FILE_BATCH_SIZE",
+        description="Number of users read from USERS_FILE and rotated at a time",
+    )
+
+    shard_count: int = Field(
+        1,
+        env="SHARD_COUNT",
+        description="Number of shards the users are partitioned into, for running several CronJobs or an indexed Job",
+    )
+
+    shard_index: int = Field(
+        0,
+        env=["SHARD_INDEX", "JOB_COMPLETION_INDEX"],
+        description="The shard of users this process rotates, from 0, defaults to the indexed Job's completion index",
+    )
+
+    rotation_concurrency: int = Field(
+        1,
+        env="ROTATION_CONCURRENCY",
+        description="Number of users rotated concurrently",
+    )
+
+    async_rotation_concurrency: int = Field(
+        100,
+        env="ASYNC_ROTATION_CONCURRENCY",
+        description="Number of users in flight at once in the asyncio rotation engine",
+    )
+
     k8s_mode: bool = Field(
         False, env="K8S_MODE", description="Toggle k8s or local mode"
     )
@@ -71,14 +220,212 @@ class Settings(BaseSettings):
         None, env="K8S_SECRET_KEY", description="The key within the secret to update"
     )
 
+    user_secret_targets: dict[str, SecretTarget] = Field(
+        {},
+        env="USER_SECRET_TARGETS",
+        description="Per user mapping of Object Store user name to k8s namespace, secret and key",
+    )
+
+    k8s_prefetch_secrets: bool = Field(
+        True,
+        env="K8S_PREFETCH_SECRETS",
+        description="Check all target secrets exist with a single call at startup",
+    )
+
     kubeconfig: str = Field(
         None, env="KUBECONFIG", description="Path to kubeconfig file"
     )
 
+    lease_mode: bool = Field(
+        False,
+        env="LEASE_MODE",
+        description="Share the users between replicas by claiming batches of them with k8s Leases",
+    )
+
+    lease_namespace: str = Field(
+        None,
+        env="LEASE_NAMESPACE",
+        description="The k8s namespace the Leases are created in, defaults to K8S_NAMESPACE",
+    )
+
+    lease_prefix: str = Field(
+        "cobalt-rotation",
+        env="LEASE_PREFIX",
+        description="Prefix of the Lease names, one Lease per array and batch",
+    )
+
+    lease_batch_count: int = Field(
+        16,
+        env="LEASE_BATCH_COUNT",
+        description="Number of batches the users are split into, each claimed with a Lease",
+    )
+
+    lease_duration: int = Field(
+        300,
+        env="LEASE_DURATION",
+        description="Seconds a Lease is held without renewal, and a completed batch is left unclaimed",
+    )
+
+    lease_holder: str = Field(
+        None,
+        env="LEASE_HOLDER",
+        description="Identity Leases are held under, defaults to the host name and process id",
+    )
+
+    daemon_max_sleep: int = Field(
+        900,
+        env="DAEMON_MAX_SLEEP",
+        description="Maximum seconds the daemon sleeps between passes",
+    )
+
+    daemon_retry_interval: int = Field(
+        300,
+        env="DAEMON_RETRY_INTERVAL",
+        description="Seconds before the daemon retries a user that failed or is invalid",
+    )
+
+    daemon_health_port: int = Field(
+        8080,
+        env="DAEMON_HEALTH_PORT",
+        description="Port the daemon serves its liveness probe on",
+    )
+
+    daemon_liveness_timeout: int = Field(
+        1800,
+        env="DAEMON_LIVENESS_TIMEOUT",
+        description="Seconds without a daemon pass before the liveness probe fails",
+    )
+
+    state_file: str = Field(
+        None,
+        env="STATE_FILE",
+        description="Path to a file recording each user's newest key, so users that cannot be due are not looked up",
+    )
+
+    state_max_age: int = Field(
+        86400,
+        env="STATE_MAX_AGE",
+        description="Seconds before a user recorded in STATE_FILE is looked up on the array again",
+    )
+
+    metrics_textfile: str = Field(
+        None,
+        env="METRICS_TEXTFILE",
+        description="Path to write Prometheus metrics to at the end of a run, for the node exporter textfile collector",
+    )
+
+    metrics_pushgateway: str = Field(
+        None,
+        env="METRICS_PUSHGATEWAY",
+        description="Address of a Prometheus Pushgateway to push metrics to at the end of a run",
+    )
+
+    metrics_job: str = Field(
+        "cobalt-purestorage",
+        env="METRICS_JOB",
+        description="Job name metrics are pushed to the Pushgateway under",
+    )
+
+    tracing_exporter: str = Field(
+        None,
+        env="TRACING_EXPORTER",
+        description="Export trace spans with otlp or to a jsonl file, unset disables tracing",
+    )
+
+    tracing_file: str = Field(
+        "traces.jsonl",
+        env="TRACING_FILE",
+        description="Path spans are appended to by the jsonl exporter",
+    )
+
+    tracing_service_name: str = Field(
+        "cobalt-purestorage",
+        env="TRACING_SERVICE_NAME",
+        description="Service name spans are exported under by the otlp exporter",
+    )
+
+    smoketest_threshold: float = Field(
+        3.0,
+        env="SMOKETEST_THRESHOLD",
+        description="Factor a smoketest timing may exceed its baseline by before failing",
+    )
+
+    smoketest_repeat: int = Field(
+        5,
+        env="SMOKETEST_REPEAT",
+        description="Number of times each smoketest timing is repeated, the best is kept",
+    )
+
+    smoketest_baseline: str = Field(
+        None,
+        env="SMOKETEST_BASELINE",
+        description="Path to the smoketest baseline timings, defaults to the packaged baseline",
+    )
+
     @validator("log_level")
     def uppercase_logging_level(cls, v):
         return v.upper()
 
+    @validator("log_format")
+    def known_log_format(cls, v):
+        if v not in ("text", "json"):
+            raise ValueError("must be text or json")
+        return v
+
+    @validator("shard_count")
+    def positive_shard_count(cls, v):
+        if v < 1:
+            raise ValueError("must be at least 1")
+        return v
+
+    @validator("shard_index")
+    def shard_index_in_range(cls, v, values):
+        if not 0 <= v < values.get("shard_count", 1):
+            raise ValueError("must be at least 0 and less than SHARD_COUNT")
+        return v
+
+    @validator("users_file_batch_size")
+    def positive_users_batch_size(cls, v):
+        if v < 1:
+            raise ValueError("must be at least 1")
+        return v
+
+    @validator("lease_batch_count")
+    def positive_batch_count(cls, v):
+        if v < 1:
+            raise ValueError("must be at least 1")
+        return v
+
+    @validator("rotation_concurrency")
+    def positive_concurrency(cls, v):
+        if v < 1:
+            raise ValueError("must be at least 1")
+        return v
+
+    @validator(
+        "fb_filter_chunk_size",
+        "fb_delete_batch_size",
+        "fb_list_limit",
+        "async_rotation_concurrency",
+    )
+    def positive_limits(cls, v):
+        if v < 1:
+            raise ValueError("must be at least 1")
+        return v
+
+    @validator("fb_arrays")
+    def unique_array_names(cls, v):
+        names = [x.name for x in v]
+        if len(names) != len(set(names)):
+            raise ValueError("array names must be unique")
+        return v
+
+    @validator("tracing_exporter")
+    def known_exporter(cls, v):
+        if v and v not in ("otlp", "jsonl"):
+            raise ValueError("must be otlp or jsonl")
+        return v
+
     class Config:
         case_sensitive = True
 
@@ -0,0 +1,234 @@
+""" Daemon Module """
+
+import json
+import logging
+import signal
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import cobalt_purestorage.rotator as rotator
+from cobalt_purestorage import inventory, metrics
+from cobalt_purestorage.configuration import config
+from cobalt_purestorage.logging_utils import configure_logging, format_stacktrace
+from cobalt_purestorage.pure_storage import PureStorageFlashBlade
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
+
+def next_due(user_name, outcome, keys, now, newest_key=None):
+    """Given a user's rotation outcome and the keys it was decided from,
+    or the epoch time of its newest key when STATE_FILE showed it not
+    due, return the epoch time the user is next eligible for rotation.
+    """
+
+    min_age, variance = inventory.key_age(user_name)
+    min_allowable_age = min_age - variance
+
+    # a new key was created just now
+    if outcome in (rotator.CREATED, rotator.ROTATED):
+        return now + min_allowable_age
+
+    if outcome == rotator.SKIPPED and keys:
+        newest_key = max(x.created for x in keys) / 1000
+
+    # the newest key becomes old enough first
+    if outcome == rotator.SKIPPED and newest_key is not None:
+        return newest_key + min_allowable_age
+
+    # invalid, failed and misconfigured users are retried later
+    return now + config.daemon_retry_interval
+
+
+class Schedule:
+    """Tracks when each user is next due for rotation"""
+
+    def __init__(self, user_names, now):
+        self.due = {x: now for x in user_names}
+
+    def due_users(self, now):
+        """Return the users due at or before now"""
+
+        return sorted(x for x, due in self.due.items() if due <= now)
+
+    def update(self, outcomes, keys, now, not_due=None):
+        """Record the next due time of each rotated user, given a dict of
+        user name to the keys the outcome was decided from.  not_due is a
+        dict of user name to the epoch time of the newest key of each user
+        that was not looked up.
+        """
+
+        not_due = not_due or {}
+
+        for user_name, outcome in outcomes.items():
+            self.due[user_name] = next_due(
+                user_name,
+                outcome,
+                keys.get(user_name, []),
+                now,
+                not_due.get(user_name),
+            )
+
+    def postpone(self, user_names, now):
+        """Retry the given users after the retry interval"""
+
+        for user_name in user_names:
+            self.due[user_name] = now + config.daemon_retry_interval
+
+    def seconds_until_next(self, now):
+        """Return how long to sleep before the earliest due user,
+        capped at DAEMON_MAX_SLEEP
+        """
+
+        earliest = min(self.due.values(), default=now + config.daemon_max_sleep)
+
+        return max(0, min(earliest - now, config.daemon_max_sleep))
+
+
+class Heartbeat:
+    """Records the daemon loop's progress for the liveness probe"""
+
+    def __init__(self):
+        self.last_beat = time.monotonic()
+
+    def beat(self):
+        self.last_beat = time.monotonic()
+
+    def alive(self):
+        return time.monotonic() - self.last_beat < config.daemon_liveness_timeout
+
+
+class HealthHandler(BaseHTTPRequestHandler):
+    """Serves the liveness probe.  Extra routes can be added to
+    routes, mapping a path to a function returning
+    (status, content type, body).
+    """
+
+    routes = {}
+
+    def do_GET(self):
+        route = self.routes.get(self.path.split("?")[0])
+
+        if route is None:
+            self.send_error(404)
+            return
+
+        status, content_type, body = route()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+def start_health_server(heartbeat, port):
+    """Serve /healthz and /metrics on the given port from a background thread"""
+
+    def healthz():
+        alive = heartbeat.alive()
+        body = json.dumps({"alive": alive}).encode("utf-8")
+        return (200 if alive else 503), "application/json", body
+
+    routes = {"/healthz": healthz, "/metrics": metrics.exposition}
+    handler = type("Handler", (HealthHandler,), {"routes": routes})
+    server = ThreadingHTTPServer(("", port), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    logger.info("Liveness probe and metrics listening on port %s", port)
+
+    return server
+
+
+def run_once(fb, schedule, now):
+    """Rotate the users that are due and reschedule them"""
+
+    if not (user_names := schedule.due_users(now)):
+        return
+
+    logger.info("%s users due for rotation", len(user_names))
+
+    try:
+        outcomes, keys, not_due = rotator.rotate_users(user_names, fb)
+
+    except Exception:
+        logger.error(format_stacktrace())
+        logger.error("Rotation pass failed, retrying later")
+        schedule.postpone(user_names, now)
+        return
+
+    rotator.log_summary(rotator.summarise(outcomes))
+    schedule.update(outcomes, keys, time.time(), not_due)
+
+
+def file_entries():
+    """Return every user of USERS_FILE owned by this process's shard,
+    or nothing if it is not set.  Raises RuntimeError for the user
+    sources daemon mode does not support.
+    """
+
+    if config.fb_arrays:
+        raise RuntimeError(
+            "Daemon mode does not support FB_ARRAYS, run a daemon per array with FB_URL"
+        )
+
+    if config.users_file:
+        return [
+            x for batch in inventory.owned_batches(config.users_file) for x in batch
+        ]
+
+    if config.discover_users:
+        raise RuntimeError(
+            "Daemon mode does not support DISCOVER_USERS, "
+            "list the users in INTERESTING_USERS or USERS_FILE"
+        )
+
+    return []
+
+
+def run(stop=None):
+    """Rotate users as they become due until stopped or sent SIGTERM.
+    Raises RuntimeError for the user sources daemon mode does not support.
+    """
+
+    # the schedule holds every user, so their options stay loaded
+    entries = file_entries()
+    if config.users_file:
+        user_names = [x.name for x in entries]
+    else:
+        user_names = rotator.configured_users()
+
+    if not user_names:
+        logger.error("No Interesting Users are configured, exiting...")
+        return
+
+    stop = stop or threading.Event()
+
+    if threading.current_thread() is threading.main_thread():
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *_: stop.set())
+
+    heartbeat = Heartbeat()
+    server = start_health_server(heartbeat, config.daemon_health_port)
+
+    try:
+        with inventory.loaded(entries):
+            # the clients are kept warm across passes
+            fb = PureStorageFlashBlade()
+            schedule = Schedule(user_names, time.time())
+
+            while not stop.is_set():
+                heartbeat.beat()
+                run_once(fb, schedule, time.time())
+
+                sleep = schedule.seconds_until_next(time.time())
+                logger.debug("Sleeping for %.0f seconds", sleep)
+                stop.wait(sleep)
+
+    finally:
+        logger.info("Shutting down")
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,58 @@
+""" User Discovery Module """
+
+import logging
+import re
+from fnmatch import fnmatchcase
+
+from cobalt_purestorage.configuration import config
+from cobalt_purestorage.logging_utils import configure_logging
+from cobalt_purestorage.sharding import owns
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
+
+def name_filter(pattern):
+    """Given a glob, return a FlashBlade filter for the names starting
+    with its literal prefix.  The array only understands the * wildcard,
+    so the rest of the glob is matched as the names are listed.
+    """
+
+    prefix = re.split(r"[*?\[]", pattern, maxsplit=1)[0]
+
+    if prefix == pattern:
+        return f'name="{pattern}"'
+
+    return f'name="{prefix}*"'
+
+
+def discover_users(fb, patterns=None, exclude=None):
+    """Yield the names of the users on the array that match any of the
+    patterns, by default DISCOVER_USERS, and none of the exclude patterns,
+    by default DISCOVER_EXCLUDE, a page at a time.  Only the users owned
+    by this process's shard are included, and each user only once.
+    """
+
+    patterns = config.discover_users if patterns is None else patterns
+    exclude = config.discover_exclude if exclude is None else exclude
+    count = 0
+
+    for index, pattern in enumerate(patterns):
+        # a user matching an earlier pattern was listed with it
+        earlier = patterns[:index]
+
+        for page in fb.list_object_store_users(name_filter(pattern)):
+            users = [
+                x
+                for x in page
+                if fnmatchcase(x, pattern)
+                and not any(fnmatchcase(x, y) for y in earlier)
+                and not any(fnmatchcase(x, y) for y in exclude)
+                and owns(x)
+            ]
+
+            if users:
+                count += len(users)
+                yield users
+
+    logger.info("Discovered %s users on %s", count, fb.name)
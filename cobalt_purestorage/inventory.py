@@ -0,0 +1,133 @@
+""" User Inventory Module """
+
+import json
+import logging
+import threading
+from contextlib import contextmanager
+
+import yaml
+from pydantic import BaseModel, ValidationError
+
+from cobalt_purestorage.configuration import SecretTarget, config
+from cobalt_purestorage.logging_utils import configure_logging
+from cobalt_purestorage.pure_storage import chunked
+from cobalt_purestorage.sharding import owns
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
+YAML_EXTENSIONS = (".yaml", ".yml")
+
+# the entries of the batches being rotated, with a count of the
+# batches each is loaded by, as arrays may rotate a user concurrently
+_entries = {}
+_entries_lock = threading.Lock()
+
+
+class UserEntry(BaseModel):
+    """A user read from USERS_FILE.
+    Unset fields fall back to USER_SECRET_TARGETS, ACCESS_KEY_MIN_AGE
+    and ACCESS_KEY_AGE_VARIANCE.
+    """
+
+    name: str
+    target: SecretTarget = None
+    access_key_min_age: int = None
+    access_key_age_variance: int = None
+
+
+def documents(f, path):
+    """Given an open users file, yield its documents one at a time"""
+
+    if path.endswith(YAML_EXTENSIONS):
+        yield from yaml.safe_load_all(f)
+        return
+
+    for line in f:
+        if line.strip():
+            yield json.loads(line)
+
+
+def read_users(path):
+    """Given the path of a YAML or newline delimited JSON file, yield its
+    users one at a time.  Each YAML document or JSON line is a user, a
+    user name or a list of them.  Raises ValueError for an invalid user.
+    """
+
+    count = 0
+
+    with open(path) as f:
+        for document in documents(f, path):
+            for item in document if isinstance(document, list) else [document]:
+                if item is None:
+                    continue
+
+                try:
+                    yield UserEntry.parse_obj(
+                        {"name": item} if isinstance(item, str) else item
+                    )
+
+                except ValidationError as err:
+                    raise ValueError(f"invalid user {count + 1} in {path}: {err}")
+
+                count += 1
+
+    logger.info("Read %s users from %s", count, path)
+
+
+def owned_batches(path, batch_size=None):
+    """Yield lists of at most USERS_FILE_BATCH_SIZE of the users in the
+    file that are owned by this process's shard
+    """
+
+    owned = (x for x in read_users(path) if owns(x.name))
+
+    yield from chunked(owned, batch_size or config.users_file_batch_size)
+
+
+@contextmanager
+def loaded(entries):
+    """Make the options of the given users visible to entry()
+    while the block runs
+    """
+
+    with _entries_lock:
+        for x in entries:
+            _entries.setdefault(x.name, [x, 0])[1] += 1
+
+    try:
+        yield
+
+    finally:
+        with _entries_lock:
+            for x in entries:
+                record = _entries[x.name]
+                record[1] -= 1
+                if not record[1]:
+                    del _entries[x.name]
+
+
+def entry(user_name):
+    """Return the loaded UserEntry of a user, or None"""
+
+    record = _entries.get(user_name)
+
+    return record[0] if record else None
+
+
+def key_age(user_name):
+    """Return the minimum key age and its variance for a user"""
+
+    user = entry(user_name)
+
+    if user is None:
+        return config.access_key_min_age, config.access_key_age_variance
+
+    return (
+        config.access_key_min_age
+        if user.access_key_min_age is None
+        else user.access_key_min_age,
+        config.access_key_age_variance
+        if user.access_key_age_variance is None
+        else user.access_key_age_variance,
+    )
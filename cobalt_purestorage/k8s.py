@@ -1,22 +1,86 @@
 """ Kubernetes Service Module """
 
+import json
 import logging
+import threading
+import time
 
 import kubernetes
 
+from cobalt_purestorage import metrics
 from cobalt_purestorage.configuration import config
-from cobalt_purestorage.logging_utils import format_stacktrace
+from cobalt_purestorage.logging_utils import configure_logging, format_stacktrace
 
-logging.basicConfig(level=config.log_level)
+configure_logging()
 logger = logging.getLogger(__name__)
 
+# ask the API server for metadata only when listing secrets
+METADATA_ONLY = "application/json;as=PartialObjectMetadataList;g=meta.k8s.io;v=v1"
+
+_k8s = None
+_k8s_lock = threading.Lock()
+
+
+def get_k8s():
+    """Return the process wide K8S service, creating it on first use.
+    Sharing one client keeps its connections to the API server alive
+    and avoids reloading the kube config for every update.
+    """
+
+    global _k8s
+
+    with _k8s_lock:
+        if _k8s is None:
+            _k8s = K8S()
+
+    return _k8s
+
+
+def log_k8s_stats():
+    """Log how long the shared K8S service took to create
+    and how many patches reused it
+    """
+
+    if _k8s is not None:
+        logger.info(
+            "Kubernetes client created once in %.3fs and reused for %s patches",
+            _k8s.init_seconds,
+            _k8s.patch_count,
+        )
+
+
+def clear_secret_cache():
+    """Forget the shared K8S service's cached secret existence checks,
+    so each rotation pass sees the secrets created or deleted since
+    """
+
+    if _k8s is not None:
+        _k8s.clear_secret_cache()
+
+
+def reset_k8s():
+    """Discard the process wide K8S service"""
+
+    global _k8s
+
+    with _k8s_lock:
+        _k8s = None
+
 
 class K8S:
     """Service class for the kubernetes client"""
 
     def __init__(self):
         logger.debug("Instantiating Kubernetes Client")
+        start = time.perf_counter()
         self.v1 = self._create_client(config.kubeconfig)
+        self.coordination = kubernetes.client.CoordinationV1Api(self.v1.api_client)
+        self.init_seconds = time.perf_counter() - start
+        self.patch_count = 0
+        self._patch_count_lock = threading.Lock()
+        self._secret_cache = {}
+        self._secret_cache_lock = threading.Lock()
+        logger.debug("Kubernetes Client instantiated in %.3fs", self.init_seconds)
 
     def _create_client(self, kubeconfig):
         """Create the kubernetes client"""
@@ -31,28 +95,106 @@ class K8S:
                 logger.error(format_stacktrace())
                 raise RuntimeError(err)
 
-        return kubernetes.client.CoreV1Api()
+        # size the connection pool so concurrent rotations reuse
+        # keep-alive connections rather than opening new ones
+        configuration = kubernetes.client.Configuration.get_default_copy()
+        configuration.connection_pool_maxsize = max(
+            configuration.connection_pool_maxsize, config.rotation_concurrency
+        )
+
+        return kubernetes.client.CoreV1Api(kubernetes.client.ApiClient(configuration))
+
+    def _timed(self, call):
+        """Time a kubernetes API call"""
+
+        return metrics.timed(metrics.K8S_REQUEST_SECONDS, metrics.K8S_REQUESTS, call)
 
     def _secret_exist(self, namespace, secret):
-        """Given a namespace and a secret name, check if the secret exists"""
+        """Given a namespace and a secret name, check if the secret exists.
+        Results are cached until clear_secret_cache, at the start of each
+        rotation pass.
+        """
+
+        with self._secret_cache_lock:
+            if (namespace, secret) in self._secret_cache:
+                return self._secret_cache[(namespace, secret)]
+
+        try:
+            with self._timed("read_namespaced_secret"):
+                resp = self.v1.read_namespaced_secret(
+                    secret, namespace, _preload_content=False
+                )
+            resp.release_conn()
+            exists = True
+
+        except kubernetes.client.exceptions.ApiException as err:
+            if err.status != 404:
+                logger.error(format_stacktrace())
+                raise RuntimeError("error reading k8s secret")
+            exists = False
+
+        with self._secret_cache_lock:
+            self._secret_cache[(namespace, secret)] = exists
+
+        return exists
+
+    def prefetch_secrets(self, namespace, secret_names):
+        """Given a namespace and secret names, check all of them exist
+        with a single metadata only list call and cache the results.
+        Returns the set of secret names that do not exist.
+        """
+
+        try:
+            with self._timed("list_namespaced_secret"):
+                resp = self.v1.api_client.call_api(
+                    "/api/v1/namespaces/{namespace}/secrets",
+                    "GET",
+                    path_params={"namespace": namespace},
+                    header_params={"Accept": METADATA_ONLY},
+                    auth_settings=["BearerToken"],
+                    _preload_content=False,
+                )[0]
+            existing = {x["metadata"]["name"] for x in json.loads(resp.data)["items"]}
+
+        except kubernetes.client.exceptions.ApiException as err:
+            logger.error(format_stacktrace())
+            raise RuntimeError("error listing k8s secrets")
+
+        with self._secret_cache_lock:
+            for name in secret_names:
+                self._secret_cache[(namespace, name)] = name in existing
 
-        resp = self.v1.list_namespaced_secret(namespace).to_dict()
-        secrets = [x["metadata"]["name"] for x in resp["items"]]
+        return set(secret_names) - existing
 
-        return secret in secrets
+    def clear_secret_cache(self):
+        """Forget cached secret existence checks"""
+
+        with self._secret_cache_lock:
+            self._secret_cache.clear()
 
     def update_secret(self, namespace, secret_name, secret_key, secret_body):
         """update a pre-existing secret"""
 
+        self.update_secret_data(namespace, secret_name, {secret_key: secret_body})
+
+    def update_secret_data(self, namespace, secret_name, data):
+        """update many keys of a pre-existing secret with a single patch"""
+
         secret_exists = self._secret_exist(namespace, secret_name)
 
         if secret_exists:
-            body = {"data": {secret_key: secret_body}}
+            body = {"data": data}
 
             try:
-                self.v1.patch_namespaced_secret(secret_name, namespace, body)
+                with self._timed("patch_namespaced_secret"):
+                    self.v1.patch_namespaced_secret(secret_name, namespace, body)
+                with self._patch_count_lock:
+                    self.patch_count += 1
                 logger.info(
-                    f"Patched secret: Namespace: {namespace} Secret: {secret_name}"
+                    "Patched secret: Namespace: %s Secret: %s Keys: %s",
+                    namespace,
+                    secret_name,
+                    len(data),
                 )
 
             except kubernetes.client.exceptions.ApiException as err:
@@ -62,3 +204,46 @@ class K8S:
         else:
             logger.error("specified secret does not exist")
             raise ValueError("secret does not exist")
+
+    def read_lease(self, namespace, name):
+        """Given a namespace and a lease name, return the lease,
+        or None if it does not exist
+        """
+
+        try:
+            with self._timed("read_namespaced_lease"):
+                return self.coordination.read_namespaced_lease(name, namespace)
+
+        except kubernetes.client.exceptions.ApiException as err:
+            if err.status != 404:
+                logger.error(format_stacktrace())
+                raise RuntimeError("error reading k8s lease")
+
+        return None
+
+    def write_lease(self, namespace, body, resource_version=None):
+        """Create a lease, or replace it if the resource version it was
+        read at is given.  Returns the resource version written, or None
+        if another writer created or changed the lease first.
+        """
+
+        name = body["metadata"]["name"]
+
+        try:
+            if resource_version is None:
+                with self._timed("create_namespaced_lease"):
+                    lease = self.coordination.create_namespaced_lease(namespace, body)
+            else:
+                body["metadata"]["resourceVersion"] = resource_version
+                with self._timed("replace_namespaced_lease"):
+                    lease = self.coordination.replace_namespaced_lease(
+                        name, namespace, body
+                    )
+
+        except kubernetes.client.exceptions.ApiException as err:
+            if err.status != 409:
+                logger.error(format_stacktrace())
+                raise RuntimeError("error writing k8s lease")
+            return None
+
+        return lease.metadata.resource_version
@@ -0,0 +1,288 @@
+""" Leases Module """
+
+import logging
+import os
+import re
+import socket
+import threading
+import time
+from datetime import datetime, timezone
+
+from cobalt_purestorage.configuration import config
+from cobalt_purestorage.k8s import get_k8s
+from cobalt_purestorage.logging_utils import configure_logging, format_stacktrace
+from cobalt_purestorage.sharding import shard_of
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
+# set on release, when the batch was rotated rather than abandoned
+COMPLETED_ANNOTATION = "cobalt-purestorage/completed"
+
+
+def holder_identity():
+    """Return the identity this process holds leases under"""
+
+    return config.lease_holder or f"{socket.gethostname()}-{os.getpid()}"
+
+
+def lease_scope(array, part=None):
+    """Return the scope of the leases of an array's batches.  Shards and
+    the parts of USERS_FILE hold different users, so lease apart.
+    """
+
+    scope = array
+
+    if config.shard_count > 1:
+        scope += f"-shard{config.shard_index}-of-{config.shard_count}"
+
+    if part is not None:
+        scope += f"-part{part}"
+
+    return scope
+
+
+def lease_name(array, index):
+    """Return the name of the lease of one of an array's batches,
+    a valid k8s object name
+    """
+
+    name = re.sub(r"[^a-z0-9]+", "-", f"{config.lease_prefix}-{array}".lower())
+
+    return f"{name.strip('-')[:240]}-{index}"
+
+
+def microtime(epoch):
+    """Format an epoch time as a k8s MicroTime"""
+
+    return datetime.fromtimestamp(epoch, timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def lease_body(name, holder, now, acquired, transitions, completed=None):
+    """Return the body of a lease, held by holder, or released if it is None"""
+
+    annotations = {COMPLETED_ANNOTATION: str(completed)} if completed else {}
+
+    return {
+        "apiVersion": "coordination.k8s.io/v1",
+        "kind": "Lease",
+        "metadata": {"name": name, "annotations": annotations},
+        "spec": {
+            "holderIdentity": holder,
+            "leaseDurationSeconds": config.lease_duration,
+            "acquireTime": microtime(acquired),
+            "renewTime": microtime(now),
+            "leaseTransitions": transitions,
+        },
+    }
+
+
+def is_free(lease, holder, now):
+    """Given a lease, return True if holder may claim it: it is released,
+    expired or already held by holder, and its batch was not completed
+    within LEASE_DURATION
+    """
+
+    spec = lease.spec
+    annotations = lease.metadata.annotations or {}
+
+    completed = annotations.get(COMPLETED_ANNOTATION)
+    if completed and now - float(completed) < config.lease_duration:
+        return False
+
+    if not spec.holder_identity or spec.holder_identity == holder:
+        return True
+
+    if spec.renew_time is None:
+        return True
+
+    duration = spec.lease_duration_seconds or config.lease_duration
+
+    return spec.renew_time.timestamp() + duration <= now
+
+
+class Claim:
+    """A lease held on a batch of users, renewed in the background
+    every third of LEASE_DURATION until it is released.  Work on the
+    batch should stop once the claim is no longer held.
+    """
+
+    def __init__(self, k8s, namespace, name, holder, resource_version, transitions):
+        self.k8s = k8s
+        self.namespace = namespace
+        self.name = name
+        self.holder = holder
+        self.resource_version = resource_version
+        self.transitions = transitions
+        self.acquired = time.time()
+        self.renewed = self.acquired
+        self.lost = False
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._renew_until_released, daemon=True)
+        self._thread.start()
+
+    def _renew_until_released(self):
+        while not self._stop.wait(config.lease_duration / 3):
+            try:
+                if not self.renew():
+                    return
+
+            except RuntimeError:
+                # the lease is still held until it expires, try again
+                logger.error(format_stacktrace())
+
+    def _write(self, holder, completed=None):
+        """Write the lease, returning False if it was lost to another replica"""
+
+        with self._lock:
+            if self.lost:
+                return False
+
+            body = lease_body(
+                self.name,
+                holder,
+                time.time(),
+                self.acquired,
+                self.transitions,
+                completed,
+            )
+            resource_version = self.k8s.write_lease(
+                self.namespace, body, self.resource_version
+            )
+
+            if resource_version is None:
+                self.lost = True
+                logger.warning("Lost lease %s to another replica", self.name)
+                return False
+
+            self.resource_version = resource_version
+            self.renewed = time.time()
+            return True
+
+    @property
+    def held(self):
+        """False once the lease was released or lost, or went unrenewed
+        for long enough that another replica may have taken it over
+        """
+
+        return (
+            not self._stop.is_set()
+            and not self.lost
+            and time.time() - self.renewed < config.lease_duration
+        )
+
+    def renew(self):
+        """Extend the lease, returning False if it was lost"""
+
+        return self._write(self.holder)
+
+    def release(self, completed):
+        """Stop renewing and release the lease, so another replica may
+        claim the batch at once, or once LEASE_DURATION has passed if the
+        batch was completed.  Failures are logged, the lease expires.
+        """
+
+        self._stop.set()
+        self._thread.join()
+
+        try:
+            self._write(None, time.time() if completed else None)
+
+        except RuntimeError:
+            logger.error(format_stacktrace())
+            logger.error("Could not release lease %s", self.name)
+
+
+def try_claim(k8s, namespace, name, holder):
+    """Claim the named lease, creating it if it does not exist.
+    Returns the Claim, or None if another replica holds the lease,
+    claimed it first or recently completed its batch.
+    """
+
+    now = time.time()
+    lease = k8s.read_lease(namespace, name)
+
+    if lease is None:
+        transitions = 0
+        resource_version = k8s.write_lease(
+            namespace, lease_body(name, holder, now, now, transitions)
+        )
+
+    elif is_free(lease, holder, now):
+        transitions = (lease.spec.lease_transitions or 0) + 1
+        resource_version = k8s.write_lease(
+            namespace,
+            lease_body(name, holder, now, now, transitions),
+            lease.metadata.resource_version,
+        )
+
+    else:
+        return None
+
+    if resource_version is None:
+        return None
+
+    return Claim(k8s, namespace, name, holder, resource_version, transitions)
+
+
+def batch_users(user_names, batch_count):
+    """Split users into at most batch_count batches by a stable hash,
+    so every replica agrees on the batches.  Returns a dict of batch
+    index to the batch's set of users, without empty batches.
+    """
+
+    batches = {}
+    for user_name in user_names:
+        batches.setdefault(shard_of(user_name, batch_count), set()).add(user_name)
+
+    return batches
+
+
+def claimed_batches(user_names, array):
+    """Yield the batches of the given users whose leases this replica
+    claims, for one array, each with its Claim.  Each lease is held while
+    the caller processes its batch, and released when the caller asks for
+    the next batch, so close the generator if processing stops early.
+    The caller should stop processing a batch whose claim is not held.
+    """
+
+    namespace = config.lease_namespace or config.k8s_namespace
+    if not namespace:
+        raise ValueError("LEASE_MODE needs LEASE_NAMESPACE or K8S_NAMESPACE")
+
+    k8s = get_k8s()
+    holder = holder_identity()
+    batches = batch_users(user_names, config.lease_batch_count)
+
+    # replicas start from different batches, so they rarely contend
+    order = sorted(batches)
+    if order:
+        start = shard_of(holder, len(order))
+        order = order[start:] + order[:start]
+
+    claimed = 0
+    for index in order:
+        name = lease_name(array, index)
+
+        if not (claim := try_claim(k8s, namespace, name, holder)):
+            logger.debug("Batch %s is held or recently completed: %s", index, name)
+            continue
+
+        claimed += 1
+        logger.info(
+            "Claimed batch %s with %s users. Lease: %s",
+            index,
+            len(batches[index]),
+            name,
+        )
+        completed = False
+
+        try:
+            yield batches[index], claim
+            completed = True
+
+        finally:
+            claim.release(completed)
+
+    logger.info("Claimed %s of %s batches as %s", claimed, len(batches), holder)
@@ -1,25 +1,158 @@
 """ Logging Utils Module """
 
 import json
+import logging
 import sys
 import traceback
 
+from cobalt_purestorage.configuration import config
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+REDACTED = "***"
+
+# field names are compared lower cased, without "-" or "_"
+SECRET_FIELDS = {
+    "apitoken",
+    "authorization",
+    "password",
+    "secretaccesskey",
+    "sessiontoken",
+    "xauthtoken",
+}
+
+# attributes every LogRecord has, anything else was passed as extra
+RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+def stacktrace(exc_info):
+    """Given an exc_info tuple, return the exception as a dict"""
+
+    exception_type, exception_value, exception_traceback = exc_info
+    traceback_string = traceback.format_exception(
+        exception_type, exception_value, exception_traceback
+    )
+
+    return {
+        "errorType": exception_type.__name__,
+        "errorMessage": str(exception_value),
+        "stackTrace": traceback_string,
+    }
+
 
 def format_stacktrace():
     """Format a stacktrace into a json structure
     to prevent multi-line error messages
     """
 
-    exception_type, exception_value, exception_traceback = sys.exc_info()
-    traceback_string = traceback.format_exception(
-        exception_type, exception_value, exception_traceback
+    err_msg = json.dumps(stacktrace(sys.exc_info()))
+
+    return err_msg
+
+
+def dumps(obj):
+    """Encode obj as a JSON string, with orjson when it is installed"""
+
+    if orjson:
+        return orjson.dumps(obj, default=str).decode("utf-8")
+
+    return json.dumps(obj, default=str, separators=(",", ":"))
+
+
+class Lazy:
+    """A log argument that is only computed if the record is emitted"""
+
+    __slots__ = ("func",)
+
+    def __init__(self, func):
+        self.func = func
+
+    def __str__(self):
+        return str(self.func())
+
+
+def is_secret(field):
+    """Given a field name, return True if its value is a secret"""
+
+    return (
+        isinstance(field, str)
+        and field.lower().replace("-", "").replace("_", "") in SECRET_FIELDS
     )
-    err_msg = json.dumps(
-        {
-            "errorType": exception_type.__name__,
-            "errorMessage": str(exception_value),
-            "stackTrace": traceback_string,
+
+
+def redact(value):
+    """Return value with the values of any secret fields
+    replaced, evaluating Lazy arguments
+    """
+
+    if isinstance(value, Lazy):
+        value = value.func()
+
+    if isinstance(value, dict):
+        return {k: REDACTED if is_secret(k) else redact(v) for k, v in value.items()}
+
+    if isinstance(value, list):
+        return [redact(x) for x in value]
+
+    if isinstance(value, tuple):
+        return tuple(redact(x) for x in value)
+
+    return value
+
+
+class RedactFilter(logging.Filter):
+    """Redacts secret fields from the arguments and extra fields
+    of the records a handler emits
+    """
+
+    def filter(self, record):
+        if record.args:
+            record.args = redact(record.args)
+
+        for field in set(vars(record)) - RECORD_ATTRIBUTES:
+            value = getattr(record, field)
+            setattr(record, field, REDACTED if is_secret(field) else redact(value))
+
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as a single line JSON object,
+    including any extra fields it was logged with
+    """
+
+    def format(self, record):
+        entry = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
         }
-    )
 
-    return err_msg
+        for field in set(vars(record)) - RECORD_ATTRIBUTES:
+            entry[field] = getattr(record, field)
+
+        if record.exc_info:
+            entry["exception"] = stacktrace(record.exc_info)
+
+        return dumps(entry)
+
+
+def configure_logging():
+    """Install the root handler, in LOG_FORMAT, unless one already
+    exists, as logging.basicConfig does
+    """
+
+    if logging.getLogger().handlers:
+        return
+
+    handler = logging.StreamHandler()
+    handler.addFilter(RedactFilter())
+
+    if config.log_format == "json":
+        handler.setFormatter(JsonFormatter())
+
+    logging.basicConfig(level=config.log_level, handlers=[handler])
@@ -0,0 +1,171 @@
+""" Metrics Module """
+
+import logging
+import time
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    push_to_gateway,
+    write_to_textfile,
+)
+
+from cobalt_purestorage.configuration import config
+from cobalt_purestorage.logging_utils import configure_logging, format_stacktrace
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
+# a registry of our own, so that only rotation metrics are pushed
+REGISTRY = CollectorRegistry()
+
+FB_REQUEST_SECONDS = Histogram(
+    "cobalt_flashblade_request_duration_seconds",
+    "Duration of FlashBlade API calls, including failed attempts",
+    ["array", "method"],
+    registry=REGISTRY,
+)
+
+FB_REQUESTS = Counter(
+    "cobalt_flashblade_requests",
+    "FlashBlade API calls by result",
+    ["array", "method", "result"],
+    registry=REGISTRY,
+)
+
+K8S_REQUEST_SECONDS = Histogram(
+    "cobalt_k8s_request_duration_seconds",
+    "Duration of Kubernetes API calls",
+    ["call"],
+    registry=REGISTRY,
+)
+
+K8S_REQUESTS = Counter(
+    "cobalt_k8s_requests",
+    "Kubernetes API calls by result",
+    ["call", "result"],
+    registry=REGISTRY,
+)
+
+USERS_SCANNED = Gauge(
+    "cobalt_rotation_users_scanned",
+    "Users considered in the last rotation run",
+    ["array"],
+    registry=REGISTRY,
+)
+
+USERS = Gauge(
+    "cobalt_rotation_users",
+    "Users in the last rotation run by outcome",
+    ["array", "outcome"],
+    registry=REGISTRY,
+)
+
+NEWEST_KEY_AGE = Gauge(
+    "cobalt_newest_access_key_age_seconds",
+    "Age of each user's newest access key",
+    ["array", "user"],
+    registry=REGISTRY,
+)
+
+LAST_RUN = Gauge(
+    "cobalt_rotation_last_run_timestamp_seconds",
+    "When the last rotation run finished",
+    registry=REGISTRY,
+)
+
+
+class Call:
+    """The result of a timed call, callers may mark it as failed"""
+
+    ok = True
+
+
+@contextmanager
+def timed(duration, requests, *labels):
+    """Time the enclosed call, counting it as an error if it raises
+    or the caller marks it as failed
+    """
+
+    call = Call()
+    start = time.perf_counter()
+
+    try:
+        yield call
+
+    except BaseException:
+        call.ok = False
+        raise
+
+    finally:
+        duration.labels(*labels).observe(time.perf_counter() - start)
+        requests.labels(*labels, "success" if call.ok else "error").inc()
+
+
+def record_run(array, summary, newest_keys=None):
+    """Given an array's run summary and a dict of user name to the epoch
+    time of the user's newest key, update the rotation gauges.  The key
+    age of a user in the run without a newest key, such as a user that
+    was removed from the array, is no longer reported.  Without
+    newest_keys, only the run's counts are updated.
+    """
+
+    USERS_SCANNED.labels(array).set(sum(len(x) for x in summary.values()))
+
+    for outcome, users in summary.items():
+        USERS.labels(array, outcome).set(len(users))
+
+    if newest_keys is not None:
+        for user_name in {x for users in summary.values() for x in users}:
+            if user_name not in newest_keys:
+                try:
+                    NEWEST_KEY_AGE.remove(array, user_name)
+
+                except KeyError:
+                    pass
+
+        for user_name, created in newest_keys.items():
+            # evaluated when scraped, so the age stays current between runs
+            NEWEST_KEY_AGE.labels(array, user_name).set_function(
+                lambda created=created: time.time() - created
+            )
+
+    LAST_RUN.set_to_current_time()
+
+
+def exposition():
+    """Serve the metrics, as a HealthHandler route"""
+
+    return 200, CONTENT_TYPE_LATEST, generate_latest(REGISTRY)
+
+
+def dump():
+    """Write the metrics to METRICS_TEXTFILE and push them to
+    METRICS_PUSHGATEWAY, when configured.  Failures are logged
+    rather than failing the run.
+    """
+
+    if config.metrics_textfile:
+        try:
+            write_to_textfile(config.metrics_textfile, REGISTRY)
+            logger.debug("Wrote metrics to %s", config.metrics_textfile)
+
+        except OSError:
+            logger.error(format_stacktrace())
+            logger.error("Could not write metrics textfile")
+
+    if config.metrics_pushgateway:
+        try:
+            push_to_gateway(
+                config.metrics_pushgateway, job=config.metrics_job, registry=REGISTRY
+            )
+            logger.debug("Pushed metrics to %s", config.metrics_pushgateway)
+
+        except OSError:
+            logger.error(format_stacktrace())
+            logger.error("Could not push metrics")
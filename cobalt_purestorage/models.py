@@ -0,0 +1,41 @@
+""" FlashBlade Models Module """
+
+from dataclasses import dataclass, field
+
+
+@dataclass(frozen=True, slots=True)
+class ObjectStoreUser:
+    """An Object Store User, holding only the fields the rotator uses"""
+
+    name: str
+
+    @classmethod
+    def from_dict(cls, item):
+        """Build a user from a FlashBlade response item"""
+
+        return cls(item["name"])
+
+
+@dataclass(frozen=True, slots=True)
+class AccessKey:
+    """An Object Store Access Key, holding only the fields the rotator
+    uses.  created is in epoch milliseconds, as the array reports it.
+    The secret is only returned when a key is created, and is kept out
+    of the repr.
+    """
+
+    name: str
+    created: int = None
+    user_name: str = None
+    secret_access_key: str = field(default=None, repr=False)
+
+    @classmethod
+    def from_dict(cls, item):
+        """Build a key from a FlashBlade response item"""
+
+        return cls(
+            item["name"],
+            item.get("created"),
+            (item.get("user") or {}).get("name"),
+            item.get("secret_access_key"),
+        )
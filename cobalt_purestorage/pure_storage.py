@@ -5,122 +5,325 @@ import warnings
 
 import requests
 import urllib3
-from pypureclient.exceptions import PureError
-from pypureclient.flashblade import Client, ObjectStoreAccessKeyPost
 
+from cobalt_purestorage import metrics
 from cobalt_purestorage.configuration import config
-from cobalt_purestorage.logging_utils import format_stacktrace
+from cobalt_purestorage.logging_utils import configure_logging, format_stacktrace
+from cobalt_purestorage.models import AccessKey, ObjectStoreUser
+from cobalt_purestorage.resilience import (
+    AUTH_STATUS_CODES,
+    call_with_retry,
+    circuit_breaker,
+    retry_policy,
+)
 
-logging.basicConfig(level=config.log_level)
+configure_logging()
 logger = logging.getLogger(__name__)
 
 
+def chunked(items, size):
+    """Given an iterable, yield lists of at most size items"""
+
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+def or_filter(field, values):
+    """Given a field and a list of values,
+    return a FlashBlade filter matching any of the values
+    """
+
+    return " or ".join(f'{field}="{value}"' for value in values)
+
+
+def quote_token(continuation_token):
+    """Given a continuation token returned by a listing, return it quoted
+    to be sent back, as the SDK's own item iterator does
+    """
+
+    return f"'{continuation_token}'"
+
+
+def default_timeout():
+    """Return the FlashBlade timeout, as a (connect, read) tuple
+    when either has been configured separately
+    """
+
+    if config.fb_connect_timeout is None and config.fb_read_timeout is None:
+        return config.fb_timeout
+
+    return (
+        config.fb_connect_timeout or config.fb_timeout,
+        config.fb_read_timeout or config.fb_timeout,
+    )
+
+
+def pool_size():
+    """Return the FlashBlade connection pool size"""
+
+    return config.fb_pool_size or config.rotation_concurrency
+
+
 class PureStorageFlashBlade:
-    """Service class for the PureStorage FlashBlade API"""
+    """Service class for the PureStorage FlashBlade API.
+    Unset arguments fall back to FB_URL, API_TOKEN and FB_TIMEOUT.
+    """
 
-    def __init__(self):
+    def __init__(self, url=None, api_token=None, timeout=None, name=None):
         logger.debug("Instantiating FlashBlade Client")
+        url = url or config.fb_url
+        self.name = name or url
         self.client = self._create_client(
-            config.fb_url, config.api_token, config.fb_timeout
+            url, api_token or config.api_token, timeout or default_timeout()
         )
+        self._configure_pool(pool_size())
+        self.retry_policy = retry_policy()
+        self.breaker = circuit_breaker()
         logger.debug("FlashBlade Client instantiated OK")
 
     def _create_client(self, url, token, timeout):
         """Create the client"""
 
-        with warnings.catch_warnings():
-            if not config.verify_fb_tls:
-                warnings.simplefilter(
-                    "ignore", urllib3.exceptions.InsecureRequestWarning
-                )
+        # warnings.catch_warnings() mutates process wide state and is not
+        # thread safe, so the filter is installed once instead of per call
+        if not config.verify_fb_tls:
+            warnings.filterwarnings(
+                "ignore", category=urllib3.exceptions.InsecureRequestWarning
+            )
+
+        # pypureclient takes seconds to import, so it is only
+        # imported once a client is actually needed
+        from pypureclient import flashblade
+        from pypureclient.exceptions import PureError
+
+        try:
+            # pypureclient's own retries resend failed calls at once, POSTs
+            # included, so they are turned off and _call retries instead
+            client = flashblade.Client(url, api_token=token, timeout=timeout, retries=0)
+            return client
+
+        except requests.exceptions.ConnectionError:
+            logger.error(format_stacktrace())
+            raise RuntimeError("Could not instantiate FlashBlade client")
+
+        except PureError:
+            logger.error(format_stacktrace())
+            raise RuntimeError("Could not instantiate FlashBlade Client")
+
+    def _configure_pool(self, size):
+        """Size the client's connection pool.  Every call made through the
+        client shares the pool, so connections, and their TLS sessions,
+        are kept alive and reused across calls.  The pool blocks when all
+        connections are in use rather than opening throwaway connections.
+        """
+
+        pool_manager = self.client._api_client.rest_client.pool_manager
+        pool_manager.connection_pool_kw["maxsize"] = size
+        pool_manager.connection_pool_kw["block"] = True
+        # drop any pool created with the default settings
+        pool_manager.clear()
+        logger.debug("FlashBlade connection pool size: %s", size)
+
+    def _call(self, method, idempotent=True, **kwargs):
+        """Call a client method, returning the response as a dict.
+        Transient failures are retried and counted by the circuit breaker.
+        A call refused because the session expired is made again, once,
+        after logging in again.
+        """
+
+        def request():
+            with metrics.timed(
+                metrics.FB_REQUEST_SECONDS, metrics.FB_REQUESTS, self.name, method
+            ) as call:
+                resp = getattr(self.client, method)(**kwargs).to_dict()
+
+                if resp.get("status_code") in AUTH_STATUS_CODES:
+                    logger.info("FlashBlade session expired, logging in again")
+                    self.client._set_auth_header(refresh=True)
+                    resp = getattr(self.client, method)(**kwargs).to_dict()
+
+                call.ok = resp.get("status_code") == 200
+                return resp
+
+        return call_with_retry(
+            method,
+            request,
+            self.retry_policy,
+            self.breaker,
+            idempotent,
+        )
+
+    def pages(self, method, limit=None, model=None, **kwargs):
+        """Given a listing method, yield the items of each page it returns,
+        of at most limit items, by default FB_LIST_LIMIT, following the
+        continuation token until the listing is exhausted.  Items are
+        built as the given model, rather than kept as dicts, as each page
+        arrives.  Raises RuntimeError if a page cannot be fetched.
+        """
+
+        continuation_token = None
+
+        while True:
+            resp = self._call(
+                method,
+                limit=limit or config.fb_list_limit,
+                continuation_token=continuation_token,
+                **kwargs,
+            )
 
-            try:
-                client = Client(url, api_token=token, timeout=timeout)
-                return client
+            if (status := resp.get("status_code")) != 200:
+                what = method.removeprefix("get_").replace("_", " ")
+                logger.error("Failed to fetch %s with status code %s", what, status)
+                raise RuntimeError(f"Could not fetch {what}")
 
-            except requests.exceptions.ConnectionError:
-                logger.error(format_stacktrace())
-                raise RuntimeError("Could not instantiate FlashBlade client")
+            items = resp["items"]
+            yield [model.from_dict(x) for x in items] if model else items
 
-            except PureError:
-                logger.error(format_stacktrace())
-                raise RuntimeError("Could not instantiate FlashBlade Client")
+            if not (token := resp.get("continuation_token")):
+                return
+
+            continuation_token = quote_token(token)
+
+    def items(self, method, limit=None, model=None, **kwargs):
+        """Given a listing method, yield its items one at a time,
+        fetching a page of at most limit items at a time
+        """
+
+        for page in self.pages(method, limit, model, **kwargs):
+            yield from page
+
+    def object_store_users(self, name_filter=None, limit=None):
+        """Yield the Object Store Users, matching the filter if given"""
+
+        return self.items(
+            "get_object_store_users", limit, ObjectStoreUser, filter=name_filter
+        )
+
+    def object_store_access_keys(self, key_filter=None, limit=None):
+        """Yield the Object Store Access Keys, matching the filter if given"""
+
+        return self.items(
+            "get_object_store_access_keys", limit, AccessKey, filter=key_filter
+        )
 
     def object_store_user_exists(self, name):
         """Given an Object Store User name,
         check if the user exists on the FB array
         """
 
-        with warnings.catch_warnings():
-            if not config.verify_fb_tls:
-                warnings.simplefilter(
-                    "ignore", urllib3.exceptions.InsecureRequestWarning
-                )
+        try:
+            return (
+                next(self.object_store_users(f'name="{name}"', limit=1), None)
+                is not None
+            )
 
-            resp = self.client.get_object_store_users(filter=f'name="{name}"').to_dict()
+        except RuntimeError:
+            return False
 
-        if (status := resp.get("status_code")) != 200:
-            logger.error(
-                f"Failed to fetch object store users with status code {status}"
-            )
-        return bool(resp.get("items"))
+    def list_object_store_users(self, name_filter):
+        """Given a FlashBlade filter, yield the names of the matching
+        Object Store Users a page of FB_LIST_LIMIT at a time
+        """
+
+        for page in self.pages(
+            "get_object_store_users", model=ObjectStoreUser, filter=name_filter
+        ):
+            yield [x.name for x in page]
 
     def get_access_keys_for_user(self, name):
         """Given an Object Store User name,
         return the keys associated that that user
         """
 
-        with warnings.catch_warnings():
-            if not config.verify_fb_tls:
-                warnings.simplefilter(
-                    "ignore", urllib3.exceptions.InsecureRequestWarning
-                )
+        try:
+            return list(self.object_store_access_keys(f'user.name="{name}"'))
 
-            resp = self.client.get_object_store_access_keys(
-                filter=f'user.name="{name}"'
-            ).to_dict()
+        except RuntimeError:
+            return None
 
-        if resp["status_code"] == 200:
-            return resp["items"]
+    def get_object_store_users_by_name(self, names):
+        """Given a list of Object Store User names,
+        return the set of names that exist on the FB array.
+        Names are OR-combined into chunked filters to keep
+        the number of round-trips low.
+        """
 
-        return None
+        existing = set()
+
+        for chunk in chunked(sorted(names), config.fb_filter_chunk_size):
+            existing.update(
+                x.name for x in self.object_store_users(or_filter("name", chunk))
+            )
+
+        return existing
+
+    def get_access_keys_for_users(self, names):
+        """Given a list of Object Store User names,
+        return a dict of user name to the keys associated with that user
+        """
+
+        keys = {name: [] for name in names}
+
+        for chunk in chunked(sorted(keys), config.fb_filter_chunk_size):
+            for key in self.object_store_access_keys(or_filter("user.name", chunk)):
+                keys.setdefault(key.user_name, []).append(key)
+
+        return keys
 
     def post_object_store_access_keys(self, user_name):
         """Create a new object store access key"""
 
-        with warnings.catch_warnings():
-            if not config.verify_fb_tls:
-                warnings.simplefilter(
-                    "ignore", urllib3.exceptions.InsecureRequestWarning
-                )
+        from pypureclient.flashblade import ObjectStoreAccessKeyPost
 
-            resp = self.client.post_object_store_access_keys(
-                object_store_access_key=ObjectStoreAccessKeyPost(
-                    user={"name": user_name}
-                )
-            ).to_dict()
+        # creating a key is not idempotent, so it is only retried
+        # when the array rejected the request
+        resp = self._call(
+            "post_object_store_access_keys",
+            idempotent=False,
+            object_store_access_key=ObjectStoreAccessKeyPost(user={"name": user_name}),
+        )
 
         if resp["status_code"] == 200:
-            return resp["items"][0]
+            return AccessKey.from_dict(resp["items"][0])
 
-        logger.error(f"An error occured creating a key for user {user_name}")
+        logger.error("An error occured creating a key for user %s", user_name)
         return None
 
-    def delete_object_store_access_keys(self, key_names):
-        """Given a list of key names, delete them"""
+    def existing_access_keys(self, key_names):
+        """Given a list of key names,
+        return the set of names that exist on the FB array
+        """
+
+        existing = set()
 
-        with warnings.catch_warnings():
-            if not config.verify_fb_tls:
-                warnings.simplefilter(
-                    "ignore", urllib3.exceptions.InsecureRequestWarning
-                )
+        for chunk in chunked(sorted(key_names), config.fb_filter_chunk_size):
+            existing.update(
+                x.name for x in self.object_store_access_keys(or_filter("name", chunk))
+            )
 
-            resp = self.client.delete_object_store_access_keys(
-                names=key_names
-            ).to_dict()
+        return existing
+
+    def delete_object_store_access_keys(self, key_names):
+        """Given a list of key names, delete them.  A delete that failed
+        is checked against a listing of the keys, as a retried delete
+        fails once an earlier attempt was applied.
+        """
+
+        resp = self._call("delete_object_store_access_keys", names=key_names)
 
         if resp["status_code"] == 200:
             return True
 
-        logger.error(f"An error occured deleting keys {key_names}")
+        if key_names and not self.existing_access_keys(key_names):
+            logger.warning("Keys were deleted despite the error: %s", key_names)
+            return True
+
+        logger.error("An error occured deleting keys %s", key_names)
         return False
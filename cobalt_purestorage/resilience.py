@@ -0,0 +1,164 @@
+""" Resilience Module """
+
+import logging
+import random
+import threading
+import time
+
+import requests
+import urllib3
+
+from cobalt_purestorage.configuration import config
+from cobalt_purestorage.logging_utils import configure_logging
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
+# statuses indicating the array is overloaded or briefly unavailable
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# statuses indicating the array refused the request without acting on it
+REJECTED_STATUS_CODES = {429}
+
+# statuses indicating the session token expired or was revoked
+AUTH_STATUS_CODES = {401, 403}
+
+TRANSIENT_EXCEPTIONS = (
+    urllib3.exceptions.HTTPError,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+)
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised when the circuit breaker is refusing calls"""
+
+
+class CircuitBreaker:
+    """Stops calls to an unhealthy service.
+
+    The breaker opens after failure_threshold consecutive failures and
+    refuses calls until reset_timeout seconds have passed.  It then lets a
+    single trial call through, closing again if that call succeeds.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Raise CircuitOpenError if the call should not be made"""
+
+        with self._lock:
+            if self.opened_at is None:
+                return
+
+            if time.monotonic() - self.opened_at < self.reset_timeout:
+                raise CircuitOpenError("FlashBlade circuit breaker is open")
+
+            if self._trial_in_flight:
+                raise CircuitOpenError("FlashBlade circuit breaker is half open")
+
+            self._trial_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+
+            if self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.error(
+                        "Opening circuit breaker after %s consecutive failures",
+                        self.failures,
+                    )
+                self.opened_at = time.monotonic()
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter"""
+
+    def __init__(self, attempts, base_delay, max_delay):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt):
+        """Return the delay before the given retry attempt, counting from 1"""
+
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+
+def retry_policy():
+    """Build the retry policy from configuration"""
+
+    return RetryPolicy(
+        config.fb_retry_attempts, config.fb_retry_base_delay, config.fb_retry_max_delay
+    )
+
+
+def circuit_breaker():
+    """Build a circuit breaker from configuration"""
+
+    return CircuitBreaker(
+        config.fb_circuit_failure_threshold, config.fb_circuit_reset_timeout
+    )
+
+
+def call_with_retry(operation, request, policy, breaker, idempotent=True):
+    """Call request, a function returning a response dict, retrying
+    transient failures.  Operations that are not idempotent are only
+    retried when the array rejected the request without acting on it.
+    Any other exception is counted as a failure and raised at once.
+    Returns the last response, or raises the last exception.
+    """
+
+    attempt = 0
+
+    while True:
+        breaker.before_call()
+        attempt += 1
+
+        try:
+            resp = request()
+
+        except TRANSIENT_EXCEPTIONS:
+            breaker.record_failure()
+            if not idempotent or attempt >= policy.attempts:
+                raise
+            logger.warning(
+                "%s raised a transient error, attempt %s", operation, attempt
+            )
+
+        except Exception:
+            # count it, so a half open breaker is not left waiting on
+            # a trial call that will never report back
+            breaker.record_failure()
+            raise
+
+        else:
+            status = resp.get("status_code")
+
+            if status not in RETRYABLE_STATUS_CODES:
+                breaker.record_success()
+                return resp
+
+            breaker.record_failure()
+            retryable = idempotent or status in REJECTED_STATUS_CODES
+            if not retryable or attempt >= policy.attempts:
+                return resp
+            logger.warning(
+                "%s returned status %s, attempt %s", operation, status, attempt
+            )
+
+        time.sleep(policy.delay(attempt))
@@ -2,17 +2,44 @@
 
 import json
 import logging
+import threading
 import time
 from base64 import urlsafe_b64encode
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
 from datetime import datetime, timedelta
+from operator import attrgetter
 
+from cobalt_purestorage import discovery, inventory, metrics, sharding, state, tracing
 from cobalt_purestorage.configuration import config
-from cobalt_purestorage.k8s import K8S
-from cobalt_purestorage.pure_storage import PureStorageFlashBlade
+from cobalt_purestorage.logging_utils import Lazy, configure_logging, format_stacktrace
+from cobalt_purestorage.pure_storage import PureStorageFlashBlade, chunked
+from cobalt_purestorage.resilience import CircuitOpenError
 
-logging.basicConfig(level=config.log_level)
+configure_logging()
 logger = logging.getLogger(__name__)
 
+# rotation outcomes, in summary order
+CREATED = "created"
+ROTATED = "rotated"
+SKIPPED = "skipped"
+TOO_MANY_KEYS = "too_many_keys"
+INVALID = "invalid"
+FAILED = "failed"
+OUTCOMES = (CREATED, ROTATED, SKIPPED, TOO_MANY_KEYS, INVALID, FAILED)
+
+# how a dry run describes each planned outcome
+PLAN_ACTIONS = {
+    CREATED: "create a key",
+    ROTATED: "delete key {key_name}, then create a key",
+    SKIPPED: "skip, keys are too young",
+    TOO_MANY_KEYS: "skip, more than two keys",
+    INVALID: "skip, user does not exist",
+    FAILED: "skip, secret does not exist",
+}
+
+_local_output_lock = threading.Lock()
+
 
 def base64(input):
     """Given a string, return a base64 encoded string"""
@@ -22,18 +49,22 @@ def base64(input):
     return b64_bytes.decode("utf-8")
 
 
-def key_too_recent(keys):
+def key_too_recent(keys, min_age=None, variance=None):
     """Given a list of keys,
     check if any are younger than minimum allowable age.
+    The age and variance default to ACCESS_KEY_MIN_AGE and
+    ACCESS_KEY_AGE_VARIANCE.
     """
 
     curr_ts = int(time.time())
+    min_age = config.access_key_min_age if min_age is None else min_age
+    variance = config.access_key_age_variance if variance is None else variance
 
     # to allow for scheduling variances, we take a variance factor off the
     # min key age
-    min_allowable_age = config.access_key_min_age - config.access_key_age_variance
-    logger.debug(f"min allowable age: {min_allowable_age}")
-    ls = [x for x in keys if (curr_ts - (x["created"] / 1000)) < min_allowable_age]
+    min_allowable_age = min_age - variance
+    logger.debug("min allowable age: %s", min_allowable_age)
+    ls = [x for x in keys if (curr_ts - (x.created / 1000)) < min_allowable_age]
 
     if ls:
         return True
@@ -41,20 +72,20 @@ def key_too_recent(keys):
     return False
 
 
-def generate_aws_credentials(credentials):
+def generate_aws_credentials(credentials, min_age=None, variance=None):
     """Given FlashBlade credentials, return the credentials
-    in the format expected by the AWS SDK.
+    in the format expected by the AWS SDK.  The key age and variance
+    default to ACCESS_KEY_MIN_AGE and ACCESS_KEY_AGE_VARIANCE.
     """
 
+    min_age = config.access_key_min_age if min_age is None else min_age
+    variance = config.access_key_age_variance if variance is None else variance
+
     #  to allow time for credentials to be distributed,
     #  add a buffer to their expiry time
-    expiry_offset = int(
-        config.access_key_min_age
-        + (config.access_key_min_age / 2)
-        + config.access_key_age_variance
-    )
+    expiry_offset = int(min_age + (min_age / 2) + variance)
 
-    logger.debug(f"Credentials will expire in {expiry_offset} seconds.")
+    logger.debug("Credentials will expire in %s seconds.", expiry_offset)
 
     # RFC3339 UTC datetime string
     expiry_ts = (
@@ -63,8 +94,8 @@ def generate_aws_credentials(credentials):
 
     _d = {
         "Version": 1,
-        "AccessKeyId": credentials["name"],
-        "SecretAccessKey": credentials["secret_access_key"],
+        "AccessKeyId": credentials.name,
+        "SecretAccessKey": credentials.secret_access_key,
         "SessionToken": "",
         "Expiration": f"{expiry_ts}Z",
     }
@@ -82,94 +113,859 @@ def update_credentials(refreshed_credentials, user_name):
         update_local(refreshed_credentials, user_name)
 
 
+def secret_target(user_name):
+    """Given a user name, return the (namespace, secret, key)
+    its credentials are written to.
+    """
+
+    user = inventory.entry(user_name)
+    target = (user and user.target) or config.user_secret_targets.get(user_name)
+
+    if target is None:
+        return config.k8s_namespace, config.k8s_secret_name, config.k8s_secret_key
+
+    return (
+        target.namespace or config.k8s_namespace,
+        target.secret or config.k8s_secret_name,
+        target.key or config.k8s_secret_key,
+    )
+
+
 def update_k8s(refreshed_credentials, user_name):
     """Given a credentials dict, update the k8s secret."""
 
+    from cobalt_purestorage import k8s
+
     encoded_secret_data = base64(json.dumps(refreshed_credentials))
 
-    k8s = K8S()
-    k8s.update_secret(
-        config.k8s_namespace,
-        config.k8s_secret_name,
-        config.k8s_secret_key,
-        encoded_secret_data,
-    )
-    logger.info(f"Updated k8s. User: {user_name}")
+    with tracing.span("update_k8s", user=user_name):
+        k8s.get_k8s().update_secret(*secret_target(user_name), encoded_secret_data)
+    logger.info("Updated k8s. User: %s", user_name)
+
+
+class SecretBatch:
+    """Collects rotated credentials so that all users
+    targeting the same secret are written with a single patch
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._users = {}
+        self._lock = threading.Lock()
+
+    def add(self, refreshed_credentials, user_name):
+        """Stage a user's credentials for publishing."""
+
+        namespace, secret_name, secret_key = secret_target(user_name)
+        encoded_secret_data = base64(json.dumps(refreshed_credentials))
+
+        with self._lock:
+            data = self._data.setdefault((namespace, secret_name), {})
+            if secret_key in data:
+                logger.warning(
+                    "Users share a secret key, the last one wins. User: %s, Key: %s",
+                    user_name,
+                    secret_key,
+                )
+            data[secret_key] = encoded_secret_data
+            self._users.setdefault((namespace, secret_name), []).append(user_name)
+
+    def take(self):
+        """Empty the batch, returning the staged data of each
+        (namespace, secret) and the users staged into it
+        """
+
+        with self._lock:
+            batches, self._data = self._data, {}
+            users, self._users = self._users, {}
+
+        return batches, users
+
+    def flush(self):
+        """Patch every staged secret once.
+        Returns the users whose credentials could not be published.
+        """
+
+        from cobalt_purestorage import k8s
+
+        failed = []
+        batches, users = self.take()
+
+        for (namespace, secret_name), data in sorted(batches.items()):
+            try:
+                with tracing.span(
+                    "update_k8s",
+                    namespace=namespace,
+                    secret=secret_name,
+                    users=len(users[(namespace, secret_name)]),
+                ):
+                    k8s.get_k8s().update_secret_data(namespace, secret_name, data)
+                logger.info(
+                    "Updated k8s. Users: %s",
+                    ", ".join(sorted(users[(namespace, secret_name)])),
+                )
+
+            except (RuntimeError, ValueError):
+                logger.error(
+                    "Failed to update secret: Namespace: %s Secret: %s",
+                    namespace,
+                    secret_name,
+                )
+                failed.extend(users[(namespace, secret_name)])
+
+        return failed
+
+
+def missing_secret_users(user_names):
+    """Check the target secrets of the given users exist with a single
+    call per namespace, before any keys are created.
+    Returns the users whose target secret does not exist.
+    """
+
+    from cobalt_purestorage import k8s
+
+    targets = {}
+    for user_name in user_names:
+        namespace, secret_name, _ = secret_target(user_name)
+        targets.setdefault(namespace, {}).setdefault(secret_name, []).append(user_name)
+
+    missing_users = []
+    for namespace, secrets in sorted(targets.items()):
+        with tracing.span(
+            "check_secrets_exist", namespace=namespace, secrets=len(secrets)
+        ):
+            missing = k8s.get_k8s().prefetch_secrets(namespace, sorted(secrets))
+
+        for secret_name in sorted(missing):
+            logger.error(
+                "Secret does not exist: Namespace: %s Secret: %s",
+                namespace,
+                secret_name,
+            )
+            missing_users.extend(secrets[secret_name])
+
+    return missing_users
 
 
 def update_local(refreshed_credentials, user_name):
     """Given a credentials dict, write it out to the local filesystem."""
 
-    with open(config.credentials_output_path, "w") as f:
+    with tracing.span("update_local", user=user_name), _local_output_lock, open(
+        config.credentials_output_path, "w"
+    ) as f:
         f.write(json.dumps(refreshed_credentials))
-    logger.info(f"Updated local credentials file. User: {user_name}")
+    logger.info("Updated local credentials file. User: %s", user_name)
+
+
+def fetch_inventory(fb, user_names, known_existing=False):
+    """Given a list of user names, fetch the users and their keys
+    from the FlashBlade in bulk.  Returns a dict of user name to keys
+    containing only the users that exist on the array.  Users that were
+    just listed from the array are known_existing, and not looked up.
+    """
+
+    if known_existing:
+        existing = set(user_names)
+
+    else:
+        with tracing.span("check_users_exist", users=len(user_names)) as span:
+            existing = fb.get_object_store_users_by_name(user_names)
+            span.set_attribute("existing", len(existing))
+
+    for user_name in sorted(set(user_names) - existing):
+        logger.error("User %s does not appear to be a valid user...", user_name)
+
+    if not existing:
+        return {}
+
+    with tracing.span("list_access_keys", users=len(existing)) as span:
+        keys = fb.get_access_keys_for_users(existing)
+        span.set_attribute("keys", sum(len(x) for x in keys.values()))
+
+    return {user_name: keys.get(user_name, []) for user_name in sorted(existing)}
+
+
+def create_and_publish(fb, user_name, publish=update_credentials):
+    """Create a new key for the user and publish the credentials.
+    Returns True if a key was created.
+    """
+
+    with tracing.span("create_access_key", user=user_name):
+        credentials = fb.post_object_store_access_keys(user_name)
+
+    if credentials:
+        logger.info("New key created. User: %s, Key: %s", user_name, credentials.name)
+        with tracing.span("publish", user=user_name):
+            publish(
+                generate_aws_credentials(credentials, *inventory.key_age(user_name)),
+                user_name,
+            )
+        return True
+
+    return False
+
+
+def plan_user(user_name, keys):
+    """Given a user and its prefetched keys, decide whether the user's
+    keys need rotating.  Returns the outcome the rotation would have
+    and the name of the key to delete first, if any.
+    """
+
+    logger.debug("Begin operations for user: %s", user_name)
+
+    if not keys:
+        # no keys, create a new one
+        logger.info("No keys found. User: %s", user_name)
+        return CREATED, None
+
+    # only the key names and ages are logged, and only at debug level
+    logger.debug(
+        "Keys for user %s: %s",
+        user_name,
+        Lazy(lambda: {x.name: x.created for x in keys}),
+    )
+
+    # hmmm, the FlashBlade only allows a max of two keys per user
+    if len(keys) > 2:
+        logger.warning("More than two keys found. User: %s", user_name)
+        return TOO_MANY_KEYS, None
+
+    if key_too_recent(keys, *inventory.key_age(user_name)):
+        logger.warning("Keys are too young, ignoring. User: %s", user_name)
+        return SKIPPED, None
+
+    # if existing key not too young create a new key
+    if len(keys) == 1:
+        logger.info("One key found. User: %s", user_name)
+        return CREATED, None
+
+    # if existing keys not too young, delete oldest then create new
+    logger.info("Two keys found. User: %s", user_name)
+    oldest_key = min(keys, key=attrgetter("created"))
+
+    return ROTATED, oldest_key.name
+
+
+def plan(inventory):
+    """Given a dict of user name to keys, return a dict of
+    user name to (outcome, key to delete)
+    """
+
+    with tracing.span("plan", users=len(inventory)):
+        return {x: plan_user(x, keys) for x, keys in inventory.items()}
+
+
+def delete_batch(fb, key_names):
+    """Delete the keys with a single call.  If the array rejects the
+    batch the keys are deleted one at a time, so that one bad key only
+    fails its own user.  Returns the keys that were not deleted.
+    """
+
+    if fb.delete_object_store_access_keys(key_names):
+        return []
+
+    if len(key_names) == 1:
+        return key_names
+
+    logger.warning("Batch delete failed, deleting %s keys singly", len(key_names))
+
+    return [x for x in key_names if not fb.delete_object_store_access_keys([x])]
+
+
+def delete_keys(fb, deletes):
+    """Given a dict of key name to user name, delete the keys in batches
+    of FB_DELETE_BATCH_SIZE.  Returns the users whose key was not deleted.
+    """
+
+    failed = set()
+
+    for chunk in chunked(sorted(deletes), config.fb_delete_batch_size):
+        with tracing.span("delete_access_keys", keys=len(chunk)) as span:
+            try:
+                remaining = delete_batch(fb, chunk)
+
+            except CircuitOpenError:
+                raise
+
+            except Exception:
+                logger.error(format_stacktrace())
+                remaining = chunk
+
+            span.set_attribute("failed", len(remaining))
+
+        for key_name in chunk:
+            if key_name in remaining:
+                logger.error(
+                    "Failed to delete oldest key. User: %s, Key: %s",
+                    deletes[key_name],
+                    key_name,
+                )
+                failed.add(deletes[key_name])
+            else:
+                logger.info(
+                    "Oldest key deleted. User: %s, Key: %s", deletes[key_name], key_name
+                )
+
+    return failed
+
+
+def user_span(user_name, keys=None):
+    """Return the span of a user's rotation, with the number of keys
+    the user had, when known
+    """
+
+    if keys is None:
+        return tracing.span("rotate_user", user=user_name)
+
+    return tracing.span("rotate_user", user=user_name, keys=keys)
+
+
+def safe_create_and_publish(
+    fb, user_name, outcome, publish=update_credentials, keys=None
+):
+    """Create and publish a user's new key, isolating any failure from
+    the other users.  Returns the planned outcome, or FAILED.
+    """
+
+    with user_span(user_name, keys) as span:
+        try:
+            if not create_and_publish(fb, user_name, publish):
+                outcome = FAILED
+
+        except CircuitOpenError:
+            # the array is unhealthy, fail the run rather than every user
+            raise
+
+        except Exception:
+            logger.error(format_stacktrace())
+            logger.error("Rotation failed. User: %s", user_name)
+            outcome = FAILED
+
+        span.set_attribute("outcome", outcome)
+
+    return outcome
+
+
+def abandoned(claim, planned, outcomes):
+    """If the claim on the planned users' lease is no longer held, skip
+    the users without an outcome, leaving them to the replica that took
+    the lease over.  Returns True if they were skipped.
+    """
+
+    if claim is None or claim.held:
+        return False
+
+    remaining = [x for x in planned if x not in outcomes]
+    logger.warning(
+        "Lease %s is no longer held, leaving %s users to its new holder",
+        claim.name,
+        len(remaining),
+    )
+    outcomes.update({x: SKIPPED for x in remaining})
+
+    return True
+
+
+def apply(fb, planned, publish=update_credentials, claim=None, inventory=None):
+    """Carry out a plan.  Every deletion is made first, in a few batched
+    calls, then the new keys are created and handed to publish
+    concurrently.  When the users are rotated under a lease's claim, the
+    plan is abandoned once the claim is lost, before the deletions and
+    again before the creations.  Each user is traced with the number of
+    keys it had in the inventory the plan was made from, if given.
+    Returns a dict of user name to outcome.
+    """
+
+    keys = {x: len(user_keys) for x, user_keys in (inventory or {}).items()}
+    outcomes = {
+        x: outcome
+        for x, (outcome, _) in planned.items()
+        if outcome not in (CREATED, ROTATED)
+    }
+    created = {}
+
+    if not abandoned(claim, planned, outcomes):
+        deletes = {key_name: x for x, (_, key_name) in planned.items() if key_name}
+        outcomes.update({x: FAILED for x in delete_keys(fb, deletes)})
+
+        if not abandoned(claim, planned, outcomes):
+            with ThreadPoolExecutor(config.rotation_concurrency) as executor:
+                futures = {
+                    x: executor.submit(
+                        tracing.propagate(safe_create_and_publish),
+                        fb,
+                        x,
+                        outcome,
+                        publish,
+                        keys.get(x),
+                    )
+                    for x, (outcome, _) in planned.items()
+                    if x not in outcomes
+                }
+                created = {x: f.result() for x, f in futures.items()}
+
+    # users no key was created for are traced with their outcome too
+    for user_name in sorted(outcomes):
+        with user_span(user_name, keys.get(user_name)) as span:
+            span.set_attribute("outcome", outcomes[user_name])
+
+    outcomes.update(created)
+
+    return outcomes
+
+
+def summarise(outcomes):
+    """Given a dict of user name to outcome,
+    return a dict of outcome to sorted user names
+    """
+
+    summary = {}
+    for user_name in sorted(outcomes):
+        summary.setdefault(outcomes[user_name], []).append(user_name)
+
+    return summary
+
+
+def log_summary(summary, array=None):
+    """Log the outcome of a run, ordered by outcome and user name."""
+
+    counts = ", ".join(
+        f"{outcome}={len(summary.get(outcome, []))}" for outcome in OUTCOMES
+    )
+    where = f" for array {array}" if array else ""
+    logger.info("Rotation summary%s: %s", where, counts)
+
+    for outcome in (INVALID, TOO_MANY_KEYS, FAILED):
+        if users := summary.get(outcome):
+            logger.warning("Users %s%s: %s", outcome, where, ", ".join(users))
+
+
+def newest_keys(outcomes, inventory, now):
+    """Return a dict of user name to the epoch time of the user's
+    newest key, once the run's outcomes have been applied
+    """
+
+    newest = {}
+    for user_name, keys in inventory.items():
+        if outcomes.get(user_name) in (CREATED, ROTATED):
+            newest[user_name] = now
+        elif keys:
+            newest[user_name] = max(x.created for x in keys) / 1000
+
+    return newest
+
+
+def record_metrics(array, outcomes, inventory=None, not_due=None):
+    """Update the array's rotation gauges, counting every outcome.
+    not_due is a dict of user name to the epoch time of the newest key
+    of each user that was not looked up.  Without the inventory of keys
+    the outcomes were decided from, only the counts are updated.
+    """
+
+    summary = summarise(outcomes)
+    newest = None
+
+    if inventory is not None:
+        newest = {**(not_due or {}), **newest_keys(outcomes, inventory, time.time())}
+
+    metrics.record_run(array, {x: summary.get(x, []) for x in OUTCOMES}, newest)
+
+
+def update_state(store, outcomes, inventory, started):
+    """Record the newest key of each user the array was checked for.
+    Keys created by the run are recorded as created when it started,
+    so that they are never thought to be younger than they are.
+    """
+
+    now = time.time()
+
+    for user_name, outcome in outcomes.items():
+        if outcome in (CREATED, ROTATED):
+            store.record(user_name, started, now, published=now)
+
+        elif outcome == SKIPPED and inventory.get(user_name):
+            # users left to a lease's new holder may have had no keys
+            newest_key = max(x.created for x in inventory[user_name]) / 1000
+            store.record(user_name, newest_key, now)
+
+        elif outcome != SKIPPED:
+            store.forget(user_name)
+
+
+def rotate_users(user_names, fb=None, claim=None, known_existing=False):
+    """Rotate the given users, creating a FlashBlade client if one is
+    not supplied.  Users rotated under a lease's claim are left alone
+    once it is lost.  Users known_existing are not looked up before
+    their keys.  Returns a dict of user name to outcome, the inventory
+    of keys the decisions were made from, and a dict of user name to the
+    epoch time of the newest key of each user STATE_FILE showed not due.
+    """
+
+    user_names = set(user_names)
+    # a client created here is for FB_URL
+    array = fb.name if fb else config.fb_url
+    started = time.time()
+
+    store = state.RotationState(config.state_file, array) if config.state_file else None
+    not_due = store.not_due(user_names, started) if store else {}
+
+    with tracing.span("rotate_users", array=array, users=len(user_names)) as span:
+        outcomes, inventory = _rotate_users(
+            user_names - set(not_due), fb, claim, known_existing
+        )
+        outcomes.update({x: SKIPPED for x in not_due})
+
+        span.set_attribute("not_due", len(not_due))
+        for outcome, users in summarise(outcomes).items():
+            span.set_attribute(outcome, len(users))
+
+    if not_due:
+        logger.info(
+            "Skipped %s users whose keys are known to be too young", len(not_due)
+        )
+
+    if store:
+        update_state(store, outcomes, inventory, started)
+        store.save()
+
+    record_metrics(array, outcomes, inventory, not_due)
+
+    return outcomes, inventory, not_due
+
+
+def _rotate_users(user_names, fb, claim=None, known_existing=False):
+    """The body of rotate_users, within its span"""
+
+    outcomes = {}
+    inventory = {}
+
+    if config.k8s_mode:
+        from cobalt_purestorage import k8s
+
+        # the client lives as long as the process, secrets may have
+        # been created or deleted since the last pass
+        k8s.clear_secret_cache()
+
+    if config.k8s_mode and config.k8s_prefetch_secrets:
+        outcomes.update({x: FAILED for x in missing_secret_users(user_names)})
+        user_names -= set(outcomes)
+
+    if not user_names:
+        return outcomes, inventory
+
+    fb = fb or PureStorageFlashBlade()
+
+    inventory = fetch_inventory(fb, user_names, known_existing)
+    outcomes.update({x: INVALID for x in user_names if x not in inventory})
+
+    # in k8s mode, users sharing a secret are published with one patch
+    batch = SecretBatch() if config.k8s_mode else None
+    publish = batch.add if batch else update_credentials
+
+    planned = plan(inventory)
+
+    try:
+        outcomes.update(apply(fb, planned, publish, claim, inventory))
+
+    finally:
+        # publish whatever was created, even when the run is failing
+        if batch:
+            outcomes.update({x: FAILED for x in batch.flush()})
+
+    return outcomes, inventory
+
+
+def rotate_claimed(user_names, fb=None, part=None, known_existing=False):
+    """Rotate the given users, creating a FlashBlade client if one is
+    not supplied.  In LEASE_MODE only the batches of users whose Lease
+    this replica claims are rotated, so replicas share the users without
+    rotating any user twice.  part numbers the Leases of each batch read
+    from USERS_FILE apart.  Returns a dict of user name to outcome.
+    """
+
+    if not config.lease_mode:
+        outcomes, _, _ = rotate_users(user_names, fb, known_existing=known_existing)
+        return outcomes
+
+    from cobalt_purestorage import leases
+
+    fb = fb or PureStorageFlashBlade()
+    outcomes = {}
+    inventory = {}
+    not_due = {}
+
+    scope = leases.lease_scope(fb.name, part)
+
+    with closing(leases.claimed_batches(user_names, scope)) as batches:
+        for batch, claim in batches:
+            batch_outcomes, batch_inventory, batch_not_due = rotate_users(
+                batch, fb, claim, known_existing
+            )
+            outcomes.update(batch_outcomes)
+            inventory.update(batch_inventory)
+            not_due.update(batch_not_due)
+
+    # the gauges count every batch this replica rotated, not just the last
+    record_metrics(fb.name, outcomes, inventory, not_due)
+
+    return outcomes
+
+
+def configured_users(array=None):
+    """Return the configured users, of one of FB_ARRAYS if given,
+    that are owned by this process's shard
+    """
+
+    user_names = (array and array.interesting_users) or config.interesting_users
+    owned = sharding.owned_users(user_names)
+
+    if config.shard_count > 1:
+        logger.info(
+            "Shard %s of %s owns %s of %s users",
+            config.shard_index,
+            config.shard_count,
+            len(owned),
+            len(user_names),
+        )
+
+    return owned
+
+
+def streams_users(array=None):
+    """Return True if the configured users, of one of FB_ARRAYS if given,
+    are read from USERS_FILE or discovered on the array, in batches
+    """
+
+    if array and array.interesting_users:
+        return False
+
+    return bool(config.users_file or config.discover_users)
+
+
+def discovers_users(array=None):
+    """Return True if the configured users, of one of FB_ARRAYS if given,
+    are discovered on the array, so are known to exist
+    """
+
+    return streams_users(array) and not config.users_file
+
+
+def configured_batches(fb, array=None):
+    """Yield the configured users, of one of FB_ARRAYS if given, that are
+    owned by this process's shard, as (part, user names).  Users listed in
+    USERS_FILE are read USERS_FILE_BATCH_SIZE at a time, numbered from 0,
+    with their options loaded while the batch is processed.  Users matching
+    DISCOVER_USERS are listed from the array, a batch per page.  Otherwise
+    part is None and every user is in one batch.
+    """
+
+    if not streams_users(array):
+        yield None, configured_users(array)
+
+    elif config.users_file:
+        for part, entries in enumerate(inventory.owned_batches(config.users_file)):
+            with inventory.loaded(entries):
+                yield part, {x.name for x in entries}
+
+    elif config.lease_mode:
+        # pages shift as users are added, so replicas could disagree on
+        # the batches, the leases share all of the users instead
+        yield None, {x for page in discovery.discover_users(fb) for x in page}
+
+    else:
+        for part, user_names in enumerate(discovery.discover_users(fb)):
+            yield part, set(user_names)
+
+
+def rotate_configured(fb=None, array=None):
+    """Rotate the configured users of FB_URL, or of one of FB_ARRAYS if
+    given, a batch at a time.  Returns a dict of user name to outcome.
+    """
+
+    if fb is None and streams_users(array):
+        # the batches share a client
+        fb = PureStorageFlashBlade()
+
+    outcomes = {}
+    parts = 0
+
+    known_existing = discovers_users(array)
+
+    with closing(configured_batches(fb, array)) as batches:
+        for part, user_names in batches:
+            outcomes.update(rotate_claimed(user_names, fb, part, known_existing))
+            parts += 1
+
+    if parts > 1:
+        # the gauges count every batch, not just the last
+        record_metrics(fb.name, outcomes)
+
+    return outcomes
+
+
+def plan_users(user_names, fb=None, known_existing=False):
+    """Plan the rotation of the given users without changing anything,
+    creating a FlashBlade client if one is not supplied.  Users
+    known_existing are not looked up before their keys.  Returns a dict
+    of user name to (outcome, key to delete).
+    """
+
+    user_names = set(user_names)
+    planned = {}
+
+    if config.k8s_mode and config.k8s_prefetch_secrets:
+        planned.update({x: (FAILED, None) for x in missing_secret_users(user_names)})
+        user_names -= set(planned)
+
+    if user_names:
+        inventory = fetch_inventory(
+            fb or PureStorageFlashBlade(), user_names, known_existing
+        )
+        planned.update({x: (INVALID, None) for x in user_names if x not in inventory})
+        planned.update(plan(inventory))
+
+    return planned
+
+
+def format_plan(planned):
+    """Return a plan as a line per user, ordered by user name"""
+
+    return [
+        f"{x}: {PLAN_ACTIONS[outcome].format(key_name=key_name)}"
+        for x, (outcome, key_name) in sorted(planned.items())
+    ]
+
+
+def plan_configured(fb=None, array=None):
+    """Plan the rotation of the configured users of FB_URL, or of one of
+    FB_ARRAYS if given, a batch at a time.  Returns a dict of user name
+    to (outcome, key to delete).
+    """
+
+    if fb is None and streams_users(array):
+        fb = PureStorageFlashBlade()
+
+    planned = {}
+    known_existing = discovers_users(array)
+
+    with closing(configured_batches(fb, array)) as batches:
+        for _, user_names in batches:
+            planned.update(plan_users(user_names, fb, known_existing))
+
+    return planned
+
+
+def dry_run():
+    """Plan the rotation of the configured users on every configured
+    array, without changing anything.  Returns the plan as lines of text.
+    """
+
+    if not config.fb_arrays:
+        return format_plan(plan_configured())
+
+    lines = []
+    for array in config.fb_arrays:
+        fb = PureStorageFlashBlade(
+            array.url, array.api_token, array.timeout, array.name
+        )
+        lines.append(f"Array: {array.name}")
+        lines.extend(f"  {x}" for x in format_plan(plan_configured(fb, array)))
+
+    return lines
+
+
+def rotate_array(array):
+    """Given one of FB_ARRAYS, rotate its users with a client of its own.
+    Returns a dict of user name to outcome.
+    """
+
+    if not (array.interesting_users or streams_users() or config.interesting_users):
+        logger.error("No Interesting Users are configured. Array: %s", array.name)
+        return {}
+
+    fb = PureStorageFlashBlade(array.url, array.api_token, array.timeout, array.name)
+
+    return rotate_configured(fb, array)
+
+
+def rotate_arrays(arrays):
+    """Rotate the given arrays concurrently, isolating any failure
+    from the other arrays.  Returns a dict of array name to outcomes,
+    and the names of the arrays that failed.
+    """
+
+    results = {}
+    failed = []
+
+    with ThreadPoolExecutor(len(arrays)) as executor:
+        futures = [
+            (array, executor.submit(tracing.propagate(rotate_array), array))
+            for array in arrays
+        ]
+
+    for array, future in futures:
+        try:
+            results[array.name] = future.result()
+
+        except Exception:
+            logger.error(format_stacktrace())
+            logger.error("Rotation failed. Array: %s", array.name)
+            results[array.name] = {x: FAILED for x in configured_users(array)}
+            failed.append(array.name)
+
+    return results, failed
+
+
+def main_arrays(arrays):
+    """Rotate each of FB_ARRAYS, logging a summary per array.
+    Raises RuntimeError once every array has finished if any failed.
+    """
+
+    try:
+        results, failed = rotate_arrays(arrays)
+
+    finally:
+        metrics.dump()
+
+    summaries = {}
+    for array_name, outcomes in results.items():
+        summaries[array_name] = summarise(outcomes)
+        log_summary(summaries[array_name], array_name)
+
+    if config.k8s_mode:
+        from cobalt_purestorage import k8s
+
+        k8s.log_k8s_stats()
+
+    if failed:
+        raise RuntimeError(f"Rotation failed on arrays: {', '.join(failed)}")
+
+    return summaries
 
 
 def main():
     """Main logic flow."""
 
-    if not config.interesting_users:
+    if config.fb_arrays:
+        return main_arrays(config.fb_arrays)
+
+    if not (streams_users() or config.interesting_users):
         logger.error("No Interesting Users are configured, exiting...")
         return
 
-    fb = PureStorageFlashBlade()
-
-    for user_name in config.interesting_users:
-        logger.debug(f"Begin operations for user: {user_name}")
-        # check username is valid
-        if not fb.object_store_user_exists(user_name):
-            logger.error(f"User {user_name} does not appear to be a valid user...")
-            continue
-
-        if keys := fb.get_access_keys_for_user(user_name):
-            logger.debug(f"Keys for user {user_name}: {keys}")
-            # sort keys to identify the oldest key for deletion
-            sorted_keys = sorted(keys, key=lambda d: d["created"])
-
-            # if existing key not too young create a new key
-            if len(keys) == 1:
-                logger.info(f"One key found. User: {user_name}")
-
-                if not key_too_recent(keys):
-                    if credentials := fb.post_object_store_access_keys(user_name):
-                        logger.info(
-                            f"New key created. User: {user_name}, Key: {credentials['name']}"
-                        )
-                        update_credentials(
-                            generate_aws_credentials(credentials), user_name
-                        )
-                else:
-                    logger.warning(f"Keys are too young, ignoring. User: {user_name}")
-
-            # if existing keys not too young, delete oldest then create new
-            if len(keys) == 2:
-                logger.info(f"Two keys found. User: {user_name}")
-
-                if not key_too_recent(keys):
-                    fb.delete_object_store_access_keys([sorted_keys[0]["name"]])
-                    logger.info(
-                        f"Oldest key deleted. User: {user_name}, Key: {sorted_keys[0]['name']}"
-                    )
-                    if credentials := fb.post_object_store_access_keys(user_name):
-                        logger.info(
-                            f"New key created. User: {user_name}, Key: {credentials['name']}"
-                        )
-                        update_credentials(
-                            generate_aws_credentials(credentials), user_name
-                        )
-
-                else:
-                    logger.warning(f"Keys are too young, ignoring. User: {user_name}")
-
-            # hmmm, the FlashBlade only allows a max of two keys per user
-            if len(keys) > 2:
-                logger.warning(f"More than two keys found. User: {user_name}")
-
-        else:
-            # no keys, create a new one
-            logger.info(f"No keys found. User: {user_name}")
-            if credentials := fb.post_object_store_access_keys(user_name):
-                logger.info(
-                    f"New key created. User: {user_name}, Key: {credentials['name']}"
-                )
-                update_credentials(generate_aws_credentials(credentials), user_name)
+    try:
+        outcomes = rotate_configured()
+
+    finally:
+        # a failed run's metrics are the most useful ones
+        metrics.dump()
+
+    summary = summarise(outcomes)
+    log_summary(summary)
+
+    if config.k8s_mode:
+        from cobalt_purestorage import k8s
+
+        k8s.log_k8s_stats()
+
+    return summary
@@ -0,0 +1,34 @@
+""" Sharding Module """
+
+import hashlib
+
+from cobalt_purestorage.configuration import config
+
+
+def shard_of(user_name, shard_count):
+    """Return the index of the shard that owns the user.  Unlike hash(),
+    the hash is the same in every process, so replicas agree.
+    """
+
+    digest = hashlib.blake2b(user_name.encode("utf-8"), digest_size=8).digest()
+
+    return int.from_bytes(digest, "big") % shard_count
+
+
+def owns(user_name, shard_index=None, shard_count=None):
+    """Return True if a shard, by default SHARD_INDEX of SHARD_COUNT,
+    owns the user
+    """
+
+    shard_index = config.shard_index if shard_index is None else shard_index
+    shard_count = shard_count or config.shard_count
+
+    return shard_count == 1 or shard_of(user_name, shard_count) == shard_index
+
+
+def owned_users(user_names, shard_index=None, shard_count=None):
+    """Return the set of the given users owned by a shard,
+    by default SHARD_INDEX of SHARD_COUNT
+    """
+
+    return {x for x in user_names if owns(x, shard_index, shard_count)}
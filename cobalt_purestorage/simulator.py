@@ -0,0 +1,706 @@
+""" FlashBlade Simulator Module """
+
+import base64
+import datetime
+import fnmatch
+import json
+import logging
+import math
+import os
+import random
+import re
+import secrets
+import ssl
+import string
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from cobalt_purestorage.logging_utils import configure_logging
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
+# the REST API versions the simulator claims to support
+API_VERSIONS = ["1.0", "2.0", "2.1", "2.2", "2.3", "2.4", "2.5", "2.6", "2.7", "2.8"]
+
+# the FlashBlade allows at most two access keys per user
+MAX_KEYS_PER_USER = 2
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "exponential", "lognormal")
+
+FILTER_TOKEN = re.compile(
+    r"""\s*(?:(?P<paren>[()])|(?P<op>!=|=)|(?P<string>'[^']*'|"[^"]*")|(?P<word>[\w.]+))"""
+)
+
+
+def write_self_signed_cert(directory):
+    """Write a self signed certificate for localhost to the given directory,
+    returning the certificate and key paths
+    """
+
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "localhost")])
+    now = datetime.datetime.utcnow()
+    cert = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(minutes=5))
+        .not_valid_after(now + datetime.timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+
+    cert_path = os.path.join(directory, "cert.pem")
+    key_path = os.path.join(directory, "key.pem")
+
+    with open(cert_path, "wb") as f:
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+
+    with open(key_path, "wb") as f:
+        f.write(
+            key.private_bytes(
+                serialization.Encoding.PEM,
+                serialization.PrivateFormat.PKCS8,
+                serialization.NoEncryption(),
+            )
+        )
+
+    return cert_path, key_path
+
+
+def parse_filter(expression):
+    """Given a FlashBlade filter such as 'name="a" or user.name="b*"',
+    return a function testing whether an item matches it.
+    Supports = and != on string values, * wildcards,
+    and, or, not and parentheses.
+    """
+
+    tokens = []
+    position = 0
+    expression = expression.rstrip()
+
+    while position < len(expression):
+        if not (match := FILTER_TOKEN.match(expression, position)):
+            raise ValueError(f"Invalid filter: {expression}")
+        tokens.append((match.lastgroup, match[match.lastgroup]))
+        position = match.end()
+
+    tokens.append((None, None))
+    index = 0
+
+    def peek(*values):
+        return tokens[index][1] in values
+
+    def take():
+        nonlocal index
+        index += 1
+        return tokens[index - 1]
+
+    def expect(kind):
+        token_kind, value = take()
+        if token_kind != kind:
+            raise ValueError(f"Invalid filter: {expression}")
+        return value
+
+    def parse_or():
+        predicates = [parse_and()]
+        while peek("or"):
+            take()
+            predicates.append(parse_and())
+
+        if len(predicates) == 1:
+            return predicates[0]
+
+        # a field compared with many values is a set lookup
+        lookups = [getattr(x, "lookup", None) for x in predicates]
+        if all(lookups) and len({field for field, _ in lookups}) == 1:
+            return equals(lookups[0][0], set().union(*(x for _, x in lookups)))
+
+        return lambda item: any(x(item) for x in predicates)
+
+    def parse_and():
+        predicates = [parse_not()]
+        while peek("and"):
+            take()
+            predicates.append(parse_not())
+
+        if len(predicates) == 1:
+            return predicates[0]
+
+        return lambda item: all(x(item) for x in predicates)
+
+    def parse_not():
+        if peek("not"):
+            take()
+            predicate = parse_not()
+            return lambda item: not predicate(item)
+
+        if peek("("):
+            take()
+            predicate = parse_or()
+            if take()[1] != ")":
+                raise ValueError(f"Invalid filter: {expression}")
+            return predicate
+
+        return parse_comparison()
+
+    def parse_comparison():
+        field = expect("word")
+        op = expect("op")
+        pattern = expect("string")[1:-1]
+
+        if op == "=" and "*" not in pattern:
+            return equals(field, {pattern})
+
+        def predicate(item):
+            value = field_value(item, field)
+            matched = value is not None and fnmatch.fnmatchcase(str(value), pattern)
+            return matched if op == "=" else not matched
+
+        return predicate
+
+    predicate = parse_or()
+
+    if take()[0] is not None:
+        raise ValueError(f"Invalid filter: {expression}")
+
+    return predicate
+
+
+def equals(field, values):
+    """Return a filter predicate matching items whose field is one of values.
+    The predicate's lookup attribute lets callers use an index instead.
+    """
+
+    def predicate(item):
+        return str(field_value(item, field)) in values
+
+    predicate.lookup = (field, values)
+
+    return predicate
+
+
+def field_value(item, field):
+    """Given an item and a dotted field name, return the field's value"""
+
+    for part in field.split("."):
+        if not isinstance(item, dict):
+            return None
+        item = item.get(part)
+
+    return item
+
+
+class Latency:
+    """Samples simulated response times, in seconds.
+    spread is the half width of a uniform distribution,
+    or the standard deviation of a lognormal one.
+    """
+
+    def __init__(self, distribution="fixed", mean=0.0, spread=0.0):
+        if distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution: {distribution}")
+
+        self.distribution = distribution
+        self.mean = mean
+        self.spread = spread
+
+    def sample(self):
+        """Return a response time in seconds"""
+
+        if self.mean <= 0:
+            return 0.0
+
+        if self.distribution == "uniform":
+            return random.uniform(
+                max(0, self.mean - self.spread), self.mean + self.spread
+            )
+
+        if self.distribution == "exponential":
+            return random.expovariate(1 / self.mean)
+
+        if self.distribution == "lognormal":
+            # spread is the standard deviation of the response time
+            sigma = math.sqrt(math.log(1 + (self.spread / self.mean) ** 2))
+            return random.lognormvariate(math.log(self.mean) - sigma**2 / 2, sigma)
+
+        return self.mean
+
+
+class TokenBucket:
+    """Allows rate requests a second, with bursts of up to burst requests"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or rate
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self):
+        """Return True if a request is allowed"""
+
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(
+                self.burst, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+
+            if self.tokens < 1:
+                return False
+
+            self.tokens -= 1
+            return True
+
+
+class SimulatorError(Exception):
+    """Raised to return an error response"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class FlashBladeSimulator:
+    """In memory object store users and access keys,
+    with configurable latency, error rate and throttling
+    """
+
+    def __init__(
+        self,
+        api_token=None,
+        latency=None,
+        error_rate=0.0,
+        error_status=503,
+        rate_limit=0,
+        max_page_size=1000,
+    ):
+        self.api_token = api_token
+        self.latency = latency or Latency()
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.bucket = TokenBucket(rate_limit) if rate_limit else None
+        self.max_page_size = max_page_size
+        self.users = {}
+        self.keys = {}
+        self.user_keys = {}
+        self.sessions = set()
+        self.requests = Counter()
+        self.started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def add_user(self, name, key_ages=()):
+        """Add an object store user, with keys of the given ages in seconds"""
+
+        account = name.split("/")[0]
+
+        with self._lock:
+            self.users[name] = {
+                "name": name,
+                "id": str(uuid.uuid4()),
+                "account": {
+                    "name": account,
+                    "id": str(uuid.uuid5(uuid.NAMESPACE_DNS, account)),
+                    "resource_type": "object-store-accounts",
+                },
+                "created": int(time.time() * 1000),
+            }
+            self.user_keys[name] = []
+
+            for age in key_ages:
+                self._create_key(name, int((time.time() - age) * 1000))
+
+    def populate(self, count, prefix="simulator/user", key_ages=()):
+        """Add count users named prefix00000, prefix00001 and so on"""
+
+        for i in range(count):
+            self.add_user(f"{prefix}{i:05d}", key_ages)
+
+    def _create_key(self, user_name, created):
+        """Create a key, the lock must be held"""
+
+        user = self.users[user_name]
+        key = {
+            "name": f"PSFB{''.join(random.choices(string.ascii_uppercase, k=20))}",
+            "created": created,
+            "enabled": True,
+            "secret_access_key": secrets.token_urlsafe(30),
+            "user": {
+                "name": user_name,
+                "id": user["id"],
+                "resource_type": "object-store-users",
+            },
+        }
+        self.keys[key["name"]] = key
+        self.user_keys[user_name].append(key["name"])
+
+        return key
+
+    def _user_view(self, user):
+        """Return a user as listed by the array, the lock must be held"""
+
+        access_keys = [
+            {"name": x, "resource_type": "object-store-access-keys"}
+            for x in self.user_keys[user["name"]]
+        ]
+
+        return {**user, "access_keys": access_keys}
+
+    def _key_view(self, key):
+        """Return a key as listed by the array, without its secret"""
+
+        return {k: v for k, v in key.items() if k != "secret_access_key"}
+
+    def login(self, api_token):
+        """Exchange an api token for a session token"""
+
+        if not api_token or self.api_token not in (None, api_token):
+            raise SimulatorError(401, "invalid api token")
+
+        session = secrets.token_hex(16)
+        with self._lock:
+            self.sessions.add(session)
+
+        return session
+
+    def authenticated(self, session):
+        with self._lock:
+            return session in self.sessions
+
+    def list_users(self, params):
+        predicate = self._filter(params)
+        lookup = getattr(predicate, "lookup", None)
+
+        with self._lock:
+            if lookup and lookup[0] == "name":
+                users = [self.users[x] for x in lookup[1] if x in self.users]
+            else:
+                users = self.users.values()
+
+            users = [self._user_view(x) for x in users]
+
+        return self._page(users, params, predicate)
+
+    def list_keys(self, params):
+        predicate = self._filter(params)
+        lookup = getattr(predicate, "lookup", None)
+
+        with self._lock:
+            if lookup and lookup[0] == "user.name":
+                names = [y for x in lookup[1] for y in self.user_keys.get(x, [])]
+                keys = [self.keys[x] for x in names]
+            else:
+                keys = self.keys.values()
+
+            keys = [self._key_view(x) for x in keys]
+
+        return self._page(keys, params, predicate)
+
+    def create_key(self, params, body):
+        """Create a key for the user named in the request body"""
+
+        user_ref = (body or {}).get("user") or {}
+
+        with self._lock:
+            user_name = user_ref.get("name") or next(
+                (x for x, u in self.users.items() if u["id"] == user_ref.get("id")),
+                None,
+            )
+
+            if user_name not in self.users:
+                raise SimulatorError(400, "object store user does not exist")
+
+            if len(self.user_keys[user_name]) >= MAX_KEYS_PER_USER:
+                raise SimulatorError(
+                    400, "object store user already has the maximum number of keys"
+                )
+
+            key = self._create_key(user_name, int(time.time() * 1000))
+
+        return {"items": [key]}
+
+    def delete_keys(self, params):
+        """Delete the keys named in the request"""
+
+        names = self._names(params)
+        if not names:
+            raise SimulatorError(400, "names must be specified")
+
+        with self._lock:
+            if missing := [x for x in names if x not in self.keys]:
+                raise SimulatorError(400, f"access keys do not exist: {missing}")
+
+            for name in names:
+                key = self.keys.pop(name)
+                self.user_keys[key["user"]["name"]].remove(name)
+
+        return None
+
+    def _names(self, params):
+        return [x for value in params.get("names", []) for x in value.split(",") if x]
+
+    def _filter(self, params):
+        """Return the request's filter predicate, or None"""
+
+        if not (filters := params.get("filter")):
+            return None
+
+        try:
+            return parse_filter(filters[0])
+        except ValueError as err:
+            raise SimulatorError(400, str(err))
+
+    def _page(self, items, params, predicate=None):
+        """Filter, sort and paginate the given items"""
+
+        if names := self._names(params):
+            existing = {x["name"] for x in items}
+            if missing := [x for x in names if x not in existing]:
+                raise SimulatorError(400, f"names do not exist: {missing}")
+            items = [x for x in items if x["name"] in set(names)]
+
+        if predicate:
+            items = [x for x in items if predicate(x)]
+
+        items.sort(key=lambda x: x["name"])
+
+        try:
+            limit = int(params.get("limit", [self.max_page_size])[0])
+            if token := params.get("continuation_token", [None])[0]:
+                # the SDK sends the token back quoted
+                if not (len(token) > 1 and token[0] == token[-1] == "'"):
+                    raise ValueError(token)
+                offset = int(base64.urlsafe_b64decode(token[1:-1].encode()))
+            else:
+                offset = int(params.get("offset", [0])[0])
+        except ValueError:
+            raise SimulatorError(400, "invalid pagination parameters")
+
+        limit = min(max(limit, 1), self.max_page_size)
+        page = items[offset : offset + limit]
+
+        continuation_token = None
+        if offset + limit < len(items):
+            continuation_token = base64.urlsafe_b64encode(
+                str(offset + limit).encode()
+            ).decode()
+
+        return {
+            "continuation_token": continuation_token,
+            "total_item_count": len(items),
+            "items": page,
+        }
+
+    def inject_faults(self):
+        """Apply throttling, latency and errors to an API call"""
+
+        if self.bucket and not self.bucket.take():
+            raise SimulatorError(429, "too many requests")
+
+        if delay := self.latency.sample():
+            time.sleep(delay)
+
+        if self.error_rate and random.random() < self.error_rate:
+            raise SimulatorError(self.error_status, "simulated error")
+
+    def rate_limit_headers(self):
+        """Return the headers sent with a throttled response.
+        pypureclient reads them to decide how long to back off,
+        the remaining minute limit tells it to wait a second.
+        """
+
+        return {
+            "X-RateLimit-Limit-second": str(self.bucket.rate),
+            "X-RateLimit-Remaining-second": "0",
+            "X-RateLimit-Limit-minute": str(self.bucket.rate * 60),
+            "X-RateLimit-Remaining-minute": "1",
+        }
+
+    def record(self, method, endpoint, status):
+        with self._lock:
+            self.requests[(method, endpoint, status)] += 1
+
+    def log_stats(self):
+        """Log the requests served, and the rate they were served at"""
+
+        with self._lock:
+            requests = dict(self.requests)
+
+        elapsed = time.monotonic() - self.started
+        total = sum(requests.values())
+        logger.info(
+            "Served %s requests in %.1fs, %.1f/s",
+            total,
+            elapsed,
+            total / max(elapsed, 1e-9),
+        )
+        for (method, endpoint, status), count in sorted(requests.items()):
+            logger.info("%s %s %s: %s", method, endpoint, status, count)
+
+
+class SimulatorHandler(BaseHTTPRequestHandler):
+    """Serves the FlashBlade REST API from a FlashBladeSimulator"""
+
+    # keep connections alive, as the array does
+    protocol_version = "HTTP/1.1"
+
+    api_path = re.compile(r"^/api/2\.\d+/(?P<endpoint>[\w-]+)$")
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+    def _handle(self, method):
+        simulator = self.server.simulator
+        url = urlsplit(self.path)
+        params = parse_qs(url.query)
+        body = self._read_body()
+        endpoint = url.path
+
+        headers = None
+
+        try:
+            if method == "GET" and url.path == "/api/api_version":
+                status, data = 200, {"versions": API_VERSIONS}
+
+            elif method == "POST" and url.path == "/api/login":
+                session = simulator.login(self.headers.get("api-token"))
+                status, data = 200, {"username": "simulator"}
+                headers = {"x-auth-token": session}
+
+            elif match := self.api_path.match(url.path):
+                endpoint = match["endpoint"]
+                status, data = 200, self._api(simulator, method, endpoint, params, body)
+
+            else:
+                raise SimulatorError(404, "not found")
+
+        except SimulatorError as err:
+            status = err.status
+            if status == 429:
+                # throttling errors come from the API gateway, in its format
+                data, headers = {"message": err.message}, simulator.rate_limit_headers()
+            else:
+                data = {"errors": [{"message": err.message}]}
+
+        self._reply(status, data, headers)
+        simulator.record(method, endpoint, status)
+
+    def _api(self, simulator, method, endpoint, params, body):
+        if not simulator.authenticated(self.headers.get("x-auth-token")):
+            raise SimulatorError(401, "invalid session")
+
+        simulator.inject_faults()
+
+        if endpoint == "object-store-users" and method == "GET":
+            return simulator.list_users(params)
+
+        if endpoint == "object-store-access-keys":
+            if method == "GET":
+                return simulator.list_keys(params)
+            if method == "POST":
+                return simulator.create_key(params, body)
+            if method == "DELETE":
+                return simulator.delete_keys(params)
+
+        raise SimulatorError(404, "not found")
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return None
+
+        try:
+            return json.loads(self.rfile.read(length))
+        except ValueError:
+            return None
+
+    def _reply(self, status, data, headers=None):
+        body = b"" if data is None else json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+
+class SimulatorServer(ThreadingHTTPServer):
+    """HTTPS server for a FlashBladeSimulator"""
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, simulator, host="127.0.0.1", port=0):
+        super().__init__((host, port), SimulatorHandler)
+        self.simulator = simulator
+
+        with tempfile.TemporaryDirectory() as directory:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(*write_self_signed_cert(directory))
+
+        self.socket = context.wrap_socket(self.socket, server_side=True)
+
+    @property
+    def url(self):
+        """The address to set FB_URL to"""
+
+        host, port = self.server_address[:2]
+        return f"{host}:{port}"
+
+
+@contextmanager
+def running(simulator, host="127.0.0.1", port=0):
+    """Serve the simulator from a background thread, yielding its address"""
+
+    server = SimulatorServer(simulator, host, port)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    try:
+        yield server.url
+
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def main(host, port, simulator):
+    """Serve the simulator until interrupted"""
+
+    server = SimulatorServer(simulator, host, port)
+    logger.info("FlashBlade simulator listening on %s", server.url)
+
+    try:
+        server.serve_forever()
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        server.server_close()
+        simulator.log_stats()
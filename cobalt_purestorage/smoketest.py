@@ -1,18 +1,279 @@
 """ Smoketest Module """
 
+import json
 import logging
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
 
-from cobalt_purestorage.configuration import config
+from cobalt_purestorage.configuration import Settings, config
+from cobalt_purestorage.logging_utils import configure_logging
 
-logging.basicConfig(level=config.log_level)
+configure_logging()
 logger = logging.getLogger(__name__)
 
+BASELINE_PATH = Path(__file__).parent / "smoketest_baseline.json"
 
-def main():
-    """A simple smoketest function that can be exended.
-    Intended to be used to verify docker image has been
-    correctly built.
+# the modules a rotation run imports, including those imported lazily
+IMPORTED_MODULES = (
+    "cobalt_purestorage.cli",
+    "cobalt_purestorage.rotator",
+    "cobalt_purestorage.daemon",
+    "cobalt_purestorage.k8s",
+    "pypureclient.flashblade",
+    "kubernetes",
+)
+
+# timings this close to their baseline are noise, whatever the ratio
+NOISE_FLOOR = 0.01
+
+# the timing the others are compared relative to, so the baseline holds
+# on hosts faster or slower than the one that wrote it
+REFERENCE = "interpreter_start"
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|\s*(\S+)")
+
+
+def best_of(repeat, func):
+    """Call func repeat times, returning the shortest duration in seconds"""
+
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+
+    return min(durations)
+
+
+def time_interpreter_start(repeat):
+    """Return how long a bare interpreter takes to start and exit"""
+
+    return best_of(repeat, lambda: subprocess.run([sys.executable, "-c", "pass"]))
+
+
+def parse_importtime(output, modules):
+    """Given the stderr of python -X importtime,
+    return a dict of module to cumulative import time in seconds
+    """
+
+    times = {}
+    for line in output.splitlines():
+        if (match := IMPORTTIME_LINE.match(line)) and match[3] in modules:
+            times[match[3]] = int(match[2]) / 1_000_000
+
+    return times
+
+
+def time_import(module):
+    """Import the given module in a fresh interpreter,
+    returning its cumulative import time in seconds
+    """
+
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+
+    if proc.returncode != 0:
+        logger.error(proc.stderr)
+        raise RuntimeError(f"Could not import {module}")
+
+    return parse_importtime(proc.stderr, (module,))[module]
+
+
+def time_imports(modules):
+    """Import each of the given modules in an interpreter of its own, so
+    that none is timed as already imported by another, returning a dict
+    of module to cumulative import time in seconds
+    """
+
+    return {x: time_import(x) for x in modules}
+
+
+@contextmanager
+def override(**settings):
+    """Temporarily override configuration settings"""
+
+    saved = {x: getattr(config, x) for x in settings}
+    for name, value in settings.items():
+        setattr(config, name, value)
+
+    try:
+        yield
+
+    finally:
+        for name, value in saved.items():
+            setattr(config, name, value)
+
+
+@contextmanager
+def stand_in_kubeconfig(server="https://127.0.0.1:6443"):
+    """Write a kubeconfig for a local cluster, yielding its path.
+    Creating a client does not contact the cluster.
+    """
+
+    kubeconfig = {
+        "apiVersion": "v1",
+        "kind": "Config",
+        "current-context": "smoketest",
+        "clusters": [
+            {
+                "name": "smoketest",
+                "cluster": {"server": server, "insecure-skip-tls-verify": True},
+            }
+        ],
+        "users": [{"name": "smoketest", "user": {"token": "smoketest"}}],
+        "contexts": [
+            {
+                "name": "smoketest",
+                "context": {"cluster": "smoketest", "user": "smoketest"},
+            }
+        ],
+    }
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "kubeconfig")
+        with open(path, "w") as f:
+            # JSON is valid YAML
+            json.dump(kubeconfig, f)
+
+        yield path
+
+
+def time_flashblade_client(repeat):
+    """Return how long a FlashBlade client takes to create
+    against the FlashBlade simulator
+    """
+
+    from cobalt_purestorage import simulator
+    from cobalt_purestorage.pure_storage import PureStorageFlashBlade
+
+    fb = simulator.FlashBladeSimulator(api_token="smoketest")
+
+    with simulator.running(fb) as url, override(
+        fb_url=url, api_token="smoketest", verify_fb_tls=False
+    ):
+        # the first client pays for importing pypureclient
+        PureStorageFlashBlade()
+        return best_of(repeat, PureStorageFlashBlade)
+
+
+def time_k8s_client(repeat):
+    """Return how long a kubernetes client takes to create
+    from a local kubeconfig
+    """
+
+    from cobalt_purestorage.k8s import K8S
+
+    with stand_in_kubeconfig() as path, override(kubeconfig=path):
+        K8S()
+        return best_of(repeat, K8S)
+
+
+def measure(repeat):
+    """Run the start up benchmark, returning a dict of timing name to seconds"""
+
+    results = {"interpreter_start": time_interpreter_start(repeat)}
+
+    for module, seconds in time_imports(IMPORTED_MODULES).items():
+        results[f"import {module}"] = seconds
+
+    results["settings"] = best_of(repeat, Settings)
+    results["flashblade_client"] = time_flashblade_client(repeat)
+    results["k8s_client"] = time_k8s_client(repeat)
+
+    return results
+
+
+def load_baseline(path):
+    """Load the baseline timings"""
+
+    with open(path) as f:
+        return json.load(f)
+
+
+def host_speed(results, baseline):
+    """Return how many times slower this host is than the one that wrote
+    the baseline, by their interpreter start times, or 1 if unknown
+    """
+
+    if results.get(REFERENCE) and baseline.get(REFERENCE):
+        return results[REFERENCE] / baseline[REFERENCE]
+
+    return 1.0
+
+
+def regressions(results, baseline, threshold):
+    """Given timings and their baseline, return the names of the timings
+    that exceeded the baseline by more than the threshold factor, once
+    the baseline is scaled to the speed of this host
+    """
+
+    speed = host_speed(results, baseline)
+    logger.info("Host speed relative to the baseline: %.2fx", speed)
+
+    exceeded = []
+    for name, seconds in sorted(results.items()):
+        if name == REFERENCE:
+            continue
+
+        if name not in baseline:
+            logger.warning("No baseline for %s", name)
+            continue
+
+        expected = baseline[name] * speed
+        limit = max(expected * threshold, expected + NOISE_FLOOR)
+        if seconds > limit:
+            exceeded.append(name)
+
+    return exceeded
+
+
+def main(write_baseline=None):
+    """Benchmark start up: interpreter start, imports, settings and
+    client construction.  Fails if any timing exceeds its baseline by
+    more than SMOKETEST_THRESHOLD, to catch cold start regressions in
+    the docker image.  Returns the timings.
     """
 
     logger.debug("Running smoketest function")
-    return None
+
+    results = measure(config.smoketest_repeat)
+
+    for name, seconds in results.items():
+        logger.info("%s: %.1fms", name, seconds * 1000)
+
+    if write_baseline:
+        with open(write_baseline, "w") as f:
+            json.dump(
+                {x: round(y, 6) for x, y in results.items()},
+                f,
+                indent=2,
+                sort_keys=True,
+            )
+            f.write("\n")
+        logger.info("Wrote baseline to %s", write_baseline)
+        return results
+
+    baseline = load_baseline(config.smoketest_baseline or BASELINE_PATH)
+
+    if exceeded := regressions(results, baseline, config.smoketest_threshold):
+        speed = host_speed(results, baseline)
+        for name in exceeded:
+            logger.error(
+                "%s took %.1fms, baseline %.1fms scaled to this host",
+                name,
+                results[name] * 1000,
+                baseline[name] * speed * 1000,
+            )
+        raise RuntimeError("Start up is slower than the baseline")
+
+    logger.info("Start up is within the baseline")
+    return results
@@ -0,0 +1,116 @@
+""" Rotation State Module """
+
+import json
+import logging
+import os
+import tempfile
+import threading
+
+from cobalt_purestorage import inventory
+from cobalt_purestorage.configuration import config
+from cobalt_purestorage.logging_utils import configure_logging, format_stacktrace
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
+STATE_VERSION = 1
+
+# arrays rotated concurrently share the state file
+_file_lock = threading.Lock()
+
+
+def read_state(path):
+    """Return the recorded users of every array in the state file,
+    or nothing if it is missing, unreadable or from another version
+    """
+
+    try:
+        with open(path) as f:
+            data = json.load(f)
+
+    except FileNotFoundError:
+        return {}
+
+    except (OSError, ValueError):
+        logger.error(format_stacktrace())
+        logger.warning("Ignoring unreadable state file %s", path)
+        return {}
+
+    if data.get("version") != STATE_VERSION:
+        logger.warning("Ignoring state file %s from another version", path)
+        return {}
+
+    return data["arrays"]
+
+
+class RotationState:
+    """What was last seen of each user's keys on an array, so that users
+    whose keys cannot be old enough to rotate are not looked up.
+    Users are revalidated against the array once their record is
+    older than STATE_MAX_AGE.
+    """
+
+    def __init__(self, path, array):
+        self.path = path
+        self.array = array
+        self.users = read_state(path).get(array, {})
+
+    def not_due(self, user_names, now):
+        """Return a dict of user name to the epoch time of the user's
+        newest key, for the users that are provably not due
+        """
+
+        not_due = {}
+
+        for user_name in user_names:
+            if not (record := self.users.get(user_name)):
+                continue
+
+            if now - record["checked"] >= config.state_max_age:
+                continue
+
+            min_age, variance = inventory.key_age(user_name)
+            if now - record["newest_key"] < min_age - variance:
+                not_due[user_name] = record["newest_key"]
+
+        return not_due
+
+    def record(self, user_name, newest_key, now, published=None):
+        """Record a user's newest key, as checked against the array now"""
+
+        record = self.users.setdefault(user_name, {})
+        record.update(newest_key=newest_key, checked=now)
+
+        if published:
+            record["published"] = published
+
+    def forget(self, user_name):
+        """Look the user up again next run"""
+
+        self.users.pop(user_name, None)
+
+    def save(self):
+        """Write this array's records to the state file, leaving other
+        arrays' records as they are.  Failures are logged rather than
+        failing the run.
+        """
+
+        directory = os.path.dirname(os.path.abspath(self.path))
+
+        with _file_lock:
+            arrays = read_state(self.path)
+            arrays[self.array] = self.users
+
+            try:
+                with tempfile.NamedTemporaryFile("w", dir=directory, delete=False) as f:
+                    json.dump(
+                        {"version": STATE_VERSION, "arrays": arrays},
+                        f,
+                        separators=(",", ":"),
+                    )
+                # replaced in one step, a crash never leaves a partial file
+                os.replace(f.name, self.path)
+
+            except OSError:
+                logger.error(format_stacktrace())
+                logger.error("Could not write state file %s", self.path)
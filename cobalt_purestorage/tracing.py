@@ -0,0 +1,172 @@
+""" Tracing Module """
+
+import contextvars
+import json
+import logging
+import random
+import threading
+import time
+
+from cobalt_purestorage.configuration import config
+from cobalt_purestorage.logging_utils import configure_logging
+
+configure_logging()
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar("cobalt_span", default=None)
+_tracers = {}
+_tracers_lock = threading.Lock()
+
+
+class NoopSpan:
+    """Stands in for a span when tracing is disabled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set_attribute(self, key, value):
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class JsonSpan:
+    """A span written as a line of JSON when it ends"""
+
+    def __init__(self, tracer, name, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = dict(attributes)
+        self.parent = _current.get()
+        self.trace_id = (
+            self.parent.trace_id if self.parent else f"{random.getrandbits(128):032x}"
+        )
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.status = "ok"
+
+    def __enter__(self):
+        self.start = time.time()
+        self._started = time.perf_counter()
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        duration = time.perf_counter() - self._started
+        _current.reset(self._token)
+
+        if exc_type is not None:
+            self.status = "error"
+            self.attributes["exception"] = f"{exc_type.__name__}: {exc_value}"
+
+        self.tracer.export(
+            {
+                "name": self.name,
+                "trace_id": self.trace_id,
+                "span_id": self.span_id,
+                "parent_span_id": self.parent.span_id if self.parent else None,
+                "start": self.start,
+                "duration": duration,
+                "status": self.status,
+                "attributes": self.attributes,
+            }
+        )
+        return False
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+
+class JsonTracer:
+    """Appends finished spans to TRACING_FILE, one JSON object per line"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def span(self, name, attributes):
+        return JsonSpan(self, name, attributes)
+
+    def export(self, record):
+        line = json.dumps(record, default=str)
+
+        with self._lock, open(self.path, "a") as f:
+            f.write(f"{line}\n")
+
+
+class OtlpTracer:
+    """Exports spans with the OpenTelemetry SDK, configured by the
+    standard OTEL_EXPORTER_OTLP_* environment variables
+    """
+
+    def __init__(self):
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import (
+            OTLPSpanExporter,
+        )
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+        provider = TracerProvider(
+            resource=Resource.create({"service.name": config.tracing_service_name})
+        )
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+        self.tracer = provider.get_tracer(__name__)
+
+    def span(self, name, attributes):
+        return self.tracer.start_as_current_span(name, attributes=attributes)
+
+
+def get_tracer():
+    """Return the configured tracer, creating it on first use"""
+
+    key = (config.tracing_exporter, config.tracing_file)
+
+    with _tracers_lock:
+        if key not in _tracers:
+            if config.tracing_exporter == "otlp":
+                try:
+                    _tracers[key] = OtlpTracer()
+                except ImportError:
+                    raise RuntimeError(
+                        "OTLP tracing needs the tracing extra to be installed"
+                    )
+            else:
+                _tracers[key] = JsonTracer(config.tracing_file)
+
+            logger.info("Exporting traces with %s", config.tracing_exporter)
+
+        return _tracers[key]
+
+
+def span(name, **attributes):
+    """Return a context manager timing the enclosed block as a span,
+    a child of the current span.  Costs a single check when tracing
+    is disabled.
+    """
+
+    if not config.tracing_exporter:
+        return NOOP_SPAN
+
+    return get_tracer().span(name, attributes)
+
+
+def propagate(func):
+    """Wrap func to run in a copy of the current context, so the spans
+    a worker thread starts are children of the submitting span.
+    Each submission needs its own wrapper, a context cannot be entered
+    by two threads at once.
+    """
+
+    if not config.tracing_exporter:
+        return func
+
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return context.run(func, *args, **kwargs)
+
+    return run
@@ -0,0 +1,5 @@
+#!/bin/bash
+
+set -eu
+
+python -m pytest tests/benchmarks --benchmark-enable --no-cov --log-cli-level=WARNING "$@"
@@ -0,0 +1,73 @@
+""" Benchmark Setup Module """
+
+import logging
+
+import pytest
+
+from cobalt_purestorage.models import AccessKey
+
+# extra measurements of each benchmark, reported after the run
+REPORT = []
+
+
+@pytest.fixture
+def synthetic_users(mock_data):
+    """Return a function building count users, and their keys,
+    by cycling through the users of mock_data.  Keys are AccessKey
+    models, as the FlashBlade client returns them.
+    """
+
+    templates = mock_data["users"]
+    keys = {}
+    for key in mock_data["access_keys"]:
+        keys.setdefault(key["user"]["name"], []).append(key)
+
+    def build(count):
+        users = []
+        user_keys = {}
+
+        for i in range(count):
+            template = templates[i % len(templates)]
+            user_name = f"{template['name']}-{i}"
+            users.append(user_name)
+            user_keys[user_name] = [
+                AccessKey(f"{x['name']}-{i}", x["created"], user_name)
+                for x in keys.get(template["name"], [])
+            ]
+
+        return users, user_keys
+
+    return build
+
+
+@pytest.fixture(autouse=True)
+def quiet_logging():
+    """Keep per user logging out of the timings and memory"""
+
+    logger = logging.getLogger("cobalt_purestorage")
+    level = logger.level
+    logger.setLevel(logging.ERROR)
+
+    yield
+
+    logger.setLevel(level)
+
+
+@pytest.fixture
+def report():
+    """Return a function recording a benchmark's extra measurements"""
+
+    return REPORT.append
+
+
+def pytest_terminal_summary(terminalreporter):
+    """Print the extra measurements of each benchmark"""
+
+    if not REPORT:
+        return
+
+    terminalreporter.section("benchmark extra info")
+    for row in REPORT:
+        terminalreporter.write_line(
+            ", ".join(f"{name}: {value:g}" for name, value in row.items())
+        )
@@ -0,0 +1,93 @@
+""" Benchmark Models Module """
+
+import time
+import tracemalloc
+from operator import attrgetter, itemgetter
+
+import pytest
+
+import cobalt_purestorage.rotator as rotator
+from cobalt_purestorage.models import AccessKey
+
+KEYS = 100_000
+
+# the untimed run of the normal test suite only needs a sample
+SAMPLE_KEYS = 10_000
+MIN_AGE = 3600
+
+
+def payloads(count):
+    """Yield count access keys as the FlashBlade client's to_dict()
+    returns them, spread over an hour either side of MIN_AGE
+    """
+
+    now = int(time.time() * 1000)
+
+    for i in range(count):
+        yield {
+            "name": f"PSFB{i:031X}",
+            "created": now - (i % 7200) * 1000,
+            "enabled": True,
+            "secret_access_key": None,
+            "user": {
+                "id": f"{i // 2:032x}",
+                "name": f"benchmark/user{i // 2}",
+                "resource_type": "object-store-users",
+            },
+        }
+
+
+def scan_dicts(keys):
+    """The rotator's scan of a user's keys, over to_dict() payloads"""
+
+    curr_ts = int(time.time())
+    too_recent = [x for x in keys if (curr_ts - (x["created"] / 1000)) < MIN_AGE]
+
+    return bool(too_recent), min(keys, key=itemgetter("created"))["name"]
+
+
+def scan_models(keys):
+    """The rotator's scan of a user's keys, over AccessKey models"""
+
+    too_recent = rotator.key_too_recent(keys, MIN_AGE, 0)
+
+    return too_recent, min(keys, key=attrgetter("created")).name
+
+
+def retained(build):
+    """Return what build() returns, and the memory it still holds"""
+
+    tracemalloc.start()
+    result = build()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return result, current
+
+
+@pytest.mark.parametrize(
+    "convert,scan",
+    [
+        pytest.param(dict, scan_dicts, id="dict"),
+        pytest.param(AccessKey.from_dict, scan_models, id="model"),
+    ],
+)
+def test_access_keys(benchmark, report, convert, scan):
+    """Benchmark holding and scanning 100k keys as dicts or models,
+    reporting the memory retained per 100k keys
+    """
+
+    count = SAMPLE_KEYS if benchmark.disabled else KEYS
+    keys, memory = retained(lambda: [convert(x) for x in payloads(count)])
+
+    benchmark.extra_info.update(
+        keys=count,
+        model=int(convert is not dict),
+        retained_mib_per_100k=memory / 2**20 * 100_000 / count,
+    )
+    report(benchmark.extra_info)
+
+    too_recent, oldest = scan(keys)
+    assert too_recent and oldest.startswith("PSFB")
+
+    benchmark(scan, keys)
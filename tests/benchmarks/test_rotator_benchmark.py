@@ -0,0 +1,163 @@
+""" Benchmark Rotator Module """
+
+import os
+import random
+import string
+import threading
+import time
+import tracemalloc
+from unittest.mock import patch
+
+import pytest
+
+import cobalt_purestorage.rotator as rotator
+from cobalt_purestorage import k8s
+from cobalt_purestorage.configuration import config
+from cobalt_purestorage.models import AccessKey
+from cobalt_purestorage.pure_storage import chunked
+
+SIZES = [10, 100, 1_000, 10_000]
+
+# simulated round trip latency of each call, in milliseconds
+FB_LATENCY = float(os.environ.get("BENCHMARK_FB_LATENCY", 1))
+K8S_LATENCY = float(os.environ.get("BENCHMARK_K8S_LATENCY", 1))
+
+# runs over more than 100 users are slow, so are opt in
+LARGE = os.environ.get("BENCHMARK_LARGE", "false").lower() == "true"
+
+
+class CallCounter:
+    """Counts calls, and simulates their latency"""
+
+    def __init__(self, latency):
+        self.latency = latency / 1000
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def call(self):
+        with self._lock:
+            self.calls += 1
+
+        if self.latency:
+            time.sleep(self.latency)
+
+
+class FakeFlashBlade(CallCounter):
+    """In memory stand in for PureStorageFlashBlade.
+    Bulk lookups make one call per filter chunk, as the real client does.
+    """
+
+    def __init__(self, users, keys, latency=FB_LATENCY):
+        super().__init__(latency)
+        self.users = set(users)
+        self.keys = {x: list(keys.get(x, [])) for x in self.users}
+        self.owners = {k.name: x for x, v in self.keys.items() for k in v}
+
+    def get_object_store_users_by_name(self, names):
+        for _ in chunked(names, config.fb_filter_chunk_size):
+            self.call()
+
+        return self.users & set(names)
+
+    def get_access_keys_for_users(self, names):
+        for _ in chunked(names, config.fb_filter_chunk_size):
+            self.call()
+
+        return {x: list(self.keys.get(x, [])) for x in names}
+
+    def post_object_store_access_keys(self, user_name):
+        self.call()
+
+        key = AccessKey(
+            f"PSFB{''.join(random.choices(string.ascii_uppercase, k=16))}",
+            int(time.time() * 1000),
+            user_name,
+            "***",
+        )
+        self.keys[user_name].append(key)
+        self.owners[key.name] = user_name
+
+        return key
+
+    def delete_object_store_access_keys(self, key_names):
+        self.call()
+
+        for key_name in key_names:
+            user_name = self.owners.pop(key_name)
+            self.keys[user_name] = [
+                x for x in self.keys[user_name] if x.name != key_name
+            ]
+
+        return True
+
+
+class FakeK8S(CallCounter):
+    """In memory stand in for the shared K8S service"""
+
+    def __init__(self, latency=K8S_LATENCY):
+        super().__init__(latency)
+        self.secrets = {}
+
+    def prefetch_secrets(self, namespace, secret_names):
+        self.call()
+        return set()
+
+    def update_secret(self, namespace, secret_name, secret_key, secret_body):
+        self.update_secret_data(namespace, secret_name, {secret_key: secret_body})
+
+    def update_secret_data(self, namespace, secret_name, data):
+        self.call()
+        self.secrets.setdefault((namespace, secret_name), {}).update(data)
+
+
+def run_main(users, keys):
+    """Run rotator.main against fresh fake back ends,
+    returning the back ends and the summary
+    """
+
+    fb = FakeFlashBlade(users, keys)
+    fake_k8s = FakeK8S()
+
+    with patch.object(config, "interesting_users", set(users)), patch(
+        "cobalt_purestorage.rotator.PureStorageFlashBlade", return_value=fb
+    ), patch.object(k8s, "get_k8s", return_value=fake_k8s), patch.object(
+        k8s, "log_k8s_stats"
+    ):
+        summary = rotator.main()
+
+    return fb, fake_k8s, summary
+
+
+@patch("cobalt_purestorage.configuration.config.access_key_min_age", 3600)
+@patch("cobalt_purestorage.configuration.config.access_key_age_variance", 0)
+@patch("cobalt_purestorage.configuration.config.k8s_mode", True)
+@patch("cobalt_purestorage.configuration.config.k8s_namespace", "benchmark")
+@patch("cobalt_purestorage.configuration.config.k8s_secret_name", "benchmark")
+@patch("cobalt_purestorage.configuration.config.k8s_secret_key", "benchmark")
+@pytest.mark.parametrize("size", SIZES)
+def test_rotator_main(benchmark, synthetic_users, report, size):
+    """Benchmark rotator.main, reporting calls per user and peak memory"""
+
+    if size > 100 and not LARGE:
+        pytest.skip("set BENCHMARK_LARGE=true to benchmark more than 100 users")
+
+    users, keys = synthetic_users(size)
+
+    # memory is traced in a separate run, tracing slows everything down
+    tracemalloc.start()
+    fb, fake_k8s, summary = run_main(users, keys)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    benchmark.extra_info.update(
+        users=size,
+        fb_calls_per_user=fb.calls / size,
+        k8s_calls_per_user=fake_k8s.calls / size,
+        peak_memory_mib=peak / 2**20,
+    )
+    report(benchmark.extra_info)
+
+    assert sum(len(x) for x in summary.values()) == size
+
+    # every round starts from the same keys
+    benchmark.pedantic(run_main, args=(users, keys), rounds=3 if size < 1000 else 1)
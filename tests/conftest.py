@@ -9,6 +9,7 @@ import pytest
 import yaml
 
 import cobalt_purestorage.configuration as configuration
+from cobalt_purestorage.models import AccessKey
 
 
 @pytest.fixture(scope="session", autouse=True)
@@ -31,7 +32,7 @@ def mock_fb_timeout():
 
 @pytest.fixture
 def mock_credentials():
-    creds = {"name": "pytest", "access_key": "pytest", "secret_access_key": "pytest"}
+    creds = AccessKey("pytest", secret_access_key="pytest")
 
     return creds
 
@@ -144,4 +145,4 @@ def mock_keys(request):
         },
     ]
 
-    return (keys, request.param[1])
+    return ([AccessKey.from_dict(x) for x in keys], request.param[1])
@@ -0,0 +1,300 @@
+""" Test Asyncio Rotation Module """
+
+import asyncio
+import json
+from unittest.mock import AsyncMock, patch
+
+import pytest
+
+import cobalt_purestorage.aio as aio
+import cobalt_purestorage.rotator as rotator
+from cobalt_purestorage.configuration import SecretTarget
+from cobalt_purestorage.models import AccessKey
+
+
+class MockResponse:
+    """Mock out an aiohttp response"""
+
+    def __init__(self, status, body=None, headers=None):
+        self.status = status
+        self.headers = headers or {}
+        self._body = json.dumps(body).encode() if body is not None else b""
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def read(self):
+        return self._body
+
+    async def json(self):
+        return json.loads(self._body)
+
+
+class MockSession:
+    """Mock out an aiohttp session, recording requests"""
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.calls = []
+
+    def _respond(self, method, url, **kwargs):
+        self.calls.append((method, url, kwargs))
+        return self.responses[(method, url.split("/api/")[-1])](kwargs)
+
+    def get(self, url, **kwargs):
+        return self._respond("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self._respond("POST", url, **kwargs)
+
+    def request(self, method, url, **kwargs):
+        return self._respond(method, url, **kwargs)
+
+    async def close(self):
+        pass
+
+
+def mock_session(mock_data, status_code=200):
+    """Build a session answering the FlashBlade endpoints from mock_data"""
+
+    users = {x["name"] for x in mock_data["users"]}
+
+    def get_users(kwargs):
+        names = [x.split('"')[1] for x in kwargs["params"]["filter"].split(" or ")]
+        items = [{"name": x} for x in names if x in users]
+        return MockResponse(status_code, {"items": items})
+
+    def get_keys(kwargs):
+        names = [x.split('"')[1] for x in kwargs["params"]["filter"].split(" or ")]
+        items = [x for x in mock_data["access_keys"] if x["user"]["name"] in names]
+        return MockResponse(status_code, {"items": items})
+
+    def post_key(kwargs):
+        user = kwargs["json"]["user"]["name"]
+        item = {"name": f"PSFB-{user}", "secret_access_key": "***"}
+        return MockResponse(status_code, {"items": [item]})
+
+    return MockSession(
+        {
+            ("GET", "api_version"): lambda _: MockResponse(
+                200, {"versions": ["1.12", "2.2", "2.10", "2.4"]}
+            ),
+            ("POST", "login"): lambda _: MockResponse(
+                200, headers={"x-auth-token": "pytest-session"}
+            ),
+            ("GET", "2.10/object-store-users"): get_users,
+            ("GET", "2.10/object-store-access-keys"): get_keys,
+            ("POST", "2.10/object-store-access-keys"): post_key,
+            ("DELETE", "2.10/object-store-access-keys"): lambda _: MockResponse(
+                status_code
+            ),
+        }
+    )
+
+
+def test_login(mock_data):
+    """Test the api version negotiation and login"""
+
+    session = mock_session(mock_data)
+    fb = aio.AsyncFlashBlade(session=session)
+
+    asyncio.run(fb.login())
+
+    assert fb.api_version == "2.10"
+    assert fb.auth_token == "pytest-session"
+    assert session.calls[1][2]["headers"] == {"api-token": "mock-token"}
+
+
+def test_login_failure(mock_data):
+    """Test the login error handling"""
+
+    session = mock_session(mock_data)
+    session.responses[("POST", "login")] = lambda _: MockResponse(401)
+    fb = aio.AsyncFlashBlade(session=session)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(fb.login())
+
+
+@pytest.mark.parametrize("status_code,expected", [(200, True), (400, False)])
+def test_delete_object_store_access_keys(mock_data, status_code, expected):
+    """Test the delete_object_store_access_keys method"""
+
+    session = mock_session(mock_data, status_code)
+
+    async def run():
+        async with aio.AsyncFlashBlade(session=session) as fb:
+            return await fb.delete_object_store_access_keys(["a", "b"])
+
+    assert asyncio.run(run()) == expected
+    assert session.calls[-1][2]["params"] == {"names": "a,b"}
+
+
+@pytest.mark.parametrize("status_code", [200, 400])
+def test_post_object_store_access_keys(mock_data, status_code):
+    """Test the post_object_store_access_keys method"""
+
+    session = mock_session(mock_data, status_code)
+
+    async def run():
+        async with aio.AsyncFlashBlade(session=session) as fb:
+            return await fb.post_object_store_access_keys("pytest")
+
+    result = asyncio.run(run())
+
+    if status_code == 200:
+        assert result == AccessKey("PSFB-pytest", secret_access_key="***")
+    else:
+        assert result is None
+
+
+@patch("cobalt_purestorage.configuration.config.access_key_min_age", 3600)
+@patch("cobalt_purestorage.configuration.config.access_key_age_variance", 90)
+@patch("cobalt_purestorage.configuration.config.k8s_mode", True)
+@patch("cobalt_purestorage.configuration.config.k8s_namespace", "pytest")
+@patch("cobalt_purestorage.configuration.config.k8s_secret_name", "secret")
+@patch("cobalt_purestorage.configuration.config.k8s_secret_key", "data")
+def test_rotate_users_async(mock_data):
+    """Test that the async engine applies the same rules as the rotator"""
+
+    session = mock_session(mock_data)
+    k8s = AsyncMock()
+    users = [x["name"] for x in mock_data["users"]] + ["mock_fake/missing"]
+
+    async def run():
+        async with aio.AsyncFlashBlade(session=session) as fb:
+            return await aio.rotate_users_async(users, fb=fb, k8s=k8s)
+
+    summary = asyncio.run(run())
+
+    assert summary[rotator.CREATED] == ["mock_hai/one", "mock_hai/three"]
+    assert summary[rotator.ROTATED] == ["mock_hai/four"]
+    assert summary[rotator.TOO_MANY_KEYS] == ["mock_ana/three", "mock_hai/five"]
+    assert summary[rotator.INVALID] == ["mock_fake/missing"]
+    assert len(summary[rotator.SKIPPED]) == 5
+
+    # the users share the default target, so it is patched once
+    namespace, secret, data = k8s.update_secret_data.await_args.args
+    assert k8s.update_secret_data.await_count == 1
+    assert (namespace, secret, list(data)) == ("pytest", "secret", ["data"])
+
+
+@patch(
+    "cobalt_purestorage.configuration.config.user_secret_targets",
+    {
+        "mock_hai/one": SecretTarget(key="one"),
+        "mock_hai/three": SecretTarget(key="three"),
+        "mock_hai/four": SecretTarget(namespace="other", secret="four"),
+    },
+)
+@patch("cobalt_purestorage.configuration.config.access_key_min_age", 3600)
+@patch("cobalt_purestorage.configuration.config.access_key_age_variance", 90)
+@patch("cobalt_purestorage.configuration.config.k8s_mode", True)
+@patch("cobalt_purestorage.configuration.config.k8s_namespace", "pytest")
+@patch("cobalt_purestorage.configuration.config.k8s_secret_name", "secret")
+@patch("cobalt_purestorage.configuration.config.k8s_secret_key", "data")
+def test_rotate_users_async_targets(mock_data):
+    """Test users are written to their own targets, one patch per secret"""
+
+    session = mock_session(mock_data)
+    k8s = AsyncMock()
+    k8s.update_secret_data.side_effect = [ValueError("secret does not exist"), None]
+
+    async def run():
+        async with aio.AsyncFlashBlade(session=session) as fb:
+            return await aio.rotate_users_async(
+                ["mock_hai/one", "mock_hai/three", "mock_hai/four"], fb=fb, k8s=k8s
+            )
+
+    summary = asyncio.run(run())
+
+    patches = [x.args for x in k8s.update_secret_data.await_args_list]
+    assert [(x[0], x[1], sorted(x[2])) for x in patches] == [
+        ("other", "four", ["data"]),
+        ("pytest", "secret", ["one", "three"]),
+    ]
+    assert summary == {
+        rotator.CREATED: ["mock_hai/one", "mock_hai/three"],
+        rotator.FAILED: ["mock_hai/four"],
+    }
+
+
+@patch("cobalt_purestorage.configuration.config.k8s_mode", False)
+@patch("cobalt_purestorage.rotator.update_local")
+def test_rotate_users_async_local(mock_update_local, mock_data):
+    """Test that local mode writes the credentials without a k8s client"""
+
+    session = mock_session(mock_data)
+
+    async def run():
+        async with aio.AsyncFlashBlade(session=session) as fb:
+            return await aio.rotate_users_async(["mock_hai/one"], fb=fb)
+
+    assert asyncio.run(run()) == {rotator.CREATED: ["mock_hai/one"]}
+    credentials, user_name = mock_update_local.call_args.args
+    assert credentials["AccessKeyId"] == "PSFB-mock_hai/one"
+    assert user_name == "mock_hai/one"
+
+
+@patch("cobalt_purestorage.configuration.config.access_key_min_age", 3600)
+@patch("cobalt_purestorage.configuration.config.access_key_age_variance", 90)
+@patch("cobalt_purestorage.configuration.config.k8s_mode", False)
+@patch("cobalt_purestorage.rotator.update_local")
+def test_rotate_users_async_delete_failed(mock_update_local, mock_data):
+    """Test no key is created when the oldest key could not be deleted"""
+
+    session = mock_session(mock_data)
+    session.responses[
+        ("DELETE", "2.10/object-store-access-keys")
+    ] = lambda _: MockResponse(500)
+
+    async def run():
+        async with aio.AsyncFlashBlade(session=session) as fb:
+            return await aio.rotate_users_async(["mock_hai/four"], fb=fb)
+
+    assert asyncio.run(run()) == {rotator.FAILED: ["mock_hai/four"]}
+    assert not [x for x in session.calls if x[0] == "POST" and "access-keys" in x[1]]
+    mock_update_local.assert_not_called()
+
+
+@patch("cobalt_purestorage.configuration.config.fb_list_limit", 2)
+def test_items_pagination(mock_data):
+    """Test listings follow the continuation token a page at a time"""
+
+    keys = mock_data["access_keys"][:3]
+
+    def get_keys(kwargs):
+        offset = int(kwargs["params"].get("continuation_token", "0").strip("'"))
+        page = keys[offset : offset + kwargs["params"]["limit"]]
+        token = str(offset + len(page)) if offset + len(page) < len(keys) else None
+        return MockResponse(200, {"items": page, "continuation_token": token})
+
+    session = mock_session(mock_data)
+    session.responses[("GET", "2.10/object-store-access-keys")] = get_keys
+
+    async def run():
+        async with aio.AsyncFlashBlade(session=session) as fb:
+            return [
+                x async for x in fb.items("object-store-access-keys", {}, AccessKey)
+            ]
+
+    assert asyncio.run(run()) == [AccessKey.from_dict(x) for x in keys]
+    pages = [x[2]["params"] for x in session.calls if "access-keys" in x[1]]
+    assert pages == [{"limit": 2}, {"limit": 2, "continuation_token": "'2'"}]
+
+
+@pytest.mark.parametrize("status,expected", [(404, ValueError), (500, RuntimeError)])
+def test_async_k8s_update_secret_errors(status, expected):
+    """Test the AsyncK8S update_secret error handling"""
+
+    k8s = aio.AsyncK8S()
+    k8s.v1 = AsyncMock()
+    k8s.v1.patch_namespaced_secret.side_effect = (
+        aio.kubernetes_asyncio.client.exceptions.ApiException(status=status)
+    )
+
+    with pytest.raises(expected):
+        asyncio.run(k8s.update_secret("pytest", "pytest", "pytest", "pytest"))
@@ -1,15 +1,25 @@
 """ Test CLI Module """
 
+import json
+import subprocess
+import sys
 from unittest.mock import patch
 
+import pytest
 from click.testing import CliRunner
 
 import cobalt_purestorage.cli as cli
+import cobalt_purestorage.sharding as sharding
+
+# cumulative import time, in microseconds, allowed for the entry point
+# modules.  They import in well under 100ms once kubernetes and
+# pypureclient, which take seconds, are kept off the import path.
+IMPORT_TIME_BUDGET = 1_000_000
 
 
 #  https://github.com/pallets/click/issues/824#issuecomment-562581313
 #  for caplog workaround
-@patch("cobalt_purestorage.cli.rotator.main")
+@patch("cobalt_purestorage.rotator.main")
 def test_rotate(mock, caplog):
     caplog.set_level(1000)
 
@@ -23,7 +33,50 @@ def test_rotate(mock, caplog):
     mock.assert_called_with()
 
 
-@patch("cobalt_purestorage.cli.smoketest.main")
+@patch("cobalt_purestorage.daemon.run")
+@patch("cobalt_purestorage.rotator.main")
+def test_rotate_daemon(mock_main, mock_run, caplog):
+    caplog.set_level(1000)
+
+    runner = CliRunner()
+    mock_run.return_value = None
+
+    result = runner.invoke(cli.rotate_entrypoint, ["daemon"])
+
+    assert result.output == ""
+    mock_run.assert_called_once_with()
+    mock_main.assert_not_called()
+
+
+@patch("cobalt_purestorage.rotator.dry_run")
+@patch("cobalt_purestorage.rotator.main")
+def test_rotate_plan(mock_main, mock_dry_run, caplog):
+    caplog.set_level(1000)
+
+    runner = CliRunner()
+    mock_dry_run.return_value = ["a: create a key", "b: skip, keys are too young"]
+
+    result = runner.invoke(cli.rotate_entrypoint, ["plan"])
+
+    assert result.output == "a: create a key\nb: skip, keys are too young\n"
+    mock_main.assert_not_called()
+
+
+@patch("cobalt_purestorage.configuration.config.shard_count", 4)
+def test_rotate_shard():
+    runner = CliRunner()
+
+    result = runner.invoke(cli.rotate_entrypoint, ["shard", "acc/one", "acc/two"])
+    counted = runner.invoke(cli.rotate_entrypoint, ["shard", "--count", "1", "acc/one"])
+
+    assert result.output == (
+        f"acc/one: shard {sharding.shard_of('acc/one', 4)} of 4\n"
+        f"acc/two: shard {sharding.shard_of('acc/two', 4)} of 4\n"
+    )
+    assert counted.output == "acc/one: shard 0 of 1\n"
+
+
+@patch("cobalt_purestorage.smoketest.main")
 def test_smoketest(mock, caplog):
     caplog.set_level(1000)
 
@@ -34,4 +87,74 @@ def test_smoketest(mock, caplog):
 
     assert result.output == ""
     mock.assert_called_once()
-    mock.assert_called_with()
+    mock.assert_called_with(None)
+
+
+@patch("cobalt_purestorage.smoketest.main")
+def test_smoketest_write_baseline(mock, caplog):
+    caplog.set_level(1000)
+
+    runner = CliRunner()
+    mock.return_value = None
+
+    result = runner.invoke(
+        cli.smoketest_entrypoint, ["--write-baseline", "baseline.json"]
+    )
+
+    assert result.exit_code == 0
+    mock.assert_called_with("baseline.json")
+
+
+@pytest.mark.parametrize(
+    "module",
+    [
+        "cobalt_purestorage.cli",
+        "cobalt_purestorage.rotator",
+        "cobalt_purestorage.smoketest",
+        "cobalt_purestorage.simulator",
+    ],
+)
+def test_import_time(module):
+    """Test that importing the entry points stays within budget
+    and does not import the heavy client libraries
+    """
+
+    code = (
+        f"import sys, json, {module}; "
+        "print(json.dumps([x for x in ('kubernetes', 'pypureclient') "
+        "if x in sys.modules]))"
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    assert json.loads(result.stdout) == []
+
+    cumulative = next(
+        int(line.split("|")[1])
+        for line in result.stderr.splitlines()
+        if line.endswith(f"| {module}")
+    )
+    assert cumulative < IMPORT_TIME_BUDGET
+
+
+@patch("cobalt_purestorage.simulator.main")
+def test_simulator(mock, caplog):
+    caplog.set_level(1000)
+
+    runner = CliRunner()
+
+    result = runner.invoke(
+        cli.simulator_entrypoint,
+        ["--port", "9443", "--users", "3", "--key-age", "100", "--latency", "5"],
+    )
+
+    assert result.exit_code == 0
+    host, port, fb = mock.call_args.args
+    assert (host, port) == ("127.0.0.1", 9443)
+    assert sorted(fb.users) == [f"simulator/user0000{x}" for x in range(3)]
+    assert len(fb.keys) == 3
+    assert fb.latency.mean == 0.005
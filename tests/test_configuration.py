@@ -3,6 +3,9 @@
 import os
 from unittest.mock import patch
 
+import pytest
+from pydantic import ValidationError
+
 from cobalt_purestorage.configuration import Settings, config
 
 
@@ -27,3 +30,88 @@ def test_env_var_config():
         "account/pytest-one",
         "account/pytest-two",
     }
+
+
+@patch.dict(os.environ, {"ROTATION_CONCURRENCY": "0"})
+def test_rotation_concurrency_validation():
+    """Test that a non positive concurrency is rejected"""
+
+    with pytest.raises(ValidationError):
+        Settings()
+
+
+@pytest.mark.parametrize(
+    "name",
+    [
+        "FB_FILTER_CHUNK_SIZE",
+        "FB_DELETE_BATCH_SIZE",
+        "FB_LIST_LIMIT",
+        "ASYNC_ROTATION_CONCURRENCY",
+    ],
+)
+def test_limit_validation(name):
+    """Test that a non positive size or concurrency is rejected at start up"""
+
+    with patch.dict(os.environ, {name: "0"}), pytest.raises(ValidationError):
+        Settings()
+
+
+@patch.dict(os.environ, {"TRACING_EXPORTER": "zipkin"})
+def test_tracing_exporter_validation():
+    """Test that an unknown tracing exporter is rejected"""
+
+    with pytest.raises(ValidationError):
+        Settings()
+
+
+@patch.dict(os.environ, {"LOG_FORMAT": "xml"})
+def test_log_format_validation():
+    """Test that an unknown log format is rejected"""
+
+    with pytest.raises(ValidationError):
+        Settings()
+
+
+@patch.dict(
+    os.environ,
+    {
+        "FB_ARRAYS": '[{"url": "fb01", "api_token": "one"},'
+        '{"url": "fb02", "api_token": "two", "name": "second", "interesting_users": ["a"]}]'
+    },
+)
+def test_fb_arrays_config():
+    """Test arrays can be configured from an env var, named by url by default"""
+
+    pytest_config = Settings()
+
+    assert [x.name for x in pytest_config.fb_arrays] == ["fb01", "second"]
+    assert pytest_config.fb_arrays[1].interesting_users == {"a"}
+
+
+@patch.dict(
+    os.environ,
+    {
+        "FB_ARRAYS": '[{"url": "fb01", "api_token": "one"},{"url": "fb01", "api_token": "two"}]'
+    },
+)
+def test_fb_arrays_validation():
+    """Test that arrays with the same name are rejected"""
+
+    with pytest.raises(ValidationError):
+        Settings()
+
+
+@patch.dict(os.environ, {"SHARD_COUNT": "4", "JOB_COMPLETION_INDEX": "3"})
+def test_shard_index_from_indexed_job():
+    """Test the shard index defaults to an indexed Job's completion index"""
+
+    assert Settings().shard_index == 3
+
+
+@pytest.mark.parametrize("count,index", [("0", "0"), ("2", "2"), ("2", "-1")])
+def test_shard_validation(count, index):
+    """Test that an out of range shard is rejected"""
+
+    with patch.dict(os.environ, {"SHARD_COUNT": count, "SHARD_INDEX": index}):
+        with pytest.raises(ValidationError):
+            Settings()
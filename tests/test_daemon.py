@@ -0,0 +1,227 @@
+""" Test Daemon Module """
+
+import json
+import threading
+import time
+import urllib.error
+import urllib.request
+from unittest.mock import Mock, patch
+
+import pytest
+
+import cobalt_purestorage.daemon as daemon
+import cobalt_purestorage.inventory as inventory
+import cobalt_purestorage.rotator as rotator
+from cobalt_purestorage.configuration import FlashBladeArray
+from cobalt_purestorage.inventory import UserEntry
+from cobalt_purestorage.models import AccessKey
+
+NOW = 1_700_000_000
+
+
+@patch("cobalt_purestorage.configuration.config.access_key_min_age", 3600)
+@patch("cobalt_purestorage.configuration.config.access_key_age_variance", 100)
+@patch("cobalt_purestorage.configuration.config.daemon_retry_interval", 60)
+@pytest.mark.parametrize(
+    "outcome,keys,expected",
+    [
+        (rotator.CREATED, [], NOW + 3500),
+        (rotator.ROTATED, [AccessKey("k", 0)], NOW + 3500),
+        (
+            rotator.SKIPPED,
+            [AccessKey("k", (NOW - 1000) * 1000), AccessKey("k", (NOW - 5000) * 1000)],
+            NOW - 1000 + 3500,
+        ),
+        (rotator.FAILED, [], NOW + 60),
+        (rotator.INVALID, [], NOW + 60),
+        (rotator.TOO_MANY_KEYS, [AccessKey("k", 0)] * 3, NOW + 60),
+    ],
+)
+def test_next_due(outcome, keys, expected):
+    """Test the next_due function"""
+
+    assert daemon.next_due("a", outcome, keys, NOW) == expected
+
+
+@patch("cobalt_purestorage.configuration.config.access_key_min_age", 3600)
+@patch("cobalt_purestorage.configuration.config.access_key_age_variance", 100)
+def test_next_due_key_age():
+    """Test users of USERS_FILE are scheduled by their own key age"""
+
+    entry = UserEntry(name="a", access_key_min_age=600, access_key_age_variance=0)
+
+    with inventory.loaded([entry]):
+        assert daemon.next_due("a", rotator.CREATED, [], NOW) == NOW + 600
+        assert daemon.next_due("b", rotator.CREATED, [], NOW) == NOW + 3500
+
+
+@patch("cobalt_purestorage.configuration.config.access_key_min_age", 3600)
+@patch("cobalt_purestorage.configuration.config.access_key_age_variance", 100)
+@patch("cobalt_purestorage.configuration.config.daemon_max_sleep", 900)
+def test_schedule():
+    """Test the Schedule class"""
+
+    schedule = daemon.Schedule(["b", "a"], NOW)
+    assert schedule.due_users(NOW) == ["a", "b"]
+
+    schedule.update(
+        {"a": rotator.CREATED, "b": rotator.SKIPPED},
+        {"a": [], "b": [AccessKey("k", (NOW - 3000) * 1000)]},
+        NOW,
+    )
+
+    assert schedule.due_users(NOW) == []
+    assert schedule.due_users(NOW + 500) == ["b"]
+    assert schedule.seconds_until_next(NOW) == 500
+    assert schedule.seconds_until_next(NOW + 600) == 0
+
+    schedule.due["b"] = NOW + 5000
+    assert schedule.seconds_until_next(NOW) == 900
+
+
+@patch("cobalt_purestorage.configuration.config.access_key_min_age", 3600)
+@patch("cobalt_purestorage.configuration.config.access_key_age_variance", 100)
+@patch("cobalt_purestorage.configuration.config.daemon_retry_interval", 60)
+def test_schedule_not_due():
+    """Test users STATE_FILE showed not due are rescheduled for when
+    their newest key is old enough, not retried
+    """
+
+    schedule = daemon.Schedule(["a"], NOW)
+
+    schedule.update({"a": rotator.SKIPPED}, {}, NOW, {"a": NOW - 3000})
+
+    assert schedule.due["a"] == NOW + 500
+
+
+@patch("cobalt_purestorage.rotator.rotate_users")
+def test_run_once(mock_rotate):
+    """Test due users are rotated and rescheduled"""
+
+    mock_rotate.return_value = ({"a": rotator.CREATED}, {"a": []}, {})
+    schedule = daemon.Schedule(["a"], NOW + 10)
+
+    daemon.run_once("fb", schedule, NOW)
+    mock_rotate.assert_not_called()
+
+    daemon.run_once("fb", schedule, NOW + 10)
+    mock_rotate.assert_called_once_with(["a"], "fb")
+    assert schedule.due["a"] > NOW + 10
+
+
+@patch("cobalt_purestorage.configuration.config.daemon_retry_interval", 60)
+@patch("cobalt_purestorage.rotator.rotate_users", Mock(side_effect=RuntimeError))
+def test_run_once_failure():
+    """Test a failed pass is retried later rather than crashing the daemon"""
+
+    schedule = daemon.Schedule(["a"], NOW)
+
+    daemon.run_once("fb", schedule, NOW)
+
+    assert schedule.due["a"] == NOW + 60
+
+
+@patch("cobalt_purestorage.configuration.config.daemon_liveness_timeout", 60)
+def test_health_server():
+    """Test the liveness probe"""
+
+    heartbeat = daemon.Heartbeat()
+    server = daemon.start_health_server(heartbeat, 0)
+    url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    try:
+        with urllib.request.urlopen(f"{url}/healthz") as resp:
+            assert json.loads(resp.read()) == {"alive": True}
+
+        heartbeat.last_beat -= 61
+        with pytest.raises(urllib.error.HTTPError) as err:
+            urllib.request.urlopen(f"{url}/healthz")
+        assert err.value.code == 503
+
+        with urllib.request.urlopen(f"{url}/metrics") as resp:
+            assert b"cobalt_rotation_users_scanned" in resp.read()
+
+        with pytest.raises(urllib.error.HTTPError) as err:
+            urllib.request.urlopen(f"{url}/missing")
+        assert err.value.code == 404
+
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+@patch("cobalt_purestorage.configuration.config.interesting_users", {"a"})
+@patch("cobalt_purestorage.configuration.config.daemon_health_port", 0)
+@patch("cobalt_purestorage.daemon.PureStorageFlashBlade")
+@patch("cobalt_purestorage.rotator.rotate_users")
+def test_run_stops(mock_rotate, mock_fb):
+    """Test the daemon rotates, sleeps and stops when asked"""
+
+    stop = threading.Event()
+
+    def rotate(user_names, fb):
+        stop.set()
+        return {"a": rotator.CREATED}, {"a": []}, {}
+
+    mock_rotate.side_effect = rotate
+
+    thread = threading.Thread(target=daemon.run, args=(stop,))
+    thread.start()
+    thread.join(timeout=10)
+
+    assert not thread.is_alive()
+    mock_fb.assert_called_once()
+    mock_rotate.assert_called_once_with(["a"], mock_fb.return_value)
+
+
+@patch("cobalt_purestorage.configuration.config.interesting_users", set())
+@patch("cobalt_purestorage.configuration.config.daemon_health_port", 0)
+@patch("cobalt_purestorage.configuration.config.access_key_min_age", 3600)
+@patch("cobalt_purestorage.configuration.config.access_key_age_variance", 0)
+@patch("cobalt_purestorage.daemon.PureStorageFlashBlade")
+@patch("cobalt_purestorage.rotator.rotate_users")
+def test_run_users_file(mock_rotate, mock_fb, tmp_path):
+    """Test the daemon schedules the users of USERS_FILE by their key age"""
+
+    path = tmp_path / "users.jsonl"
+    path.write_text('{"name": "a", "access_key_min_age": 600}\n"b"\n')
+    stop = threading.Event()
+    schedule = {}
+
+    def rotate(user_names, fb):
+        stop.set()
+        return {x: rotator.CREATED for x in user_names}, {}, {}
+
+    def update(self, outcomes, keys, now, not_due=None):
+        original(self, outcomes, keys, now, not_due)
+        schedule.update({x: due - now for x, due in self.due.items()})
+
+    mock_rotate.side_effect = rotate
+    original = daemon.Schedule.update
+
+    with patch("cobalt_purestorage.configuration.config.users_file", str(path)):
+        with patch.object(daemon.Schedule, "update", update):
+            daemon.run(stop)
+
+    mock_rotate.assert_called_once_with(["a", "b"], mock_fb.return_value)
+    assert schedule == {"a": 600, "b": 3600}
+    assert inventory.entry("a") is None
+
+
+@pytest.mark.parametrize(
+    "setting,value",
+    [
+        ("discover_users", ["account/*"]),
+        ("fb_arrays", [FlashBladeArray(url="fb01", api_token="one")]),
+    ],
+)
+@patch("cobalt_purestorage.configuration.config.users_file", None)
+@patch("cobalt_purestorage.daemon.PureStorageFlashBlade")
+def test_run_unsupported(mock_fb, setting, value):
+    """Test the daemon refuses user sources it does not support"""
+
+    with patch(f"cobalt_purestorage.configuration.config.{setting}", value):
+        with pytest.raises(RuntimeError):
+            daemon.run(threading.Event())
+
+    mock_fb.assert_not_called()
@@ -0,0 +1,75 @@
+""" Test User Discovery Module """
+
+from unittest.mock import Mock, patch
+
+import pytest
+
+import cobalt_purestorage.discovery as discovery
+import cobalt_purestorage.sharding as sharding
+
+ARRAY_USERS = ["a/one", "a/two", "a/test-1", "b/one", "b/two"]
+
+
+def mock_fb(page_size=2):
+    """A FlashBlade listing users a page at a time, honouring
+    the * wildcard in name filters as the array does
+    """
+
+    def list_object_store_users(name_filter):
+        pattern = name_filter[len('name="') : -1]
+        names = [x for x in ARRAY_USERS if discovery.fnmatchcase(x, pattern)]
+        for i in range(0, len(names), page_size):
+            yield names[i : i + page_size]
+
+    fb = Mock()
+    fb.name = "fb01"
+    fb.list_object_store_users.side_effect = list_object_store_users
+
+    return fb
+
+
+@pytest.mark.parametrize(
+    "pattern,expected",
+    [
+        ("account/*", 'name="account/*"'),
+        ("account/user0?", 'name="account/user0*"'),
+        ("account/[ab]*", 'name="account/*"'),
+        ("account/user01", 'name="account/user01"'),
+        ("*", 'name="*"'),
+    ],
+)
+def test_name_filter(pattern, expected):
+    """Test globs are narrowed to the array's filter syntax"""
+
+    assert discovery.name_filter(pattern) == expected
+
+
+def test_discover_users():
+    """Test matching users are streamed a page at a time"""
+
+    pages = discovery.discover_users(mock_fb(), ["a/*"], ["*/test-*"])
+
+    assert next(pages) == ["a/one", "a/two"]
+    assert list(pages) == []
+
+
+def test_discover_users_overlapping():
+    """Test a user matching several patterns is discovered once"""
+
+    fb = mock_fb()
+    pages = discovery.discover_users(fb, ["*/one", "b/*", "a/t??"], [])
+
+    assert [x for page in pages for x in page] == ["a/one", "b/one", "b/two", "a/two"]
+    fb.list_object_store_users.assert_any_call('name="a/t*"')
+
+
+@patch("cobalt_purestorage.configuration.config.shard_count", 2)
+@patch("cobalt_purestorage.configuration.config.shard_index", 0)
+@patch("cobalt_purestorage.configuration.config.discover_users", ["*"])
+@patch("cobalt_purestorage.configuration.config.discover_exclude", [])
+def test_discover_users_sharded():
+    """Test only the shard's users are discovered"""
+
+    users = [x for page in discovery.discover_users(mock_fb()) for x in page]
+
+    assert users == [x for x in ARRAY_USERS if sharding.shard_of(x, 2) == 0]
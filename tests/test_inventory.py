@@ -0,0 +1,105 @@
+""" Test User Inventory Module """
+
+from unittest.mock import patch
+
+import pytest
+
+import cobalt_purestorage.inventory as inventory
+import cobalt_purestorage.sharding as sharding
+from cobalt_purestorage.inventory import UserEntry
+
+YAML_USERS = """\
+name: account/one
+target:
+  secret: one-secret
+access_key_min_age: 3600
+---
+- account/two
+- name: account/three
+  access_key_age_variance: 0
+---
+account/four
+"""
+
+
+def test_read_users_yaml(tmp_path):
+    """Test YAML documents are users, user names or lists of them"""
+
+    path = tmp_path / "users.yaml"
+    path.write_text(YAML_USERS)
+
+    users = list(inventory.read_users(str(path)))
+
+    assert [x.name for x in users] == [
+        "account/one",
+        "account/two",
+        "account/three",
+        "account/four",
+    ]
+    assert users[0].target.secret == "one-secret"
+    assert users[0].access_key_min_age == 3600
+    assert users[2].access_key_age_variance == 0
+
+
+def test_read_users_ndjson(tmp_path):
+    """Test each JSON line is a user, skipping blank lines"""
+
+    path = tmp_path / "users.ndjson"
+    path.write_text(
+        '"account/one"\n\n{"name": "account/two", "target": {"key": "k"}}\n'
+    )
+
+    users = list(inventory.read_users(str(path)))
+
+    assert [x.name for x in users] == ["account/one", "account/two"]
+    assert users[1].target.key == "k"
+
+
+def test_read_users_lazy(tmp_path):
+    """Test users are parsed as they are consumed"""
+
+    path = tmp_path / "users.ndjson"
+    path.write_text('"account/one"\n{"no_name": true}\n')
+
+    users = inventory.read_users(str(path))
+
+    assert next(users).name == "account/one"
+    with pytest.raises(ValueError, match="invalid user 2"):
+        next(users)
+
+
+@patch("cobalt_purestorage.configuration.config.shard_count", 3)
+@patch("cobalt_purestorage.configuration.config.shard_index", 1)
+def test_owned_batches(tmp_path):
+    """Test the shard's users are batched"""
+
+    names = [f"account/user{x:04}" for x in range(100)]
+    path = tmp_path / "users.ndjson"
+    path.write_text("".join(f'"{x}"\n' for x in names))
+
+    batches = list(inventory.owned_batches(str(path), 10))
+
+    assert all(len(x) <= 10 for x in batches)
+    assert [x.name for batch in batches for x in batch] == [
+        x for x in names if sharding.shard_of(x, 3) == 1
+    ]
+
+
+@patch("cobalt_purestorage.configuration.config.access_key_min_age", 43200)
+@patch("cobalt_purestorage.configuration.config.access_key_age_variance", 900)
+def test_loaded():
+    """Test options are visible only while their batch is loaded"""
+
+    entry = UserEntry(name="account/one", access_key_min_age=3600)
+
+    assert inventory.key_age("account/one") == (43200, 900)
+
+    with inventory.loaded([entry]):
+        with inventory.loaded([entry]):
+            assert inventory.entry("account/one") is entry
+
+        # still loaded by the outer batch
+        assert inventory.key_age("account/one") == (3600, 900)
+
+    assert inventory.entry("account/one") is None
+    assert inventory._entries == {}
@@ -1,11 +1,13 @@
 """ Test Kubernetes Module """
 
+import json
 from unittest.mock import Mock, patch
 
 import kubernetes
 import pytest
 
-from cobalt_purestorage.k8s import K8S
+import cobalt_purestorage.k8s as k8s_module
+from cobalt_purestorage.k8s import K8S, get_k8s, reset_k8s
 
 
 def mock_api_response(items=[]):
@@ -44,26 +46,73 @@ def test_create_client_incluster(mock_config):
 @patch("cobalt_purestorage.configuration.config.kubeconfig", None)
 @patch("cobalt_purestorage.k8s.kubernetes.config")
 @patch("cobalt_purestorage.k8s.kubernetes.client.CoreV1Api")
-@pytest.mark.parametrize(
-    "input,expected",
-    [([{"metadata": {"name": "pytest"}}], True), ([], False)],
-)
-def test_secret_exist(mock_v1, mock_config, input, expected):
+@pytest.mark.parametrize("status,expected", [(None, True), (404, False)])
+def test_secret_exist(mock_v1, mock_config, status, expected):
     """Test the _secret_exist method"""
 
     k8s = K8S()
 
-    k8s.v1.list_namespaced_secret.return_value.to_dict = Mock(
-        return_value=mock_api_response(items=input)
-    )
+    if status:
+        k8s.v1.read_namespaced_secret.side_effect = (
+            kubernetes.client.exceptions.ApiException(status=status)
+        )
 
     result = k8s._secret_exist("pytest", "pytest")
+    # the second check is served from the cache
+    cached = k8s._secret_exist("pytest", "pytest")
 
-    assert result == expected
+    assert result == cached == expected
+    k8s.v1.read_namespaced_secret.assert_called_once_with(
+        "pytest", "pytest", _preload_content=False
+    )
+    k8s.v1.list_namespaced_secret.assert_not_called()
     mock_v1.assert_called_once()
     mock_config.load_incluster_config.assert_called_once()
 
 
+@patch("cobalt_purestorage.configuration.config.kubeconfig", None)
+@patch("cobalt_purestorage.k8s.kubernetes.config")
+@patch("cobalt_purestorage.k8s.kubernetes.client.CoreV1Api")
+def test_secret_exist_error(mock_v1, mock_config):
+    """Test the _secret_exist method error handling"""
+
+    k8s = K8S()
+    k8s.v1.read_namespaced_secret.side_effect = (
+        kubernetes.client.exceptions.ApiException(status=500)
+    )
+
+    with pytest.raises(RuntimeError):
+        k8s._secret_exist("pytest", "pytest")
+
+
+@patch("cobalt_purestorage.configuration.config.kubeconfig", None)
+@patch("cobalt_purestorage.k8s.kubernetes.config")
+@patch("cobalt_purestorage.k8s.kubernetes.client.CoreV1Api")
+def test_prefetch_secrets(mock_v1, mock_config):
+    """Test the prefetch_secrets method"""
+
+    k8s = K8S()
+    body = mock_api_response(items=[{"metadata": {"name": "one"}}])
+    k8s.v1.api_client.call_api.return_value = (
+        Mock(data=json.dumps(body).encode()),
+        200,
+        {},
+    )
+
+    missing = k8s.prefetch_secrets("pytest", ["one", "two"])
+
+    assert missing == {"two"}
+    assert k8s._secret_exist("pytest", "one") is True
+    assert k8s._secret_exist("pytest", "two") is False
+    k8s.v1.read_namespaced_secret.assert_not_called()
+    headers = k8s.v1.api_client.call_api.call_args.kwargs["header_params"]
+    assert "PartialObjectMetadataList" in headers["Accept"]
+
+    k8s.clear_secret_cache()
+    k8s._secret_exist("pytest", "one")
+    k8s.v1.read_namespaced_secret.assert_called_once()
+
+
 @patch("cobalt_purestorage.configuration.config.k8s_mode", True)
 @patch("cobalt_purestorage.configuration.config.kubeconfig", None)
 @patch("cobalt_purestorage.k8s.kubernetes.config")
@@ -95,3 +144,111 @@ def test_update_secret(mock_exists, mock_v1, mock_config, expected):
         mock_exists.assert_called_with(namespace, secret_name)
         mock_config.load_incluster_config.assert_called_once()
         mock_v1.return_value.patch_namespaced_secret.assert_not_called()
+
+
+@patch("cobalt_purestorage.configuration.config.kubeconfig", None)
+@patch("cobalt_purestorage.k8s.kubernetes.config")
+@patch("cobalt_purestorage.k8s.kubernetes.client.CoreV1Api")
+@patch("cobalt_purestorage.k8s.K8S._secret_exist", Mock(return_value=True))
+def test_get_k8s_shared(mock_v1, mock_config):
+    """Test that get_k8s creates the client once and shares it"""
+
+    reset_k8s()
+
+    try:
+        first = get_k8s()
+        second = get_k8s()
+
+        assert first is second
+        mock_config.load_incluster_config.assert_called_once()
+        mock_v1.assert_called_once()
+
+        first.update_secret("pytest", "pytest", "pytest", "pytest")
+        second.update_secret("pytest", "pytest", "pytest", "pytest")
+        assert first.patch_count == 2
+
+    finally:
+        reset_k8s()
+
+    assert k8s_module._k8s is None
+
+
+@patch("cobalt_purestorage.configuration.config.kubeconfig", None)
+@patch("cobalt_purestorage.configuration.config.rotation_concurrency", 500)
+@patch("cobalt_purestorage.k8s.kubernetes.config")
+@patch("cobalt_purestorage.k8s.kubernetes.client.CoreV1Api")
+def test_create_client_pool_size(mock_v1, mock_config):
+    """Test the connection pool is sized for the rotation concurrency"""
+
+    K8S()
+
+    api_client = mock_v1.call_args.args[0]
+    assert api_client.configuration.connection_pool_maxsize == 500
+
+
+@patch("cobalt_purestorage.configuration.config.kubeconfig", None)
+@patch("cobalt_purestorage.k8s.kubernetes.config")
+@patch("cobalt_purestorage.k8s.kubernetes.client.CoreV1Api")
+@patch("cobalt_purestorage.k8s.K8S._secret_exist", Mock(return_value=True))
+def test_update_secret_data(mock_v1, mock_config):
+    """Test many keys are written with a single patch"""
+
+    k8s = K8S()
+    k8s.update_secret_data("pytest", "secret", {"one": "1", "two": "2"})
+
+    k8s.v1.patch_namespaced_secret.assert_called_once_with(
+        "secret", "pytest", {"data": {"one": "1", "two": "2"}}
+    )
+
+
+@patch("cobalt_purestorage.configuration.config.kubeconfig", None)
+@patch("cobalt_purestorage.k8s.kubernetes.config")
+@patch("cobalt_purestorage.k8s.kubernetes.client.CoordinationV1Api")
+@patch("cobalt_purestorage.k8s.kubernetes.client.CoreV1Api")
+@pytest.mark.parametrize("status,expected", [(None, "lease"), (404, None)])
+def test_read_lease(mock_v1, mock_coordination, mock_config, status, expected):
+    """Test a missing lease is read as None"""
+
+    k8s = K8S()
+    k8s.coordination.read_namespaced_lease.return_value = "lease"
+
+    if status:
+        k8s.coordination.read_namespaced_lease.side_effect = (
+            kubernetes.client.exceptions.ApiException(status=status)
+        )
+
+    assert k8s.read_lease("pytest", "batch-0") == expected
+
+
+@patch("cobalt_purestorage.configuration.config.kubeconfig", None)
+@patch("cobalt_purestorage.k8s.kubernetes.config")
+@patch("cobalt_purestorage.k8s.kubernetes.client.CoordinationV1Api")
+@patch("cobalt_purestorage.k8s.kubernetes.client.CoreV1Api")
+def test_write_lease(mock_v1, mock_coordination, mock_config):
+    """Test leases are created, replaced at a resource version,
+    and a conflicting write returns None
+    """
+
+    k8s = K8S()
+    coordination = k8s.coordination
+    coordination.create_namespaced_lease.return_value.metadata.resource_version = "1"
+    coordination.replace_namespaced_lease.return_value.metadata.resource_version = "2"
+
+    assert k8s.write_lease("pytest", {"metadata": {"name": "batch-0"}}) == "1"
+
+    body = {"metadata": {"name": "batch-0"}}
+    assert k8s.write_lease("pytest", body, "1") == "2"
+    coordination.replace_namespaced_lease.assert_called_once_with(
+        "batch-0", "pytest", {"metadata": {"name": "batch-0", "resourceVersion": "1"}}
+    )
+
+    coordination.replace_namespaced_lease.side_effect = (
+        kubernetes.client.exceptions.ApiException(status=409)
+    )
+    assert k8s.write_lease("pytest", body, "1") is None
+
+    coordination.replace_namespaced_lease.side_effect = (
+        kubernetes.client.exceptions.ApiException(status=403)
+    )
+    with pytest.raises(RuntimeError):
+        k8s.write_lease("pytest", body, "1")
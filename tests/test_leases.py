@@ -0,0 +1,241 @@
+""" Test Leases Module """
+
+import time
+from datetime import datetime
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import pytest
+
+import cobalt_purestorage.leases as leases
+
+USERS = {f"account/user{x:04}" for x in range(40)}
+
+
+class FakeLeases:
+    """Leases held in memory, with the API server's optimistic concurrency"""
+
+    def __init__(self):
+        self.leases = {}
+        self.version = 0
+
+    def read_lease(self, namespace, name):
+        if name not in self.leases:
+            return None
+
+        body, resource_version = self.leases[name]
+        spec = body["spec"]
+
+        return SimpleNamespace(
+            metadata=SimpleNamespace(
+                annotations=body["metadata"]["annotations"],
+                resource_version=resource_version,
+            ),
+            spec=SimpleNamespace(
+                holder_identity=spec["holderIdentity"],
+                lease_duration_seconds=spec["leaseDurationSeconds"],
+                lease_transitions=spec["leaseTransitions"],
+                renew_time=datetime.strptime(
+                    spec["renewTime"], "%Y-%m-%dT%H:%M:%S.%f%z"
+                ),
+            ),
+        )
+
+    def write_lease(self, namespace, body, resource_version=None):
+        name = body["metadata"]["name"]
+        current = self.leases.get(name, (None, None))[1]
+
+        if resource_version != current:
+            return None
+
+        self.version += 1
+        self.leases[name] = (body, str(self.version))
+
+        return str(self.version)
+
+    def holders(self):
+        return {
+            x: body["spec"]["holderIdentity"] for x, (body, _) in self.leases.items()
+        }
+
+
+def test_lease_name():
+    """Test lease names are valid k8s object names"""
+
+    assert (
+        leases.lease_name("FB01.example.com", 3) == "cobalt-rotation-fb01-example-com-3"
+    )
+    assert len(leases.lease_name("x" * 300, 15)) <= 253
+
+
+def test_batch_users():
+    """Test users are split into stable batches"""
+
+    batches = leases.batch_users(USERS, 4)
+
+    assert set(batches) <= {0, 1, 2, 3}
+    assert set().union(*batches.values()) == USERS
+    assert batches == leases.batch_users(sorted(USERS, reverse=True), 4)
+
+
+@patch("cobalt_purestorage.configuration.config.lease_duration", 300)
+def test_try_claim():
+    """Test a lease is only claimed while it is free"""
+
+    fake = FakeLeases()
+
+    claim = leases.try_claim(fake, "pytest", "batch-0", "replica-a")
+    assert claim is not None
+    assert leases.try_claim(fake, "pytest", "batch-0", "replica-b") is None
+
+    claim.release(completed=False)
+    assert fake.holders() == {"batch-0": None}
+
+    # released without completing, so it may be claimed at once
+    claim = leases.try_claim(fake, "pytest", "batch-0", "replica-b")
+    assert claim is not None
+    assert fake.leases["batch-0"][0]["spec"]["leaseTransitions"] == 1
+
+    claim.release(completed=True)
+    assert leases.try_claim(fake, "pytest", "batch-0", "replica-a") is None
+
+
+@patch("cobalt_purestorage.configuration.config.lease_duration", 300)
+def test_try_claim_expired():
+    """Test the lease of a replica that stopped renewing can be taken over"""
+
+    fake = FakeLeases()
+    stale = time.time() - 600
+    fake.write_lease("pytest", leases.lease_body("batch-0", "crashed", stale, stale, 0))
+
+    claim = leases.try_claim(fake, "pytest", "batch-0", "replica-a")
+
+    assert claim is not None
+    assert fake.holders() == {"batch-0": "replica-a"}
+    claim.release(completed=True)
+
+
+@patch("cobalt_purestorage.configuration.config.lease_duration", 300)
+def test_claim_lost():
+    """Test a claim taken over by another replica is not written again"""
+
+    fake = FakeLeases()
+    claim = leases.try_claim(fake, "pytest", "batch-0", "replica-a")
+
+    # another replica wrote the lease after this one stopped renewing
+    body, version = fake.leases["batch-0"]
+    fake.write_lease(
+        "pytest", leases.lease_body("batch-0", "replica-b", time.time(), 0, 1), version
+    )
+
+    assert claim.held
+    assert claim.renew() is False
+    assert not claim.held
+    claim.release(completed=True)
+
+    assert fake.holders() == {"batch-0": "replica-b"}
+
+
+@patch("cobalt_purestorage.configuration.config.lease_duration", 300)
+def test_claim_expired():
+    """Test a claim is not held once it went unrenewed for LEASE_DURATION"""
+
+    fake = FakeLeases()
+    claim = leases.try_claim(fake, "pytest", "batch-0", "replica-a")
+
+    claim.renewed -= 300
+    assert not claim.held
+    claim.release(completed=False)
+
+
+@patch("cobalt_purestorage.configuration.config.lease_duration", 0.03)
+def test_claim_renewed():
+    """Test a held lease is renewed in the background"""
+
+    fake = FakeLeases()
+    claim = leases.try_claim(fake, "pytest", "batch-0", "replica-a")
+    version = claim.resource_version
+
+    time.sleep(0.1)
+    claim.release(completed=False)
+
+    assert int(claim.resource_version) > int(version) + 1
+
+
+@patch("cobalt_purestorage.configuration.config.lease_namespace", "pytest")
+@patch("cobalt_purestorage.configuration.config.lease_batch_count", 8)
+@patch("cobalt_purestorage.configuration.config.lease_duration", 300)
+def test_claimed_batches():
+    """Test replicas share the batches without rotating a user twice"""
+
+    fake = FakeLeases()
+    rotated = []
+
+    with patch("cobalt_purestorage.leases.get_k8s", return_value=fake):
+        with patch("cobalt_purestorage.configuration.config.lease_holder", "a"):
+            replica_a = leases.claimed_batches(USERS, "fb01")
+            rotated.append(next(replica_a))
+
+            # b claims every batch but the one a is rotating
+            with patch("cobalt_purestorage.configuration.config.lease_holder", "b"):
+                rotated.extend(leases.claimed_batches(USERS, "fb01"))
+
+            # and a finds the rest recently completed
+            rotated.extend(replica_a)
+
+    assert all(claim.held is False for _, claim in rotated)
+    assert sorted(x for batch, _ in rotated for x in batch) == sorted(USERS)
+    assert set(fake.holders().values()) == {None}
+
+
+@patch("cobalt_purestorage.configuration.config.lease_namespace", "pytest")
+@patch("cobalt_purestorage.configuration.config.lease_duration", 300)
+def test_claimed_batches_abandoned():
+    """Test a batch that was not finished is released for another replica"""
+
+    fake = FakeLeases()
+
+    with patch("cobalt_purestorage.leases.get_k8s", return_value=fake):
+        batches = leases.claimed_batches(USERS, "fb01")
+        first, _ = next(batches)
+        batches.close()
+
+        assert first in [x for x, _ in leases.claimed_batches(USERS, "fb01")]
+
+
+@patch("cobalt_purestorage.configuration.config.lease_namespace", None)
+@patch("cobalt_purestorage.configuration.config.k8s_namespace", None)
+def test_claimed_batches_namespace():
+    """Test a namespace is needed for the leases"""
+
+    with pytest.raises(ValueError):
+        next(leases.claimed_batches(USERS, "fb01"))
+
+
+@patch("cobalt_purestorage.configuration.config.lease_namespace", "pytest")
+@patch("cobalt_purestorage.configuration.config.lease_batch_count", 8)
+@patch("cobalt_purestorage.configuration.config.lease_duration", 300)
+@patch("cobalt_purestorage.configuration.config.shard_count", 2)
+def test_claimed_batches_sharded():
+    """Test shards sharing an array lease their own users apart"""
+
+    fake = FakeLeases()
+    rotated = []
+
+    with patch("cobalt_purestorage.leases.get_k8s", return_value=fake):
+        for index in range(2):
+            with patch("cobalt_purestorage.configuration.config.shard_index", index):
+                owned = {x for x in USERS if leases.shard_of(x, 2) == index}
+                scope = leases.lease_scope("fb01", 0)
+                rotated.extend(leases.claimed_batches(owned, scope))
+
+    assert sorted(x for batch, _ in rotated for x in batch) == sorted(USERS)
+    assert any("fb01-shard0-of-2-part0-" in x for x in fake.leases)
+    assert any("fb01-shard1-of-2-part0-" in x for x in fake.leases)
+
+
+def test_lease_scope():
+    """Test unsharded leases are scoped by the array and USERS_FILE part"""
+
+    assert leases.lease_scope("fb01") == "fb01"
+    assert leases.lease_scope("fb01", 3) == "fb01-part3"
@@ -0,0 +1,108 @@
+""" Test Logging Utils Module """
+
+import json
+import logging
+import sys
+from unittest.mock import Mock, patch
+
+import pytest
+
+import cobalt_purestorage.logging_utils as logging_utils
+
+CREDENTIALS = {
+    "AccessKeyId": "key",
+    "SecretAccessKey": "secret",
+    "nested": [{"secret_access_key": "secret", "api-token": "token"}],
+}
+
+
+def record(msg, args=(), **extra):
+    return logging.makeLogRecord({"msg": msg, "args": args, **extra})
+
+
+def test_format_stacktrace():
+    """Test exceptions are formatted as a single line of JSON"""
+
+    try:
+        raise ValueError("broken")
+    except ValueError:
+        result = json.loads(logging_utils.format_stacktrace())
+
+    assert result["errorType"] == "ValueError"
+    assert result["errorMessage"] == "broken"
+    assert "raise ValueError" in "".join(result["stackTrace"])
+
+
+def test_redact():
+    """Test secret fields are redacted however they are spelt"""
+
+    assert logging_utils.redact(CREDENTIALS) == {
+        "AccessKeyId": "key",
+        "SecretAccessKey": "***",
+        "nested": [{"secret_access_key": "***", "api-token": "***"}],
+    }
+    assert logging_utils.redact(("a", 1)) == ("a", 1)
+
+
+def test_lazy():
+    """Test Lazy arguments are only evaluated when a record is emitted"""
+
+    func = Mock(return_value={"password": "secret"})
+    logger = logging.getLogger("cobalt_purestorage.test_lazy")
+    logger.setLevel(logging.INFO)
+
+    logger.debug("%s", logging_utils.Lazy(func))
+    func.assert_not_called()
+
+    entry = record("%s", (logging_utils.Lazy(func),))
+    logging_utils.RedactFilter().filter(entry)
+
+    assert entry.getMessage() == "{'password': '***'}"
+
+
+def test_redact_filter():
+    """Test secrets are redacted from arguments and extra fields"""
+
+    entry = record("%s", (CREDENTIALS,), api_token="token", user="acc/one")
+
+    assert logging_utils.RedactFilter().filter(entry)
+    assert "'secret'" not in entry.getMessage()
+    assert entry.api_token == "***"
+    assert entry.user == "acc/one"
+
+
+@pytest.mark.parametrize("fast", [True, False])
+def test_json_formatter(fast):
+    """Test records are formatted as a line of JSON, with or without orjson"""
+
+    try:
+        raise ValueError("broken")
+    except ValueError:
+        entry = record("User: %s", ("acc/one",), user="acc/one")
+        entry.exc_info = sys.exc_info()
+
+    with patch.object(logging_utils, "orjson", logging_utils.orjson if fast else None):
+        line = logging_utils.JsonFormatter().format(entry)
+
+    result = json.loads(line)
+
+    assert "\n" not in line
+    assert result["message"] == "User: acc/one"
+    assert result["user"] == "acc/one"
+    assert result["exception"]["errorType"] == "ValueError"
+
+
+@patch("cobalt_purestorage.configuration.config.log_format", "json")
+def test_configure_logging():
+    """Test the root handler is installed once, in the configured format"""
+
+    root = logging.getLogger()
+
+    with patch.object(root, "handlers", []):
+        logging_utils.configure_logging()
+        handler = root.handlers[0]
+        logging_utils.configure_logging()
+
+        assert root.handlers == [handler]
+        assert isinstance(handler.formatter, logging_utils.JsonFormatter)
+        assert isinstance(handler.filters[0], logging_utils.RedactFilter)
@@ -0,0 +1,114 @@
+""" Test Metrics Module """
+
+import logging
+import time
+from unittest.mock import patch
+
+import pytest
+
+import cobalt_purestorage.metrics as metrics
+
+
+def sample(name, **labels):
+    return metrics.REGISTRY.get_sample_value(name, labels) or 0
+
+
+def test_timed():
+    """Test the timed context manager counts successes and errors"""
+
+    labels = {"array": "fb01", "method": "test_timed"}
+    name = "cobalt_flashblade_requests_total"
+    args = (metrics.FB_REQUEST_SECONDS, metrics.FB_REQUESTS, "fb01", "test_timed")
+
+    with metrics.timed(*args):
+        pass
+
+    with metrics.timed(*args) as call:
+        call.ok = False
+
+    with pytest.raises(ValueError):
+        with metrics.timed(*args):
+            raise ValueError
+
+    assert sample(name, result="success", **labels) == 1
+    assert sample(name, result="error", **labels) == 2
+    assert sample("cobalt_flashblade_request_duration_seconds_count", **labels) == 3
+
+
+def test_record_run():
+    """Test the rotation gauges"""
+
+    metrics.record_run(
+        "fb01",
+        {"rotated": ["a", "b"], "failed": ["c"], "skipped": []},
+        {"a": time.time() - 100},
+    )
+
+    assert sample("cobalt_rotation_users_scanned", array="fb01") == 3
+    assert sample("cobalt_rotation_users", array="fb01", outcome="rotated") == 2
+    assert sample("cobalt_rotation_users", array="fb01", outcome="failed") == 1
+    assert sample("cobalt_rotation_users", array="fb01", outcome="skipped") == 0
+    assert sample("cobalt_newest_access_key_age_seconds", array="fb01", user="a") >= 100
+    assert sample("cobalt_rotation_last_run_timestamp_seconds") == pytest.approx(
+        time.time(), abs=5
+    )
+
+
+def test_record_run_removed():
+    """Test the key age of a user that is gone is no longer reported,
+    and is left alone by a run that only counts outcomes
+    """
+
+    metrics.record_run("fb02", {"rotated": ["a", "b"]}, {"a": 0, "b": 0})
+    metrics.record_run("fb02", {"rotated": ["a", "b"]})
+    assert sample("cobalt_newest_access_key_age_seconds", array="fb02", user="b")
+
+    metrics.record_run("fb02", {"rotated": ["a"], "invalid": ["b"]}, {"a": 0})
+    metrics.record_run("fb02", {"invalid": ["c"]}, {})
+
+    assert sample("cobalt_newest_access_key_age_seconds", array="fb02", user="a")
+    assert not sample("cobalt_newest_access_key_age_seconds", array="fb02", user="b")
+
+
+def test_exposition():
+    """Test the metrics are served in the Prometheus text format"""
+
+    status, content_type, body = metrics.exposition()
+
+    assert status == 200
+    assert content_type.startswith("text/plain")
+    assert b"cobalt_rotation_users_scanned" in body
+
+
+def test_dump(tmp_path):
+    """Test writing the metrics textfile and pushing to a gateway"""
+
+    textfile = tmp_path / "cobalt.prom"
+
+    with patch(
+        "cobalt_purestorage.configuration.config.metrics_textfile", str(textfile)
+    ), patch(
+        "cobalt_purestorage.configuration.config.metrics_pushgateway", "gateway:9091"
+    ), patch(
+        "cobalt_purestorage.metrics.push_to_gateway"
+    ) as mock_push:
+        metrics.dump()
+
+    assert b"cobalt_rotation_users_scanned" in textfile.read_bytes()
+    mock_push.assert_called_once_with(
+        "gateway:9091", job="cobalt-purestorage", registry=metrics.REGISTRY
+    )
+
+
+@patch("cobalt_purestorage.configuration.config.metrics_textfile", None)
+@patch("cobalt_purestorage.configuration.config.metrics_pushgateway", "gateway:9091")
+@patch("cobalt_purestorage.metrics.push_to_gateway")
+def test_dump_failure(mock_push, caplog):
+    """Test a failed push is logged rather than raised"""
+
+    mock_push.side_effect = OSError("unreachable")
+
+    with caplog.at_level(logging.ERROR):
+        metrics.dump()
+
+    assert "Could not push metrics" in caplog.text
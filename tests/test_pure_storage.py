@@ -6,7 +6,14 @@ import pytest
 import requests
 from pypureclient.flashblade import Client
 
-from cobalt_purestorage.pure_storage import PureStorageFlashBlade
+from cobalt_purestorage.models import AccessKey
+from cobalt_purestorage.pure_storage import (
+    PureStorageFlashBlade,
+    chunked,
+    default_timeout,
+    or_filter,
+    pool_size,
+)
 
 MOCK_FB_URL = "169.254.99.99"
 
@@ -60,7 +67,7 @@ def mock_api_response(items, status_code):
     return resp
 
 
-@patch("cobalt_purestorage.pure_storage.Client")
+@patch("pypureclient.flashblade.Client")
 def test_init_ok(mock, requests_mock):
     """Test the class initialisation."""
 
@@ -70,10 +77,21 @@ def test_init_ok(mock, requests_mock):
 
     fb = PureStorageFlashBlade()
     mock.assert_called_once()
-    mock.assert_called_with(MOCK_FB_URL, api_token="mock-token", timeout=1)
+    mock.assert_called_with(MOCK_FB_URL, api_token="mock-token", timeout=1, retries=0)
     assert isinstance(fb, PureStorageFlashBlade)
 
 
+@patch("pypureclient.flashblade.Client")
+def test_init_array(mock):
+    """Test the client can be created for a given array"""
+
+    fb = PureStorageFlashBlade("fb02", "fb02-token", 30, "second")
+
+    mock.assert_called_with("fb02", api_token="fb02-token", timeout=30, retries=0)
+    assert fb.name == "second"
+    assert PureStorageFlashBlade("fb03").name == "fb03"
+
+
 def test_init_conn_failure(requests_mock):
     """Test the class initialisation error handing
     where there is a connection failure.
@@ -107,10 +125,10 @@ def test_init_pure_failure(requests_mock):
         fb = PureStorageFlashBlade()
 
 
-@patch("cobalt_purestorage.pure_storage.Client")
+@patch("pypureclient.flashblade.Client")
 @pytest.mark.parametrize(
     "items, status_code, expected",
-    [(["pytest"], 200, True), ([], 200, False), ([], 400, False)],
+    [([{"name": "test"}], 200, True), ([], 200, False), ([], 400, False)],
 )
 def test_object_store_user_exists(mock, items, status_code, expected):
     """Test the object_store_user_exists function"""
@@ -123,11 +141,11 @@ def test_object_store_user_exists(mock, items, status_code, expected):
     assert result == expected
 
 
-@patch("cobalt_purestorage.pure_storage.Client")
+@patch("pypureclient.flashblade.Client")
 @pytest.mark.parametrize(
     "items, status_code, expected",
     [
-        ([{"pytest": "pytest"}], 200, [{"pytest": "pytest"}]),
+        ([{"name": "pytest"}], 200, [AccessKey("pytest")]),
         ([], 200, []),
         ([], 400, None),
     ],
@@ -144,10 +162,17 @@ def test_get_access_keys_for_user(mock, items, status_code, expected):
     assert result == expected
 
 
-@patch("cobalt_purestorage.pure_storage.Client")
+@patch("pypureclient.flashblade.Client")
 @pytest.mark.parametrize(
     "items, status_code, expected",
-    [([{"k": "v"}], 400, None), ([{"k": "v"}], 200, {"k": "v"})],
+    [
+        ([{"name": "k"}], 400, None),
+        (
+            [{"name": "k", "secret_access_key": "v"}],
+            200,
+            AccessKey("k", secret_access_key="v"),
+        ),
+    ],
 )
 def test_post_object_store_access_keys(mock, items, status_code, expected):
     """Test the post_object_store_access_keys method"""
@@ -161,15 +186,287 @@ def test_post_object_store_access_keys(mock, items, status_code, expected):
     assert result == expected
 
 
-@patch("cobalt_purestorage.pure_storage.Client")
-@pytest.mark.parametrize("status_code,expected", [(200, True), (400, False)])
-def test_delete_object_store_access_keys(mock, status_code, expected, caplog):
-    """Test the delete_object_store_access_keys method"""
+@patch("pypureclient.flashblade.Client")
+@pytest.mark.parametrize(
+    "status_code,existing,expected",
+    [(200, [], True), (400, [{"name": "pytest"}], False), (400, [], True)],
+)
+def test_delete_object_store_access_keys(mock, status_code, existing, expected):
+    """Test the delete_object_store_access_keys method, a failed delete
+    succeeds if the keys are gone
+    """
 
     fb = PureStorageFlashBlade()
     fb.client.delete_object_store_access_keys.return_value.to_dict = Mock(
         return_value=mock_api_response([], status_code)
     )
+    fb.client.get_object_store_access_keys.return_value.to_dict = Mock(
+        return_value=mock_api_response(existing, 200)
+    )
 
-    result = fb.delete_object_store_access_keys([])
+    result = fb.delete_object_store_access_keys(["pytest"])
     assert result == expected
+
+
+def test_chunked():
+    """Test the chunked function"""
+
+    assert list(chunked(range(5), 2)) == [[0, 1], [2, 3], [4]]
+    assert list(chunked([], 2)) == []
+
+
+def test_or_filter():
+    """Test the or_filter function"""
+
+    assert or_filter("name", ["a/one", "a/two"]) == 'name="a/one" or name="a/two"'
+
+
+@patch("cobalt_purestorage.configuration.config.fb_filter_chunk_size", 2)
+@patch("pypureclient.flashblade.Client")
+def test_get_object_store_users_by_name(mock):
+    """Test the get_object_store_users_by_name method"""
+
+    fb = PureStorageFlashBlade()
+    fb.client.get_object_store_users.return_value.to_dict = Mock(
+        side_effect=[
+            mock_api_response([{"name": "a"}, {"name": "b"}], 200),
+            mock_api_response([], 200),
+        ]
+    )
+
+    result = fb.get_object_store_users_by_name(["c", "b", "a"])
+
+    assert result == {"a", "b"}
+    assert fb.client.get_object_store_users.call_count == 2
+    fb.client.get_object_store_users.assert_any_call(
+        filter='name="a" or name="b"', limit=1000, continuation_token=None
+    )
+    fb.client.get_object_store_users.assert_any_call(
+        filter='name="c"', limit=1000, continuation_token=None
+    )
+
+
+@patch("cobalt_purestorage.configuration.config.fb_list_limit", 2)
+@patch("pypureclient.flashblade.Client")
+def test_list_object_store_users(mock):
+    """Test users are listed a page at a time until there is no
+    continuation token
+    """
+
+    first = mock_api_response([{"name": "a/1"}, {"name": "a/2"}], 200)
+    first["continuation_token"] = "next"
+
+    fb = PureStorageFlashBlade()
+    fb.client.get_object_store_users.return_value.to_dict = Mock(
+        side_effect=[first, mock_api_response([{"name": "a/3"}], 200)]
+    )
+
+    pages = fb.list_object_store_users('name="a/*"')
+
+    assert next(pages) == ["a/1", "a/2"]
+    fb.client.get_object_store_users.assert_called_once_with(
+        filter='name="a/*"', limit=2, continuation_token=None
+    )
+
+    assert list(pages) == [["a/3"]]
+    fb.client.get_object_store_users.assert_called_with(
+        filter='name="a/*"', limit=2, continuation_token="'next'"
+    )
+
+
+@patch("pypureclient.flashblade.Client")
+def test_items(mock):
+    """Test items are yielded one at a time, a page is only fetched
+    once the previous one is used up
+    """
+
+    first = mock_api_response([{"name": "k1"}, {"name": "k2"}], 200)
+    first["continuation_token"] = "next"
+
+    fb = PureStorageFlashBlade()
+    fb.client.get_object_store_access_keys.return_value.to_dict = Mock(
+        side_effect=[first, mock_api_response([{"name": "k3"}], 200)]
+    )
+
+    keys = fb.object_store_access_keys('user.name="a"', limit=2)
+
+    assert [next(keys), next(keys)] == [AccessKey("k1"), AccessKey("k2")]
+    assert fb.client.get_object_store_access_keys.call_count == 1
+    assert list(keys) == [AccessKey("k3")]
+    assert fb.client.get_object_store_access_keys.call_count == 2
+
+
+@patch("cobalt_purestorage.configuration.config.fb_list_limit", 1)
+@patch("pypureclient.flashblade.Client")
+def test_get_access_keys_for_users_pages(mock):
+    """Test keys beyond the first page are not cut off"""
+
+    keys = [{"name": f"k{x}", "user": {"name": "a"}} for x in range(3)]
+    pages = [mock_api_response([x], 200) for x in keys]
+    for page, token in zip(pages, ["1", "2", None]):
+        page["continuation_token"] = token
+
+    fb = PureStorageFlashBlade()
+    fb.client.get_object_store_access_keys.return_value.to_dict = Mock(
+        side_effect=pages
+    )
+
+    assert fb.get_access_keys_for_users(["a"]) == {
+        "a": [AccessKey(f"k{x}", user_name="a") for x in range(3)]
+    }
+
+
+@patch("pypureclient.flashblade.Client")
+def test_object_store_user_exists_limit(mock):
+    """Test the existence check asks for a single user"""
+
+    fb = PureStorageFlashBlade()
+    fb.client.get_object_store_users.return_value.to_dict = Mock(
+        return_value=mock_api_response([{"name": "test"}], 200)
+    )
+
+    assert fb.object_store_user_exists("test")
+    fb.client.get_object_store_users.assert_called_once_with(
+        limit=1, continuation_token=None, filter='name="test"'
+    )
+
+
+@patch("pypureclient.flashblade.Client")
+def test_list_object_store_users_error(mock):
+    """Test a failed page raises"""
+
+    fb = PureStorageFlashBlade()
+    fb.client.get_object_store_users.return_value.to_dict.return_value = (
+        mock_api_response([], 400)
+    )
+
+    with pytest.raises(RuntimeError):
+        list(fb.list_object_store_users('name="a/*"'))
+
+
+@patch("pypureclient.flashblade.Client")
+def test_get_object_store_users_by_name_error(mock):
+    """Test the get_object_store_users_by_name method error handling"""
+
+    fb = PureStorageFlashBlade()
+    fb.client.get_object_store_users.return_value.to_dict = Mock(
+        return_value=mock_api_response([], 400)
+    )
+
+    with pytest.raises(RuntimeError):
+        fb.get_object_store_users_by_name(["a"])
+
+
+@patch("pypureclient.flashblade.Client")
+@pytest.mark.parametrize("status_code", [200, 400])
+def test_get_access_keys_for_users(mock, status_code, mock_data):
+    """Test the get_access_keys_for_users method"""
+
+    fb = PureStorageFlashBlade()
+    fb.client.get_object_store_access_keys.return_value.to_dict = Mock(
+        return_value=mock_api_response(mock_data["access_keys"], status_code)
+    )
+    names = [x["name"] for x in mock_data["users"]]
+
+    if status_code == 400:
+        with pytest.raises(RuntimeError):
+            fb.get_access_keys_for_users(names)
+        return
+
+    result = fb.get_access_keys_for_users(names)
+
+    assert set(result) == set(names)
+    for user in mock_data["users"]:
+        assert [x.name for x in result[user["name"]]] == [
+            x["name"] for x in user["access_keys"]
+        ]
+
+
+@pytest.mark.parametrize(
+    "connect,read,expected",
+    [(None, None, 1), (3, None, (3, 1)), (None, 30, (1, 30)), (3, 30, (3, 30))],
+)
+def test_timeout(connect, read, expected):
+    """Test the default_timeout function"""
+
+    with patch(
+        "cobalt_purestorage.configuration.config.fb_connect_timeout", connect
+    ), patch("cobalt_purestorage.configuration.config.fb_read_timeout", read):
+        assert default_timeout() == expected
+
+
+@patch("cobalt_purestorage.configuration.config.rotation_concurrency", 8)
+@pytest.mark.parametrize("size,expected", [(None, 8), (32, 32)])
+def test_pool_size(size, expected):
+    """Test the pool_size function"""
+
+    with patch("cobalt_purestorage.configuration.config.fb_pool_size", size):
+        assert pool_size() == expected
+
+
+@patch("cobalt_purestorage.configuration.config.fb_pool_size", 16)
+@patch("cobalt_purestorage.configuration.config.fb_connect_timeout", 2)
+@patch("pypureclient.flashblade.Client")
+def test_init_session(mock):
+    """Test the client is created with split timeouts and a sized pool"""
+
+    fb = PureStorageFlashBlade()
+
+    mock.assert_called_with(
+        MOCK_FB_URL, api_token="mock-token", timeout=(2, 1), retries=0
+    )
+    pool_manager = fb.client._api_client.rest_client.pool_manager
+    pool_manager.connection_pool_kw.__setitem__.assert_any_call("maxsize", 16)
+    pool_manager.connection_pool_kw.__setitem__.assert_any_call("block", True)
+    pool_manager.clear.assert_called_once()
+
+
+@patch("cobalt_purestorage.resilience.time.sleep")
+@patch("pypureclient.flashblade.Client")
+def test_delete_object_store_access_keys_retry(mock, mock_sleep):
+    """Test transient failures are retried"""
+
+    fb = PureStorageFlashBlade()
+    fb.client.delete_object_store_access_keys.return_value.to_dict = Mock(
+        side_effect=[mock_api_response([], 503), mock_api_response([], 200)]
+    )
+
+    assert fb.delete_object_store_access_keys(["pytest"]) is True
+    assert fb.client.delete_object_store_access_keys.call_count == 2
+    mock_sleep.assert_called_once()
+
+
+@patch("cobalt_purestorage.resilience.time.sleep", Mock())
+@patch("pypureclient.flashblade.Client")
+def test_delete_object_store_access_keys_applied(mock):
+    """Test a delete applied before a server error is not reported
+    failed when its retry finds the keys gone
+    """
+
+    fb = PureStorageFlashBlade()
+    fb.client.delete_object_store_access_keys.return_value.to_dict = Mock(
+        side_effect=[mock_api_response([], 503), mock_api_response([], 400)]
+    )
+    fb.client.get_object_store_access_keys.return_value.to_dict = Mock(
+        return_value=mock_api_response([], 200)
+    )
+
+    assert fb.delete_object_store_access_keys(["k1", "k2"]) is True
+    fb.client.get_object_store_access_keys.assert_called_once_with(
+        filter='name="k1" or name="k2"', limit=1000, continuation_token=None
+    )
+
+
+@patch("cobalt_purestorage.resilience.time.sleep")
+@patch("pypureclient.flashblade.Client")
+def test_post_object_store_access_keys_no_retry(mock, mock_sleep):
+    """Test key creation is not retried when the array may have acted on it"""
+
+    fb = PureStorageFlashBlade()
+    fb.client.post_object_store_access_keys.return_value.to_dict = Mock(
+        return_value=mock_api_response([], 503)
+    )
+
+    assert fb.post_object_store_access_keys("pytest") is None
+    fb.client.post_object_store_access_keys.assert_called_once()
+    mock_sleep.assert_not_called()
@@ -0,0 +1,138 @@
+""" Test Resilience Module """
+
+from unittest.mock import Mock, patch
+
+import pytest
+import urllib3
+
+from cobalt_purestorage.resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    RetryPolicy,
+    call_with_retry,
+)
+
+
+def response(status_code):
+    """Mock out a FB API response dict"""
+
+    return {"status_code": status_code}
+
+
+@pytest.mark.parametrize("attempt", [1, 2, 3, 10])
+def test_retry_policy_delay(attempt):
+    """Test the backoff is jittered and capped"""
+
+    policy = RetryPolicy(attempts=3, base_delay=0.5, max_delay=4)
+
+    for _ in range(50):
+        assert 0 <= policy.delay(attempt) <= min(4, 0.5 * 2**attempt)
+
+
+@patch("cobalt_purestorage.resilience.time.monotonic")
+def test_circuit_breaker(mock_time):
+    """Test the breaker opens, half opens and closes"""
+
+    mock_time.return_value = 100
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+
+    breaker.record_failure()
+    breaker.before_call()
+    breaker.record_failure()
+
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    # after the reset timeout a single trial call is let through
+    mock_time.return_value = 131
+    breaker.before_call()
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    breaker.record_success()
+    breaker.before_call()
+    assert breaker.failures == 0
+
+
+@patch("cobalt_purestorage.resilience.time.sleep")
+@pytest.mark.parametrize(
+    "statuses,idempotent,expected_status,expected_calls",
+    [
+        ([200], True, 200, 1),
+        ([503, 200], True, 200, 2),
+        ([503, 503, 503], True, 503, 3),
+        ([400], True, 400, 1),
+        ([500], False, 500, 1),
+        ([429, 200], False, 200, 2),
+    ],
+)
+def test_call_with_retry(
+    mock_sleep, statuses, idempotent, expected_status, expected_calls
+):
+    """Test which responses are retried"""
+
+    request = Mock(side_effect=[response(x) for x in statuses])
+    policy = RetryPolicy(attempts=3, base_delay=0.1, max_delay=1)
+    breaker = CircuitBreaker(failure_threshold=10, reset_timeout=30)
+
+    resp = call_with_retry("pytest", request, policy, breaker, idempotent)
+
+    assert resp["status_code"] == expected_status
+    assert request.call_count == expected_calls
+    assert mock_sleep.call_count == expected_calls - 1
+
+
+@patch("cobalt_purestorage.resilience.time.sleep")
+@pytest.mark.parametrize("idempotent,expected_calls", [(True, 2), (False, 1)])
+def test_call_with_retry_exception(mock_sleep, idempotent, expected_calls):
+    """Test transient exceptions are only retried for idempotent calls"""
+
+    error = urllib3.exceptions.ProtocolError("connection reset")
+    request = Mock(side_effect=[error, response(200)])
+    policy = RetryPolicy(attempts=3, base_delay=0.1, max_delay=1)
+    breaker = CircuitBreaker(failure_threshold=10, reset_timeout=30)
+
+    if idempotent:
+        assert call_with_retry("pytest", request, policy, breaker, idempotent)
+    else:
+        with pytest.raises(urllib3.exceptions.ProtocolError):
+            call_with_retry("pytest", request, policy, breaker, idempotent)
+
+    assert request.call_count == expected_calls
+
+
+@patch("cobalt_purestorage.resilience.time.sleep")
+def test_call_with_retry_opens_breaker(mock_sleep):
+    """Test a run of failures opens the breaker and stops further calls"""
+
+    request = Mock(return_value=response(503))
+    policy = RetryPolicy(attempts=5, base_delay=0.1, max_delay=1)
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+
+    with pytest.raises(CircuitOpenError):
+        call_with_retry("pytest", request, policy, breaker)
+
+    assert request.call_count == 2
+
+
+@patch("cobalt_purestorage.resilience.time.monotonic")
+def test_call_with_retry_trial_error(mock_time):
+    """Test a trial call raising an unexpected error does not leave
+    the breaker half open for good
+    """
+
+    mock_time.return_value = 100
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30)
+    policy = RetryPolicy(attempts=3, base_delay=0.1, max_delay=1)
+    breaker.record_failure()
+
+    mock_time.return_value = 131
+    with pytest.raises(KeyError):
+        call_with_retry("pytest", Mock(side_effect=KeyError("items")), policy, breaker)
+
+    # the failed trial opened the breaker again, and the next trial goes through
+    with pytest.raises(CircuitOpenError, match="is open"):
+        breaker.before_call()
+
+    mock_time.return_value = 162
+    assert call_with_retry("pytest", Mock(return_value=response(200)), policy, breaker)
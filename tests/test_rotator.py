@@ -1,12 +1,27 @@
 """ Test Rotater Module """
 
+import json
+import time
 from datetime import datetime
-from unittest.mock import mock_open, patch
+from types import SimpleNamespace
+from unittest.mock import Mock, mock_open, patch
 
 import pytest
 
 import cobalt_purestorage.configuration as config
+import cobalt_purestorage.inventory as inventory
 import cobalt_purestorage.rotator as rotator
+import cobalt_purestorage.sharding as sharding
+from cobalt_purestorage.configuration import FlashBladeArray, SecretTarget
+from cobalt_purestorage.inventory import UserEntry
+from cobalt_purestorage.models import AccessKey
+from cobalt_purestorage.resilience import CircuitOpenError
+
+
+def access_keys(mock_user):
+    """Return a mock_data user's keys, as the FlashBlade client returns them"""
+
+    return [AccessKey.from_dict(x) for x in mock_user["access_keys"]]
 
 
 def test_base64():
@@ -35,6 +50,11 @@ def test_generate_aws_credentials(mock_dt, mock_credentials):
     expiration = datetime.fromisoformat(result["Expiration"].replace("Z", ""))
     assert expiration == datetime(2000, 1, 1, 0, 23, 30)
 
+    result = rotator.generate_aws_credentials(mock_credentials, 3600, 0)
+
+    expiration = datetime.fromisoformat(result["Expiration"].replace("Z", ""))
+    assert expiration == datetime(2000, 1, 1, 1, 30, 0)
+
 
 @patch("cobalt_purestorage.configuration.config.access_key_min_age", 3600)
 @patch("cobalt_purestorage.configuration.config.access_key_age_variance", 10)
@@ -45,6 +65,8 @@ def test_key_too_recent(mock_keys):
     """Test the key_too_recent function."""
 
     assert rotator.key_too_recent(mock_keys[0]) == mock_keys[1]
+    assert rotator.key_too_recent(mock_keys[0], 7200, 10) is True
+    assert rotator.key_too_recent(mock_keys[0], 60, 10) is False
 
 
 @patch("cobalt_purestorage.rotator.update_k8s")
@@ -67,7 +89,7 @@ def test_update_credentials(mock_update_local, mock_update_k8s):
 @patch("cobalt_purestorage.configuration.config.k8s_namespace", "pytest")
 @patch("cobalt_purestorage.configuration.config.k8s_secret_name", "secret")
 @patch("cobalt_purestorage.configuration.config.k8s_secret_key", "data")
-@patch("cobalt_purestorage.rotator.K8S")
+@patch("cobalt_purestorage.k8s.get_k8s")
 def test_update_k8s(mock):
     """Test the update_k8s function"""
 
@@ -94,13 +116,14 @@ def test_update_local(mock):
 @patch("cobalt_purestorage.configuration.config.access_key_min_age", 3600)
 @patch("cobalt_purestorage.configuration.config.access_key_age_variance", 90)
 @patch("cobalt_purestorage.configuration.config.k8s_mode", True)
+@patch("cobalt_purestorage.rotator.missing_secret_users", Mock(return_value=[]))
 @patch("cobalt_purestorage.rotator.PureStorageFlashBlade")
-@patch("cobalt_purestorage.rotator.update_k8s")
+@patch("cobalt_purestorage.rotator.SecretBatch")
 @pytest.mark.parametrize(
     "index,user_exists",
     [(0, True), (1, True), (2, True), (3, True), (4, True), (0, False)],
 )
-def test_main_key_actions(mock_k8s, mock_fb, index, user_exists, mock_data):
+def test_main_key_actions(mock_batch, mock_fb, index, user_exists, mock_data):
     """This test runs multiple times, using one user dict from the mock_data fixture in each iteration
     The index value is used to select the user dict from the mock_data list
     """
@@ -111,31 +134,37 @@ def test_main_key_actions(mock_k8s, mock_fb, index, user_exists, mock_data):
     # test the function call args
     sorted_keys = []
     if len(mock_user["access_keys"]) > 0:
-        sorted_keys = sorted(mock_user["access_keys"], key=lambda d: d["created"])
+        sorted_keys = sorted(access_keys(mock_user), key=lambda d: d.created)
 
     #   the pytest expected result actions are embedded into the test data to assert against
     #  convert to a set for easy comparison
     expected_results = set(mock_user["pytest_expected_results"])
 
     fb = mock_fb.return_value
-
-    fb.get_access_keys_for_user.return_value = "xx"
+    mock_k8s = mock_batch.return_value.add
+    mock_batch.return_value.flush.return_value = []
 
     with patch(
         "cobalt_purestorage.configuration.config.interesting_users", [mock_user["name"]]
     ):
         # mock the response to indicate wether the user exists
-        fb.object_store_user_exists.return_value = user_exists
-        fb.get_access_keys_for_user.return_value = mock_user["access_keys"]
+        fb.get_object_store_users_by_name.return_value = (
+            {mock_user["name"]} if user_exists else set()
+        )
+        fb.get_access_keys_for_users.return_value = {
+            mock_user["name"]: access_keys(mock_user)
+        }
         rotator.main()
 
         if user_exists == False:
-            fb.object_store_user_exists.assert_called_with(mock_user["name"])
+            fb.get_object_store_users_by_name.assert_called_with({mock_user["name"]})
+            fb.get_access_keys_for_users.assert_not_called()
             fb.delete_object_store_access_keys.assert_not_called()
             fb.post_object_store_access_keys.assert_not_called()
 
         if user_exists == True:
-            fb.object_store_user_exists.assert_called_with(mock_user["name"])
+            fb.get_object_store_users_by_name.assert_called_with({mock_user["name"]})
+            fb.get_access_keys_for_users.assert_called_once()
 
             if expected_results == {"skip"}:
                 fb.delete_object_store_access_keys.assert_not_called()
@@ -153,7 +182,7 @@ def test_main_key_actions(mock_k8s, mock_fb, index, user_exists, mock_data):
                 fb.post_object_store_access_keys.assert_called_with(mock_user["name"])
                 fb.delete_object_store_access_keys.assert_called_once()
                 fb.delete_object_store_access_keys.assert_called_with(
-                    [sorted_keys[0]["name"]]
+                    [sorted_keys[0].name]
                 )
                 mock_k8s.assert_called_once()
 
@@ -170,5 +199,616 @@ def test_main_key_actions_no_users(mock_fb):
 
     fb = mock_fb.return_value
     rotator.main()
-    fb.object_store_user_exists.assert_not_called()
-    fb.get_access_keys_for_user.assert_not_called()
+    fb.get_object_store_users_by_name.assert_not_called()
+    fb.get_access_keys_for_users.assert_not_called()
+
+
+def test_fetch_inventory(mock_data):
+    """Test the fetch_inventory function"""
+
+    fb = Mock()
+    users = mock_data["users"]
+    fb.get_object_store_users_by_name.return_value = {x["name"] for x in users[:3]}
+    fb.get_access_keys_for_users.return_value = {
+        x["name"]: access_keys(x) for x in users[:2]
+    }
+
+    result = rotator.fetch_inventory(fb, [x["name"] for x in users[:4]])
+
+    assert list(result) == sorted(x["name"] for x in users[:3])
+    assert result[users[1]["name"]] == access_keys(users[1])
+    assert result[users[2]["name"]] == []
+    fb.get_access_keys_for_users.assert_called_once_with({x["name"] for x in users[:3]})
+
+
+def test_fetch_inventory_known_existing():
+    """Test users just listed from the array are not looked up again"""
+
+    fb = Mock()
+    fb.get_access_keys_for_users.return_value = {"a": [AccessKey("k", 1000)]}
+
+    result = rotator.fetch_inventory(fb, ["a", "b"], known_existing=True)
+
+    assert result == {"a": [AccessKey("k", 1000)], "b": []}
+    fb.get_object_store_users_by_name.assert_not_called()
+
+
+def test_newest_keys():
+    """Test the newest_keys function"""
+
+    inventory = {
+        "a": [AccessKey("k", 1000), AccessKey("k", 3000)],
+        "b": [AccessKey("k", 1000)],
+        "c": [],
+        "d": [],
+    }
+    outcomes = {"a": rotator.SKIPPED, "b": rotator.ROTATED, "c": rotator.CREATED}
+
+    assert rotator.newest_keys(outcomes, inventory, 50) == {"a": 3, "b": 50, "c": 50}
+
+
+@patch("cobalt_purestorage.configuration.config.access_key_min_age", 3600)
+@patch("cobalt_purestorage.configuration.config.access_key_age_variance", 90)
+@patch("cobalt_purestorage.configuration.config.rotation_concurrency", 4)
+@patch("cobalt_purestorage.rotator.PureStorageFlashBlade")
+@patch("cobalt_purestorage.rotator.update_credentials")
+def test_main_concurrent_summary(mock_update, mock_fb, mock_data):
+    """Test that users are rotated concurrently, failures are isolated
+    and the summary is deterministic
+    """
+
+    users = {x["name"]: x for x in mock_data["users"]}
+    fb = mock_fb.return_value
+    fb.get_object_store_users_by_name.return_value = set(users) - {"mock_fake/one"}
+    fb.get_access_keys_for_users.return_value = {
+        name: access_keys(user) for name, user in users.items()
+    }
+
+    def post(user_name):
+        if user_name == "mock_hai/three":
+            raise RuntimeError("boom")
+        return AccessKey("PSFB", secret_access_key="***")
+
+    fb.post_object_store_access_keys.side_effect = post
+
+    with patch("cobalt_purestorage.configuration.config.interesting_users", set(users)):
+        summary = rotator.main()
+
+    assert summary == {
+        "created": ["mock_hai/one"],
+        "rotated": ["mock_hai/four"],
+        "skipped": [
+            "mock_ana/one",
+            "mock_ana/two",
+            "mock_fake/two",
+            "mock_hai/two",
+        ],
+        "too_many_keys": ["mock_ana/three", "mock_hai/five"],
+        "invalid": ["mock_fake/one"],
+        "failed": ["mock_hai/three"],
+    }
+    assert mock_update.call_count == 2
+
+
+@patch("cobalt_purestorage.configuration.config.k8s_namespace", "pytest")
+@patch("cobalt_purestorage.configuration.config.k8s_secret_name", "secret")
+@patch("cobalt_purestorage.configuration.config.k8s_secret_key", "data")
+@patch(
+    "cobalt_purestorage.configuration.config.user_secret_targets",
+    {
+        "one": SecretTarget(namespace="other", secret="one-secret"),
+        "two": SecretTarget(key="two"),
+    },
+)
+@pytest.mark.parametrize(
+    "user_name,expected",
+    [
+        ("one", ("other", "one-secret", "data")),
+        ("two", ("pytest", "secret", "two")),
+        ("three", ("pytest", "secret", "data")),
+    ],
+)
+def test_secret_target(user_name, expected):
+    """Test the secret_target function"""
+
+    assert rotator.secret_target(user_name) == expected
+
+    # a target read from USERS_FILE takes precedence
+    entry = UserEntry(name=user_name, target={"secret": "file-secret"})
+    with inventory.loaded([entry]):
+        assert rotator.secret_target(user_name)[1] == "file-secret"
+
+
+@patch("cobalt_purestorage.configuration.config.k8s_namespace", "pytest")
+@patch("cobalt_purestorage.configuration.config.k8s_secret_name", "secret")
+@patch("cobalt_purestorage.configuration.config.k8s_secret_key", "data")
+@patch(
+    "cobalt_purestorage.configuration.config.user_secret_targets",
+    {
+        "one": SecretTarget(key="one"),
+        "two": SecretTarget(key="two"),
+        "three": SecretTarget(secret="other", key="three"),
+    },
+)
+@patch("cobalt_purestorage.k8s.get_k8s")
+def test_secret_batch(mock):
+    """Test that users sharing a secret are published with a single patch"""
+
+    k = mock.return_value
+    # secrets are patched in sorted order, so "other" is patched first
+    k.update_secret_data.side_effect = [RuntimeError("boom"), None]
+
+    batch = rotator.SecretBatch()
+    batch.add({"pytest": "one"}, "one")
+    batch.add({"pytest": "two"}, "two")
+    batch.add({"pytest": "three"}, "three")
+
+    failed = batch.flush()
+
+    assert failed == ["three"]
+    assert k.update_secret_data.call_count == 2
+    k.update_secret_data.assert_any_call(
+        "pytest",
+        "secret",
+        {
+            "one": rotator.base64(json.dumps({"pytest": "one"})),
+            "two": rotator.base64(json.dumps({"pytest": "two"})),
+        },
+    )
+    assert batch.flush() == []
+
+
+@patch("cobalt_purestorage.configuration.config.k8s_namespace", "pytest")
+@patch("cobalt_purestorage.configuration.config.k8s_secret_name", "secret")
+@patch(
+    "cobalt_purestorage.configuration.config.user_secret_targets",
+    {"one": SecretTarget(namespace="other"), "two": SecretTarget(secret="missing")},
+)
+@patch("cobalt_purestorage.k8s.get_k8s")
+def test_missing_secret_users(mock):
+    """Test the missing_secret_users function"""
+
+    k = mock.return_value
+    k.prefetch_secrets.side_effect = lambda ns, names: (
+        {"missing"} if ns == "pytest" else set()
+    )
+
+    assert rotator.missing_secret_users(["one", "two", "three"]) == ["two"]
+    k.prefetch_secrets.assert_any_call("pytest", ["missing", "secret"])
+    k.prefetch_secrets.assert_any_call("other", ["secret"])
+    assert k.prefetch_secrets.call_count == 2
+
+
+@patch("cobalt_purestorage.configuration.config.interesting_users", {"pytest"})
+@patch("cobalt_purestorage.configuration.config.k8s_mode", True)
+@patch("cobalt_purestorage.rotator.missing_secret_users", Mock(return_value=["pytest"]))
+@patch("cobalt_purestorage.rotator.PureStorageFlashBlade")
+def test_main_missing_secret(mock_fb):
+    """Test main does not touch the array for users whose secret is missing"""
+
+    assert rotator.main() == {"failed": ["pytest"]}
+    mock_fb.assert_not_called()
+
+
+@patch("cobalt_purestorage.configuration.config.k8s_mode", True)
+@patch("cobalt_purestorage.configuration.config.k8s_prefetch_secrets", False)
+@patch("cobalt_purestorage.k8s._k8s")
+def test_rotate_users_clears_secret_cache(mock_k8s):
+    """Test each pass checks the secrets afresh, the shared client
+    outliving the pass in daemon mode
+    """
+
+    fb = Mock()
+    fb.get_object_store_users_by_name.return_value = set()
+
+    rotator.rotate_users(["one"], fb)
+    rotator.rotate_users(["one"], fb)
+
+    assert mock_k8s.clear_secret_cache.call_count == 2
+
+
+@patch("cobalt_purestorage.configuration.config.interesting_users", {"one", "two"})
+@patch("cobalt_purestorage.configuration.config.k8s_mode", True)
+@patch("cobalt_purestorage.rotator.missing_secret_users", Mock(return_value=[]))
+@patch("cobalt_purestorage.rotator.SecretBatch")
+@patch("cobalt_purestorage.rotator.PureStorageFlashBlade")
+def test_main_circuit_open(mock_fb, mock_batch):
+    """Test an open circuit breaker fails the run after publishing"""
+
+    fb = mock_fb.return_value
+    fb.get_object_store_users_by_name.return_value = {"one", "two"}
+    fb.get_access_keys_for_users.return_value = {}
+    fb.post_object_store_access_keys.side_effect = CircuitOpenError("open")
+
+    with pytest.raises(CircuitOpenError):
+        rotator.main()
+
+    mock_batch.return_value.flush.assert_called_once()
+
+
+ARRAYS = [
+    FlashBladeArray(url="fb01", api_token="one", interesting_users={"a", "b"}),
+    FlashBladeArray(url="fb02", api_token="two", name="second", timeout=30),
+    FlashBladeArray(url="fb03", api_token="three", interesting_users={"c"}),
+]
+
+
+def array_client(url, api_token, timeout, name):
+    if url == "fb03":
+        raise RuntimeError("Could not instantiate FlashBlade client")
+
+    fb = Mock()
+    fb.name = name
+    fb.get_object_store_users_by_name.side_effect = set
+    fb.get_access_keys_for_users.return_value = {}
+    fb.post_object_store_access_keys.return_value = AccessKey(
+        f"{name}-key", secret_access_key="secret"
+    )
+    return fb
+
+
+@patch("cobalt_purestorage.configuration.config.interesting_users", {"d"})
+@patch("cobalt_purestorage.configuration.config.k8s_mode", False)
+@patch("cobalt_purestorage.configuration.config.fb_arrays", ARRAYS)
+@patch("cobalt_purestorage.rotator.update_credentials")
+@patch("cobalt_purestorage.rotator.PureStorageFlashBlade")
+def test_main_arrays(mock_fb, mock_update):
+    """Test each array is rotated with its own client, and a failing
+    array does not affect the others
+    """
+
+    mock_fb.side_effect = array_client
+
+    with pytest.raises(RuntimeError, match="fb03"):
+        rotator.main()
+
+    mock_fb.assert_any_call("fb02", "two", 30, "second")
+    assert rotator.rotate_arrays(ARRAYS) == (
+        {
+            "fb01": {"a": rotator.CREATED, "b": rotator.CREATED},
+            "second": {"d": rotator.CREATED},
+            "fb03": {"c": rotator.FAILED},
+        },
+        ["fb03"],
+    )
+
+
+@patch("cobalt_purestorage.configuration.config.interesting_users", set())
+@patch("cobalt_purestorage.configuration.config.fb_arrays", ARRAYS[:2])
+@patch("cobalt_purestorage.rotator.rotate_users")
+@patch("cobalt_purestorage.rotator.PureStorageFlashBlade")
+def test_main_arrays_summary(mock_fb, mock_rotate):
+    """Test main returns a summary per array, skipping arrays without users"""
+
+    mock_rotate.return_value = {"a": rotator.SKIPPED, "b": rotator.FAILED}, {}, {}
+
+    assert rotator.main() == {
+        "fb01": {rotator.SKIPPED: ["a"], rotator.FAILED: ["b"]},
+        "second": {},
+    }
+    mock_rotate.assert_called_once()
+
+
+@patch("cobalt_purestorage.configuration.config.access_key_min_age", 3600)
+@patch("cobalt_purestorage.configuration.config.access_key_age_variance", 0)
+def test_plan():
+    """Test each user's action is planned from its keys"""
+
+    old = int(time.time() - 7200) * 1000
+    young = int(time.time()) * 1000
+
+    assert rotator.plan(
+        {
+            "none": [],
+            "one": [AccessKey("k1", old)],
+            "two": [AccessKey("k2", old + 1), AccessKey("k3", old)],
+            "young": [AccessKey("k4", young)],
+            "three": [AccessKey(x, old) for x in ("k5", "k6", "k7")],
+        }
+    ) == {
+        "none": (rotator.CREATED, None),
+        "one": (rotator.CREATED, None),
+        "two": (rotator.ROTATED, "k3"),
+        "young": (rotator.SKIPPED, None),
+        "three": (rotator.TOO_MANY_KEYS, None),
+    }
+
+
+@patch("cobalt_purestorage.configuration.config.fb_delete_batch_size", 2)
+@patch("cobalt_purestorage.configuration.config.rotation_concurrency", 2)
+@patch("cobalt_purestorage.rotator.update_credentials")
+def test_apply(mock_update):
+    """Test deletions are batched, and a rejected batch is retried a key
+    at a time so only the bad key's user fails
+    """
+
+    fb = Mock()
+    fb.delete_object_store_access_keys.side_effect = lambda x: "bad" not in x
+    fb.post_object_store_access_keys.return_value = AccessKey(
+        "new", secret_access_key="secret"
+    )
+    planned = {
+        "a": (rotator.ROTATED, "ka"),
+        "b": (rotator.ROTATED, "kb"),
+        "c": (rotator.ROTATED, "bad"),
+        "d": (rotator.ROTATED, "kd"),
+        "e": (rotator.CREATED, None),
+        "f": (rotator.SKIPPED, None),
+    }
+
+    assert rotator.apply(fb, planned) == {
+        "a": rotator.ROTATED,
+        "b": rotator.ROTATED,
+        "c": rotator.FAILED,
+        "d": rotator.ROTATED,
+        "e": rotator.CREATED,
+        "f": rotator.SKIPPED,
+    }
+    assert [x.args[0] for x in fb.delete_object_store_access_keys.call_args_list] == [
+        ["bad", "ka"],
+        ["bad"],
+        ["ka"],
+        ["kb", "kd"],
+    ]
+    assert fb.post_object_store_access_keys.call_count == 4
+
+
+@patch("cobalt_purestorage.rotator.update_credentials")
+def test_apply_delete_error(mock_update):
+    """Test a batch that raises fails its users without creating keys"""
+
+    fb = Mock()
+    fb.delete_object_store_access_keys.side_effect = RuntimeError("broken")
+
+    assert rotator.apply(fb, {"a": (rotator.ROTATED, "ka")}) == {"a": rotator.FAILED}
+    fb.post_object_store_access_keys.assert_not_called()
+
+
+@patch("cobalt_purestorage.rotator.update_credentials")
+def test_apply_claim_lost(mock_update):
+    """Test no keys are created once the users' lease is lost"""
+
+    claim = SimpleNamespace(name="batch-0", held=True)
+
+    def delete(key_names):
+        # another replica took the lease over during the deletions
+        claim.held = False
+        return True
+
+    fb = Mock()
+    fb.delete_object_store_access_keys.side_effect = delete
+    planned = {
+        "a": (rotator.ROTATED, "ka"),
+        "b": (rotator.CREATED, None),
+        "c": (rotator.SKIPPED, None),
+    }
+
+    assert rotator.apply(fb, planned, claim=claim) == {
+        "a": rotator.SKIPPED,
+        "b": rotator.SKIPPED,
+        "c": rotator.SKIPPED,
+    }
+    fb.post_object_store_access_keys.assert_not_called()
+
+    # and nothing is deleted when the lease was lost before starting
+    fb.reset_mock()
+    assert rotator.apply(fb, planned, claim=claim)["a"] == rotator.SKIPPED
+    fb.delete_object_store_access_keys.assert_not_called()
+
+
+def test_update_state_claim_lost():
+    """Test keyless users left to a lease's new holder are not recorded"""
+
+    claim = SimpleNamespace(name="batch-0", held=False)
+    inventory = {"new": [], "old": [AccessKey("k1", 5000)]}
+    planned = {"new": (rotator.CREATED, None), "old": (rotator.CREATED, None)}
+    store = Mock()
+
+    outcomes = rotator.apply(None, planned, claim=claim)
+    rotator.update_state(store, outcomes, inventory, time.time())
+
+    store.record.assert_called_once_with("old", 5.0, store.record.call_args.args[2])
+    store.forget.assert_not_called()
+
+
+@patch("cobalt_purestorage.configuration.config.interesting_users", {"a", "b", "c"})
+@patch("cobalt_purestorage.configuration.config.k8s_mode", True)
+@patch("cobalt_purestorage.rotator.missing_secret_users", Mock(return_value=["c"]))
+@patch("cobalt_purestorage.rotator.PureStorageFlashBlade")
+def test_dry_run(mock_fb):
+    """Test the dry run prints the plan without changing anything"""
+
+    fb = mock_fb.return_value
+    fb.get_object_store_users_by_name.return_value = {"a"}
+    fb.get_access_keys_for_users.return_value = {}
+
+    assert rotator.dry_run() == [
+        "a: create a key",
+        "b: skip, user does not exist",
+        "c: skip, secret does not exist",
+    ]
+    fb.delete_object_store_access_keys.assert_not_called()
+    fb.post_object_store_access_keys.assert_not_called()
+
+
+@patch("cobalt_purestorage.configuration.config.interesting_users", {"d"})
+@patch("cobalt_purestorage.configuration.config.k8s_mode", False)
+@patch("cobalt_purestorage.configuration.config.fb_arrays", ARRAYS[1:2])
+@patch("cobalt_purestorage.rotator.PureStorageFlashBlade")
+def test_dry_run_arrays(mock_fb):
+    """Test the dry run plans each array"""
+
+    fb = mock_fb.return_value
+    fb.get_object_store_users_by_name.return_value = {"d"}
+    fb.get_access_keys_for_users.return_value = {
+        "d": [AccessKey("k1", 0), AccessKey("k2", 1000)]
+    }
+
+    assert rotator.dry_run() == [
+        "Array: second",
+        "  d: delete key k1, then create a key",
+    ]
+    mock_fb.assert_called_with("fb02", "two", 30, "second")
+
+
+@patch("cobalt_purestorage.configuration.config.access_key_min_age", 3600)
+@patch("cobalt_purestorage.configuration.config.access_key_age_variance", 0)
+@patch("cobalt_purestorage.configuration.config.k8s_mode", False)
+@patch("cobalt_purestorage.rotator.update_credentials")
+def test_rotate_users_state(mock_update, tmp_path):
+    """Test users recorded in the state file as too young are not looked up"""
+
+    fb = Mock()
+    fb.name = "fb01"
+    fb.get_object_store_users_by_name.side_effect = set
+    fb.get_access_keys_for_users.return_value = {
+        "young": [AccessKey("k1", int(time.time() - 60) * 1000)],
+    }
+    fb.post_object_store_access_keys.return_value = AccessKey(
+        "new", secret_access_key="secret"
+    )
+
+    with patch(
+        "cobalt_purestorage.configuration.config.state_file",
+        str(tmp_path / "state.json"),
+    ):
+        first, _, _ = rotator.rotate_users(["young", "new"], fb)
+        fb.reset_mock()
+        second, inventory, not_due = rotator.rotate_users(["young", "new", "other"], fb)
+
+    assert first == {"young": rotator.SKIPPED, "new": rotator.CREATED}
+    assert second == {
+        "young": rotator.SKIPPED,
+        "new": rotator.SKIPPED,
+        "other": rotator.CREATED,
+    }
+    assert list(inventory) == ["other"]
+    assert set(not_due) == {"new", "young"}
+    fb.get_object_store_users_by_name.assert_called_once_with({"other"})
+
+
+SHARD_USERS = {f"u{i}" for i in range(20)}
+
+
+@patch("cobalt_purestorage.configuration.config.interesting_users", SHARD_USERS)
+@patch("cobalt_purestorage.configuration.config.shard_count", 2)
+@patch("cobalt_purestorage.configuration.config.shard_index", 1)
+@patch("cobalt_purestorage.rotator.rotate_users")
+def test_main_sharded(mock_rotate):
+    """Test main only rotates the users owned by its shard"""
+
+    mock_rotate.return_value = {}, {}, {}
+
+    rotator.main()
+
+    owned = mock_rotate.call_args.args[0]
+    assert owned and owned < SHARD_USERS
+    assert all(sharding.shard_of(x, 2) == 1 for x in owned)
+
+
+@patch("cobalt_purestorage.configuration.config.interesting_users", SHARD_USERS)
+@patch("cobalt_purestorage.configuration.config.lease_mode", True)
+@patch("cobalt_purestorage.leases.claimed_batches")
+@patch("cobalt_purestorage.rotator.PureStorageFlashBlade")
+@patch("cobalt_purestorage.rotator.rotate_users")
+def test_main_leased(mock_rotate, mock_fb, mock_claimed):
+    """Test only the claimed batches are rotated, and summarised together"""
+
+    mock_fb.return_value.name = "fb01"
+    mock_claimed.return_value = (x for x in [({"u1", "u2"}, "c1"), ({"u3"}, "c2")])
+    mock_rotate.side_effect = [
+        ({"u1": rotator.ROTATED, "u2": rotator.SKIPPED}, {}, {}),
+        ({"u3": rotator.FAILED}, {}, {}),
+    ]
+
+    summary = rotator.main()
+
+    mock_claimed.assert_called_once_with(SHARD_USERS, "fb01")
+    assert [x.args for x in mock_rotate.call_args_list] == [
+        ({"u1", "u2"}, mock_fb.return_value, "c1", False),
+        ({"u3"}, mock_fb.return_value, "c2", False),
+    ]
+    assert summary == {
+        rotator.ROTATED: ["u1"],
+        rotator.SKIPPED: ["u2"],
+        rotator.FAILED: ["u3"],
+    }
+
+
+@patch("cobalt_purestorage.configuration.config.interesting_users", set())
+@patch("cobalt_purestorage.configuration.config.users_file_batch_size", 2)
+@patch("cobalt_purestorage.rotator.PureStorageFlashBlade")
+@patch("cobalt_purestorage.rotator.update_credentials")
+def test_main_users_file(mock_update, mock_fb, tmp_path):
+    """Test USERS_FILE users are rotated a batch at a time,
+    each with its own key age policy
+    """
+
+    users_file = tmp_path / "users.ndjson"
+    users_file.write_text(
+        '"old"\n{"name": "young", "access_key_min_age": 7200}\n"new"\n'
+    )
+
+    hour_ago = (time.time() - 3600) * 1000
+    keys = {
+        "old": [AccessKey("k1", hour_ago)],
+        "young": [AccessKey("k2", hour_ago)],
+        "new": [],
+    }
+
+    fb = mock_fb.return_value
+    fb.name = "fb01"
+    fb.get_object_store_users_by_name.side_effect = set
+    fb.get_access_keys_for_users.side_effect = lambda x: {y: keys[y] for y in x}
+    fb.post_object_store_access_keys.return_value = AccessKey(
+        "new-key", secret_access_key="pytest"
+    )
+
+    with patch(
+        "cobalt_purestorage.configuration.config.users_file", str(users_file)
+    ), patch("cobalt_purestorage.configuration.config.access_key_min_age", 1800):
+        summary = rotator.main()
+
+    assert summary == {
+        rotator.CREATED: ["new", "old"],
+        rotator.SKIPPED: ["young"],
+    }
+    assert fb.get_object_store_users_by_name.call_count == 2
+    mock_fb.assert_called_once()
+    assert inventory._entries == {}
+
+
+@patch("cobalt_purestorage.configuration.config.interesting_users", set())
+@patch("cobalt_purestorage.configuration.config.discover_users", ["account/*"])
+@patch("cobalt_purestorage.configuration.config.discover_exclude", [])
+@patch("cobalt_purestorage.rotator.PureStorageFlashBlade")
+@patch("cobalt_purestorage.rotator.rotate_claimed")
+@pytest.mark.parametrize(
+    "lease_mode,expected",
+    [
+        (False, [({"account/a", "account/b"}, 0), ({"account/c"}, 1)]),
+        (True, [({"account/a", "account/b", "account/c"}, None)]),
+    ],
+)
+def test_main_discovered(mock_rotate, mock_fb, lease_mode, expected):
+    """Test discovered users are rotated a page at a time, or together
+    in lease mode
+    """
+
+    fb = mock_fb.return_value
+    fb.name = "fb01"
+    fb.list_object_store_users.return_value = iter(
+        [["account/a", "account/b"], ["account/c"]]
+    )
+    mock_rotate.side_effect = lambda x, fb, part, known_existing: {
+        y: rotator.CREATED for y in x
+    }
+
+    with patch("cobalt_purestorage.configuration.config.lease_mode", lease_mode):
+        summary = rotator.main()
+
+    fb.list_object_store_users.assert_called_once_with('name="account/*"')
+    assert [(x.args[0], x.args[2]) for x in mock_rotate.call_args_list] == expected
+    # the users were just listed, so are not looked up again
+    assert all(x.args[3] for x in mock_rotate.call_args_list)
+    assert summary == {rotator.CREATED: ["account/a", "account/b", "account/c"]}
@@ -0,0 +1,35 @@
+""" Test Sharding Module """
+
+from unittest.mock import patch
+
+import pytest
+
+import cobalt_purestorage.sharding as sharding
+
+USERS = [f"account/user{i:04d}" for i in range(1000)]
+
+
+def test_shard_of():
+    """Test the shard is stable across processes and in range"""
+
+    assert sharding.shard_of("account/user0001", 7) == 0
+    assert {sharding.shard_of(x, 7) for x in USERS} == set(range(7))
+
+
+@pytest.mark.parametrize("count", [1, 2, 5])
+def test_owned_users(count):
+    """Test the shards are disjoint, cover every user and are roughly even"""
+
+    shards = [sharding.owned_users(USERS, i, count) for i in range(count)]
+
+    assert set().union(*shards) == set(USERS)
+    assert sum(len(x) for x in shards) == len(USERS)
+    assert all(len(x) > 0.8 * len(USERS) / count for x in shards)
+
+
+@patch("cobalt_purestorage.configuration.config.shard_count", 3)
+@patch("cobalt_purestorage.configuration.config.shard_index", 2)
+def test_owned_users_configured():
+    """Test the configured shard is used by default"""
+
+    assert sharding.owned_users(USERS) == sharding.owned_users(USERS, 2, 3)
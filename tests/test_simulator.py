@@ -0,0 +1,333 @@
+""" Test Simulator Module """
+
+import time
+from unittest.mock import patch
+
+import pytest
+import requests
+
+import cobalt_purestorage.rotator as rotator
+import cobalt_purestorage.simulator as simulator
+from cobalt_purestorage.smoketest import override
+
+USER = {"name": "acc/one", "user": {"name": "acc/one"}, "created": 1}
+
+
+@pytest.mark.parametrize(
+    "expression,expected",
+    [
+        ('name="acc/one"', True),
+        ("name='acc/one'", True),
+        ('name="acc/two"', False),
+        ('name!="acc/two"', True),
+        ('name="acc/*"', True),
+        ('name="other/*"', False),
+        ('name="acc/two" or name="acc/one"', True),
+        ('name="acc/*" and user.name="acc/two"', False),
+        ('not name="acc/two"', True),
+        ('(name="x" or name="acc/one") and not (user.name="y")', True),
+        ('missing.field="x"', False),
+    ],
+)
+def test_parse_filter(expression, expected):
+    """Test the parse_filter function"""
+
+    assert simulator.parse_filter(expression)(USER) == expected
+
+
+@pytest.mark.parametrize(
+    "expression", ['name="a" or', 'name "a"', "name=a", 'name="a")', '(name="a"']
+)
+def test_parse_filter_invalid(expression):
+    """Test the parse_filter function with invalid filters"""
+
+    with pytest.raises(ValueError):
+        simulator.parse_filter(expression)
+
+
+def test_parse_filter_lookup():
+    """Test equality filters are exposed as lookups"""
+
+    predicate = simulator.parse_filter('user.name="a" or user.name="b"')
+
+    assert predicate.lookup == ("user.name", {"a", "b"})
+    assert not hasattr(simulator.parse_filter('name="a*" or name="b"'), "lookup")
+
+
+@pytest.mark.parametrize(
+    "distribution", ["fixed", "uniform", "exponential", "lognormal"]
+)
+def test_latency(distribution):
+    """Test the Latency class"""
+
+    latency = simulator.Latency(distribution, 0.01, 0.005)
+    samples = [latency.sample() for _ in range(2000)]
+
+    assert all(x >= 0 for x in samples)
+    assert sum(samples) / len(samples) == pytest.approx(0.01, rel=0.2)
+    assert simulator.Latency(distribution).sample() == 0
+
+
+def test_latency_invalid():
+    """Test the Latency class with an unknown distribution"""
+
+    with pytest.raises(ValueError):
+        simulator.Latency("normal", 1)
+
+
+def test_token_bucket():
+    """Test the TokenBucket class"""
+
+    bucket = simulator.TokenBucket(2)
+
+    assert bucket.take()
+    assert bucket.take()
+    assert not bucket.take()
+
+    bucket.updated -= 1
+    assert bucket.take()
+
+
+def test_key_limit():
+    """Test a user can have at most two keys"""
+
+    fb = simulator.FlashBladeSimulator()
+    fb.add_user("acc/one", key_ages=(100,))
+
+    body = {"user": {"name": "acc/one"}}
+    fb.create_key({}, body)
+
+    with pytest.raises(simulator.SimulatorError) as err:
+        fb.create_key({}, body)
+    assert err.value.status == 400
+
+    with pytest.raises(simulator.SimulatorError):
+        fb.create_key({}, {"user": {"name": "acc/missing"}})
+
+
+def test_delete_keys():
+    """Test deleting keys"""
+
+    fb = simulator.FlashBladeSimulator()
+    fb.add_user("acc/one", key_ages=(100, 200))
+    names = list(fb.user_keys["acc/one"])
+
+    with pytest.raises(simulator.SimulatorError):
+        fb.delete_keys({"names": [f"{names[0]},missing"]})
+
+    fb.delete_keys({"names": [names[0]]})
+
+    assert list(fb.keys) == [names[1]]
+    assert fb.user_keys["acc/one"] == [names[1]]
+
+
+def test_pagination():
+    """Test listing users a page at a time"""
+
+    fb = simulator.FlashBladeSimulator(max_page_size=4)
+    fb.populate(10, "acc/user")
+
+    names = []
+    params = {"limit": ["3"], "filter": ['name="acc/user*"']}
+    while True:
+        page = fb.list_users(params)
+        assert page["total_item_count"] == 10
+        names.extend(x["name"] for x in page["items"])
+        if not page["continuation_token"]:
+            break
+        params["continuation_token"] = [f"'{page['continuation_token']}'"]
+
+    assert names == sorted(fb.users)
+    assert len(fb.list_users({"limit": ["100"]})["items"]) == 4
+
+    # the token is only accepted quoted, as the SDK sends it
+    token = fb.list_users({"limit": ["3"]})["continuation_token"]
+    with pytest.raises(simulator.SimulatorError):
+        fb.list_users({"limit": ["3"], "continuation_token": [token]})
+
+
+def test_list_keys_filter():
+    """Test listing keys by user name"""
+
+    fb = simulator.FlashBladeSimulator()
+    fb.populate(5, "acc/user", key_ages=(100,))
+
+    page = fb.list_keys({"filter": ['user.name="acc/user00001"']})
+
+    assert [x["user"]["name"] for x in page["items"]] == ["acc/user00001"]
+    assert "secret_access_key" not in page["items"][0]
+
+
+def test_list_users_names():
+    """Test listing users by name fails if any do not exist"""
+
+    fb = simulator.FlashBladeSimulator()
+    fb.populate(2, "acc/user")
+
+    page = fb.list_users({"names": ["acc/user00001"]})
+    assert [x["name"] for x in page["items"]] == ["acc/user00001"]
+
+    with pytest.raises(simulator.SimulatorError):
+        fb.list_users({"names": ["acc/user00001,acc/missing"]})
+
+
+def test_login():
+    """Test exchanging an api token for a session"""
+
+    fb = simulator.FlashBladeSimulator(api_token="token")
+
+    with pytest.raises(simulator.SimulatorError):
+        fb.login("wrong")
+
+    assert fb.authenticated(fb.login("token"))
+    assert not fb.authenticated("wrong")
+
+
+def login(url, token="token"):
+    resp = requests.post(
+        f"https://{url}/api/login", headers={"api-token": token}, verify=False
+    )
+    return {"x-auth-token": resp.headers["x-auth-token"]}
+
+
+def test_http_throttling():
+    """Test throttled calls are rejected with rate limit headers"""
+
+    fb = simulator.FlashBladeSimulator(rate_limit=1)
+
+    with simulator.running(fb) as url:
+        headers = login(url)
+        statuses = [
+            requests.get(
+                f"https://{url}/api/2.8/object-store-users",
+                headers=headers,
+                verify=False,
+            )
+            for _ in range(3)
+        ]
+
+    assert statuses[0].status_code == 200
+    assert statuses[-1].status_code == 429
+    assert statuses[-1].headers["X-RateLimit-Remaining-minute"] == "1"
+
+
+def test_http_errors():
+    """Test injected errors, authentication and unknown endpoints"""
+
+    fb = simulator.FlashBladeSimulator(error_rate=1, error_status=503)
+
+    with simulator.running(fb) as url:
+        unauthenticated = requests.get(
+            f"https://{url}/api/2.8/object-store-users", verify=False
+        )
+        headers = login(url)
+        failed = requests.get(
+            f"https://{url}/api/2.8/object-store-users", headers=headers, verify=False
+        )
+        missing = requests.get(f"https://{url}/api/other", verify=False)
+
+    assert unauthenticated.status_code == 401
+    assert failed.status_code == 503
+    assert failed.json() == {"errors": [{"message": "simulated error"}]}
+    assert missing.status_code == 404
+    assert fb.requests[("GET", "object-store-users", 503)] == 1
+
+
+@patch("cobalt_purestorage.configuration.config.access_key_min_age", 3600)
+@patch("cobalt_purestorage.configuration.config.access_key_age_variance", 0)
+@patch("cobalt_purestorage.configuration.config.k8s_mode", False)
+@patch("cobalt_purestorage.configuration.config.fb_filter_chunk_size", 3)
+def test_rotate_users(tmp_path):
+    """Test rotating users through pypureclient against the simulator"""
+
+    from cobalt_purestorage.pure_storage import PureStorageFlashBlade
+
+    fb = simulator.FlashBladeSimulator(api_token="token")
+    fb.populate(3, "acc/new")
+    fb.populate(3, "acc/old", key_ages=(7200, 5000))
+    fb.populate(2, "acc/young", key_ages=(100,))
+    old_keys = {x for y in fb.users if y.startswith("acc/old") for x in fb.user_keys[y]}
+
+    with simulator.running(fb) as url, override(
+        fb_url=url,
+        api_token="token",
+        verify_fb_tls=False,
+        credentials_output_path=str(tmp_path / "credentials.json"),
+    ):
+        outcomes, _, _ = rotator.rotate_users(
+            [*fb.users, "acc/missing"], PureStorageFlashBlade()
+        )
+
+    assert rotator.summarise(outcomes) == {
+        rotator.CREATED: ["acc/new00000", "acc/new00001", "acc/new00002"],
+        rotator.ROTATED: ["acc/old00000", "acc/old00001", "acc/old00002"],
+        rotator.SKIPPED: ["acc/young00000", "acc/young00001"],
+        rotator.INVALID: ["acc/missing"],
+    }
+    assert all(len(x) == 2 for name, x in fb.user_keys.items() if "old" in name)
+    assert len(old_keys - set(fb.keys)) == 3
+    assert max(x["created"] for x in fb.keys.values()) <= time.time() * 1000
+
+
+@patch("cobalt_purestorage.resilience.time.sleep")
+@patch("cobalt_purestorage.configuration.config.fb_retry_attempts", 3)
+@patch("cobalt_purestorage.configuration.config.fb_circuit_failure_threshold", 10)
+def test_retries_server_errors(mock_sleep):
+    """Test each attempt is a single request, so a key is never
+    created twice by pypureclient resending the POST
+    """
+
+    from cobalt_purestorage.pure_storage import PureStorageFlashBlade
+
+    fb = simulator.FlashBladeSimulator(
+        api_token="token", error_rate=1, error_status=503
+    )
+    fb.populate(1, "acc/user")
+
+    with simulator.running(fb) as url, override(
+        fb_url=url, api_token="token", verify_fb_tls=False
+    ):
+        client = PureStorageFlashBlade()
+        assert client.post_object_store_access_keys("acc/user00000") is None
+        assert client.get_access_keys_for_user("acc/user00000") is None
+
+    assert fb.requests[("POST", "object-store-access-keys", 503)] == 1
+    assert fb.requests[("GET", "object-store-access-keys", 503)] == 3
+
+
+def test_session_expired():
+    """Test a call made with an expired session logs in again"""
+
+    from cobalt_purestorage.pure_storage import PureStorageFlashBlade
+
+    fb = simulator.FlashBladeSimulator(api_token="token")
+    fb.populate(1, "acc/user")
+
+    with simulator.running(fb) as url, override(
+        fb_url=url, api_token="token", verify_fb_tls=False
+    ):
+        client = PureStorageFlashBlade()
+        fb.sessions.clear()
+
+        assert client.post_object_store_access_keys("acc/user00000")
+
+    assert fb.requests[("POST", "object-store-access-keys", 401)] == 1
+    assert fb.requests[("POST", "object-store-access-keys", 200)] == 1
+
+
+def test_pages():
+    """Test listings follow the continuation token through pypureclient"""
+
+    from cobalt_purestorage.pure_storage import PureStorageFlashBlade
+
+    fb = simulator.FlashBladeSimulator(api_token="token")
+    fb.populate(5, "acc/user")
+
+    with simulator.running(fb) as url, override(
+        fb_url=url, api_token="token", verify_fb_tls=False
+    ):
+        client = PureStorageFlashBlade()
+        users = [x.name for x in client.object_store_users('name="acc/*"', limit=2)]
+
+    assert users == sorted(fb.users)
+    assert fb.requests[("GET", "object-store-users", 200)] == 3
@@ -0,0 +1,170 @@
+""" Test Smoketest Module """
+
+import json
+from unittest.mock import patch
+
+import pytest
+
+import cobalt_purestorage.smoketest as smoketest
+from cobalt_purestorage.configuration import config
+
+IMPORTTIME_OUTPUT = """import time: self [us] | cumulative | imported package
+import time:       120 |        120 |   _io
+import time:      1500 |       2500 |     cobalt_purestorage.configuration
+import time:       300 |       3000 |   cobalt_purestorage.cli
+import time:       400 |     440000 | kubernetes
+"""
+
+
+def test_parse_importtime():
+    """Test the parse_importtime function"""
+
+    times = smoketest.parse_importtime(
+        IMPORTTIME_OUTPUT, ("cobalt_purestorage.cli", "kubernetes", "missing")
+    )
+
+    assert times == {"cobalt_purestorage.cli": 0.003, "kubernetes": 0.44}
+
+
+def test_time_imports():
+    """Test the time_imports function"""
+
+    times = smoketest.time_imports(("json", "cobalt_purestorage.configuration"))
+
+    assert set(times) == {"json", "cobalt_purestorage.configuration"}
+    assert all(x > 0 for x in times.values())
+
+
+def test_time_imports_isolated():
+    """Test each module is timed in an interpreter of its own, so none is
+    timed as already imported
+    """
+
+    times = smoketest.time_imports(
+        ("cobalt_purestorage.rotator", "cobalt_purestorage.configuration")
+    )
+
+    # the rotator imports configuration, which would then cost nothing
+    assert times["cobalt_purestorage.configuration"] > 0.001
+
+
+def test_time_imports_error():
+    """Test the time_imports function with a module that does not exist"""
+
+    with pytest.raises(RuntimeError):
+        smoketest.time_imports(("cobalt_purestorage.missing",))
+
+
+@pytest.mark.parametrize(
+    "results,expected",
+    [
+        ({"a": 1.0, "b": 0.001}, []),
+        ({"a": 3.5, "b": 0.001}, ["a"]),
+        ({"a": 1.0, "b": 0.005}, []),
+        ({"a": 1.0, "b": 0.02}, ["b"]),
+        ({"a": 1.0, "c": 100}, []),
+    ],
+)
+def test_regressions(results, expected):
+    """Test the regressions function"""
+
+    baseline = {"a": 1.0, "b": 0.001}
+
+    assert smoketest.regressions(results, baseline, 3.0) == expected
+
+
+@pytest.mark.parametrize(
+    "interpreter_start,expected",
+    [(0.05, ["a"]), (0.1, []), (0.2, []), (0.01, ["a"])],
+)
+def test_regressions_relative(interpreter_start, expected):
+    """Test the baseline is scaled to the speed of the host"""
+
+    baseline = {"interpreter_start": 0.05, "a": 1.0}
+    results = {"interpreter_start": interpreter_start, "a": 3.5}
+
+    assert smoketest.regressions(results, baseline, 3.0) == expected
+
+
+def test_override():
+    """Test the override context manager restores settings"""
+
+    fb_url = config.fb_url
+
+    with smoketest.override(fb_url="override"):
+        assert config.fb_url == "override"
+
+    assert config.fb_url == fb_url
+
+
+def test_time_flashblade_client():
+    """Test creating a FlashBlade client against the simulator"""
+
+    with patch("cobalt_purestorage.pure_storage.PureStorageFlashBlade") as mock:
+        mock.side_effect = lambda: mock.calls.append(config.fb_url)
+        mock.calls = []
+
+        assert smoketest.time_flashblade_client(2) >= 0
+
+    assert len(mock.calls) == 3
+    assert mock.calls[0].startswith("127.0.0.1:")
+
+
+def test_time_k8s_client():
+    """Test creating a kubernetes client from the stand-in kubeconfig"""
+
+    assert smoketest.time_k8s_client(2) >= 0
+
+
+@patch("cobalt_purestorage.configuration.config.smoketest_repeat", 1)
+@patch("cobalt_purestorage.smoketest.measure")
+def test_main(mock_measure, tmp_path):
+    """Test the main function passes within the baseline"""
+
+    baseline = tmp_path / "baseline.json"
+    baseline.write_text(json.dumps({"settings": 0.001}))
+    mock_measure.return_value = {"settings": 0.002}
+
+    with smoketest.override(smoketest_baseline=str(baseline)):
+        assert smoketest.main() == {"settings": 0.002}
+
+    mock_measure.assert_called_with(1)
+
+
+@patch("cobalt_purestorage.smoketest.measure")
+def test_main_regression(mock_measure, tmp_path):
+    """Test the main function fails when a timing exceeds the baseline"""
+
+    baseline = tmp_path / "baseline.json"
+    baseline.write_text(json.dumps({"settings": 0.001}))
+    mock_measure.return_value = {"settings": 0.5}
+
+    with smoketest.override(smoketest_baseline=str(baseline)):
+        with pytest.raises(RuntimeError):
+            smoketest.main()
+
+
+@patch("cobalt_purestorage.smoketest.measure")
+def test_main_write_baseline(mock_measure, tmp_path):
+    """Test the main function writes a new baseline"""
+
+    baseline = tmp_path / "baseline.json"
+    mock_measure.return_value = {"settings": 0.1234567}
+
+    smoketest.main(str(baseline))
+
+    assert json.loads(baseline.read_text()) == {"settings": 0.123457}
+
+
+def test_packaged_baseline():
+    """Test the packaged baseline covers every timing"""
+
+    baseline = smoketest.load_baseline(smoketest.BASELINE_PATH)
+
+    expected = {f"import {x}" for x in smoketest.IMPORTED_MODULES} | {
+        "interpreter_start",
+        "settings",
+        "flashblade_client",
+        "k8s_client",
+    }
+    assert set(baseline) == expected
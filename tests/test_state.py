@@ -0,0 +1,73 @@
+""" Test Rotation State Module """
+
+import json
+import logging
+from unittest.mock import patch
+
+import pytest
+
+import cobalt_purestorage.state as state
+
+NOW = 1_700_000_000
+
+
+@patch("cobalt_purestorage.configuration.config.access_key_min_age", 3600)
+@patch("cobalt_purestorage.configuration.config.access_key_age_variance", 600)
+@patch("cobalt_purestorage.configuration.config.state_max_age", 86400)
+def test_not_due(tmp_path):
+    """Test only users with a fresh record of a young key are not due"""
+
+    store = state.RotationState(str(tmp_path / "state.json"), "fb01")
+    store.record("young", NOW - 2999, NOW - 60)
+    store.record("old", NOW - 3000, NOW - 60)
+    store.record("stale", NOW - 100, NOW - 86400)
+    store.forget("missing")
+
+    assert store.not_due(["young", "old", "stale", "missing"], NOW) == {
+        "young": NOW - 2999
+    }
+
+
+def test_save(tmp_path):
+    """Test each array's records are saved without overwriting the others"""
+
+    path = str(tmp_path / "state.json")
+
+    first = state.RotationState(path, "fb01")
+    second = state.RotationState(path, "fb02")
+    first.record("a", NOW - 100, NOW, published=NOW)
+    second.record("b", NOW - 200, NOW)
+    first.save()
+    second.save()
+
+    assert state.RotationState(path, "fb01").users == {
+        "a": {"newest_key": NOW - 100, "checked": NOW, "published": NOW}
+    }
+    assert state.RotationState(path, "fb02").users == {
+        "b": {"newest_key": NOW - 200, "checked": NOW}
+    }
+    assert list(tmp_path.iterdir()) == [tmp_path / "state.json"]
+
+
+@pytest.mark.parametrize("content", ["{not json", '{"version": 0, "arrays": {}}'])
+def test_read_state_ignored(tmp_path, content, caplog):
+    """Test unreadable and incompatible state files are ignored"""
+
+    path = tmp_path / "state.json"
+    path.write_text(content)
+
+    with caplog.at_level(logging.WARNING):
+        assert state.read_state(str(path)) == {}
+
+    assert "Ignoring" in caplog.text
+
+
+def test_save_failure(tmp_path, caplog):
+    """Test a state file that cannot be written is logged, not raised"""
+
+    store = state.RotationState(str(tmp_path / "missing" / "state.json"), "fb01")
+
+    with caplog.at_level(logging.ERROR):
+        store.save()
+
+    assert "Could not write state file" in caplog.text
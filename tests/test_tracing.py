@@ -0,0 +1,134 @@
+""" Test Tracing Module """
+
+import json
+import threading
+import time
+from unittest.mock import Mock, patch
+
+import pytest
+
+import cobalt_purestorage.rotator as rotator
+import cobalt_purestorage.tracing as tracing
+from cobalt_purestorage.models import AccessKey
+
+
+def read_spans(path):
+    with open(path) as f:
+        return {x["name"]: x for x in map(json.loads, f)}
+
+
+def read_user_spans(path):
+    with open(path) as f:
+        return {
+            x["attributes"]["user"]: x
+            for x in map(json.loads, f)
+            if x["name"] == "rotate_user"
+        }
+
+
+@patch("cobalt_purestorage.configuration.config.tracing_exporter", None)
+def test_disabled():
+    """Test tracing is a no-op when disabled"""
+
+    def func():
+        pass
+
+    with tracing.span("disabled", user="a") as span:
+        span.set_attribute("outcome", "b")
+
+    assert span is tracing.NOOP_SPAN
+    assert tracing.propagate(func) is func
+
+
+def in_thread():
+    with tracing.span("thread"):
+        pass
+
+
+@patch("cobalt_purestorage.configuration.config.tracing_exporter", "jsonl")
+def test_jsonl(tmp_path):
+    """Test spans are written as JSON lines, children linked to parents"""
+
+    path = tmp_path / "traces.jsonl"
+
+    with patch("cobalt_purestorage.configuration.config.tracing_file", str(path)):
+        with tracing.span("parent", users=2):
+            with tracing.span("child") as span:
+                span.set_attribute("outcome", "rotated")
+
+            with pytest.raises(ValueError):
+                with tracing.span("failed"):
+                    raise ValueError("broken")
+
+            thread = threading.Thread(target=tracing.propagate(in_thread))
+            thread.start()
+            thread.join()
+
+    spans = read_spans(path)
+    parent = spans["parent"]
+
+    assert parent["parent_span_id"] is None
+    assert parent["attributes"] == {"users": 2}
+    assert spans["child"]["attributes"] == {"outcome": "rotated"}
+    assert spans["failed"]["status"] == "error"
+    assert spans["failed"]["attributes"]["exception"] == "ValueError: broken"
+    for name in ("child", "failed", "thread"):
+        assert spans[name]["trace_id"] == parent["trace_id"]
+        assert spans[name]["parent_span_id"] == parent["span_id"]
+
+
+@patch("cobalt_purestorage.configuration.config.tracing_exporter", "otlp")
+@patch.dict("sys.modules", {"opentelemetry.exporter.otlp.proto.http": None})
+def test_otlp_missing():
+    """Test the otlp exporter needs the tracing extra"""
+
+    with pytest.raises(RuntimeError):
+        tracing.span("missing")
+
+
+@patch("cobalt_purestorage.configuration.config.tracing_exporter", "jsonl")
+@patch("cobalt_purestorage.configuration.config.access_key_min_age", 3600)
+@patch("cobalt_purestorage.configuration.config.access_key_age_variance", 0)
+@patch("cobalt_purestorage.configuration.config.k8s_mode", False)
+@patch("cobalt_purestorage.configuration.config.rotation_concurrency", 2)
+@patch("cobalt_purestorage.rotator.update_local")
+def test_rotate_users(mock_update, tmp_path):
+    """Test the run is traced, with a span per user listed"""
+
+    path = tmp_path / "traces.jsonl"
+    fb = Mock()
+    fb.name = "fb01"
+    fb.get_object_store_users_by_name.return_value = {"a", "c"}
+    fb.get_access_keys_for_users.return_value = {
+        "a": [AccessKey("k1", 0), AccessKey("k2", 1000)],
+        "c": [AccessKey("k4", int(time.time() * 1000))],
+    }
+    fb.post_object_store_access_keys.return_value = AccessKey(
+        "k3", secret_access_key="secret"
+    )
+
+    with patch("cobalt_purestorage.configuration.config.tracing_file", str(path)):
+        rotator.rotate_users(["a", "b", "c"], fb)
+
+    spans = read_spans(path)
+    users = read_user_spans(path)
+    run = spans["rotate_users"]
+    user = users["a"]
+
+    assert run["attributes"] == {
+        "array": "fb01",
+        "users": 3,
+        "not_due": 0,
+        "invalid": 1,
+        "rotated": 1,
+        "skipped": 1,
+    }
+    assert user["attributes"] == {"user": "a", "keys": 2, "outcome": "rotated"}
+    assert users["c"]["attributes"] == {"user": "c", "keys": 1, "outcome": "skipped"}
+    assert "b" not in users
+    assert spans["list_access_keys"]["attributes"] == {"users": 2, "keys": 3}
+    assert spans["delete_access_keys"]["attributes"] == {"keys": 1, "failed": 0}
+    for span in (spans["plan"], spans["delete_access_keys"], user, users["c"]):
+        assert span["parent_span_id"] == run["span_id"]
+    for name in ("create_access_key", "publish"):
+        assert spans[name]["parent_span_id"] == user["span_id"]